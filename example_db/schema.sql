@@ -1,3 +1,9 @@
+DROP TABLE IF EXISTS consumer_offset;
+DROP TABLE IF EXISTS load_checkpoint;
+DROP TABLE IF EXISTS dead_letter;
+DROP TABLE IF EXISTS s3_manifest;
+DROP TABLE IF EXISTS request_rollup;
+DROP TABLE IF EXISTS rating_rollup;
 DROP TABLE IF EXISTS request_interaction;
 DROP TABLE IF EXISTS rating_interaction;
 
@@ -51,22 +57,84 @@ CREATE TABLE request_interaction (
     request_interaction_id BIGINT GENERATED ALWAYS AS IDENTITY,
     exhibition_id SMALLINT,
     request_id SMALLINT,
-    event_at TIMESTAMPTZ,
-    PRIMARY KEY (request_interaction_id),
+    event_at TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (request_interaction_id, event_at),
+    UNIQUE (exhibition_id, request_id, event_at),
     FOREIGN KEY (exhibition_id) REFERENCES exhibition(exhibition_id),
     FOREIGN KEY (request_id) REFERENCES request(request_id)
-);
+) PARTITION BY RANGE (event_at);
+
+CREATE INDEX request_interaction_event_at_brin ON request_interaction USING BRIN (event_at);
 
 CREATE TABLE rating_interaction (
     rating_interaction_id BIGINT GENERATED ALWAYS AS IDENTITY,
     exhibition_id SMALLINT,
     rating_id SMALLINT,
-    event_at TIMESTAMPTZ,
-    PRIMARY KEY (rating_interaction_id),
+    event_at TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (rating_interaction_id, event_at),
+    UNIQUE (exhibition_id, rating_id, event_at),
+    FOREIGN KEY (exhibition_id) REFERENCES exhibition(exhibition_id),
+    FOREIGN KEY (rating_id) REFERENCES rating(rating_id)
+) PARTITION BY RANGE (event_at);
+
+CREATE INDEX rating_interaction_event_at_brin ON rating_interaction USING BRIN (event_at);
+
+CREATE TABLE request_rollup (
+    exhibition_id SMALLINT,
+    event_hour TIMESTAMPTZ,
+    request_id SMALLINT,
+    interaction_count BIGINT NOT NULL,
+    PRIMARY KEY (exhibition_id, event_hour, request_id),
+    FOREIGN KEY (exhibition_id) REFERENCES exhibition(exhibition_id),
+    FOREIGN KEY (request_id) REFERENCES request(request_id)
+);
+
+CREATE TABLE rating_rollup (
+    exhibition_id SMALLINT,
+    event_hour TIMESTAMPTZ,
+    rating_id SMALLINT,
+    interaction_count BIGINT NOT NULL,
+    PRIMARY KEY (exhibition_id, event_hour, rating_id),
     FOREIGN KEY (exhibition_id) REFERENCES exhibition(exhibition_id),
     FOREIGN KEY (rating_id) REFERENCES rating(rating_id)
 );
 
+CREATE TABLE s3_manifest (
+    object_key TEXT,
+    etag TEXT NOT NULL,
+    object_size BIGINT NOT NULL,
+    last_modified TIMESTAMPTZ NOT NULL,
+    processed_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (object_key)
+);
+
+CREATE TABLE consumer_offset (
+    consumer_group TEXT,
+    topic TEXT,
+    topic_partition INT,
+    next_offset BIGINT NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (consumer_group, topic, topic_partition)
+);
+
+CREATE TABLE load_checkpoint (
+    source TEXT,
+    row_offset BIGINT NOT NULL,
+    byte_offset BIGINT,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (source)
+);
+
+CREATE TABLE dead_letter (
+    dead_letter_id BIGINT GENERATED ALWAYS AS IDENTITY,
+    source TEXT NOT NULL,
+    source_key TEXT,
+    reason TEXT NOT NULL,
+    record TEXT NOT NULL,
+    rejected_at TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (dead_letter_id)
+);
+
 INSERT INTO floor(floor_name)
 VALUES 
     ('Vault'),
@@ -0,0 +1,456 @@
+"""Throughput benchmarks for the pipeline against local stand-ins.
+
+S3 is replaced by a moto bucket, kafka by an in-process consumer and the
+database by a fake connection, or a real postgres when a dsn is given.
+Each stage runs in its own process so its peak RSS can be reported."""
+
+from os import environ as ENV, chdir, getcwd
+from csv import writer, reader
+from io import StringIO
+from json import dumps, dump, load
+from time import perf_counter
+from random import Random
+from resource import getrusage, RUSAGE_SELF
+from tempfile import TemporaryDirectory
+from itertools import islice
+from subprocess import run
+from argparse import Namespace, ArgumentParser
+from logging import getLogger, NullHandler
+from unittest.mock import patch
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+
+from boto3 import client
+from moto import mock_aws
+from psycopg2 import connect
+from psycopg2.sql import Composed, Identifier
+
+from consumer import log_message, get_message_data, read_messages
+from dimensions import DimensionCache
+from extract import get_files, get_data_chunks, stream_rows
+from loader import get_batches, group_rows, load_batch
+from transform import read_frames, transform_frame
+
+
+BUCKET = "benchmark_bucket"
+DIMENSIONS = {
+    "rating": [(value, value + 1) for value in range(5)],
+    "request": [(value, value + 1) for value in range(2)],
+    "exhibition": [(f"EXH_0{site}", site + 1) for site in range(6)]
+}
+
+
+class FakeMessage:
+    """Stand-in for a kafka message holding a raw value."""
+
+    def __init__(self, value: bytes, offset: int = 0):
+        """Store raw message value."""
+        self._value = value
+        self._offset = offset
+
+    def value(self) -> bytes:
+        """Return raw message value."""
+        return self._value
+
+    def error(self):
+        """Return no error."""
+        return None
+
+    def topic(self) -> str:
+        """Return topic name."""
+        return "lmnh"
+
+    def partition(self) -> int:
+        """Return partition number."""
+        return 0
+
+    def offset(self) -> int:
+        """Return message offset."""
+        return self._offset
+
+
+class FakeConsumer:
+    """In-process consumer serving messages and timing each batch."""
+
+    def __init__(self, messages: list[FakeMessage]):
+        """Store messages to serve in order."""
+        self.messages = messages
+        self.offset = 0
+        self.calls = []
+
+    def subscribe(self, topics: list[str]) -> None:
+        """Ignore subscription."""
+
+    def consume(self, num_messages: int = 1, timeout: float = -1) -> list[FakeMessage]:
+        """Return the next num_messages messages."""
+        del timeout
+        batch = self.messages[self.offset:self.offset + num_messages]
+        self.offset += len(batch)
+        self.calls.append((perf_counter(), len(batch)))
+        return batch
+
+    def commit(self, *_, **__) -> None:
+        """Ignore offset commits."""
+
+    def assignment(self) -> list:
+        """Return no assigned partitions."""
+        return []
+
+    def position(self, partitions: list) -> list:
+        """Return partitions unchanged."""
+        return partitions
+
+    def close(self) -> None:
+        """Ignore close."""
+
+
+def render(query) -> str:
+    """Return query as text without needing a database connection."""
+    if isinstance(query, str):
+        return query
+    if isinstance(query, Composed):
+        return "".join(render(part) for part in query.seq)
+    if isinstance(query, Identifier):
+        return ".".join(query.strings)
+    return query.string
+
+
+class FakeCursor:
+    """Cursor understanding the statements the loader sends."""
+
+    def __init__(self, conn):
+        """Attach cursor to fake connection."""
+        self.connection = conn
+        self.rowcount = -1
+        self.result = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return False
+
+    def execute(self, query, params=None) -> None:
+        """Run a loader statement against in-memory tables."""
+        text = " ".join(render(query).split())
+        self.result = []
+        self.rowcount = 0
+        if text.startswith("SELECT"):
+            self.result = next((rows for table, rows in DIMENSIONS.items()
+                                if f"FROM {table}" in text), [])
+        elif text.startswith("EXECUTE merge_"):
+            table_name = text.split("merge_")[1].split()[0]
+            self.rowcount = self.connection.insert(
+                table_name, self.connection.staging.pop(table_name, []))
+        elif text.startswith("EXECUTE insert_"):
+            table_name = text.split("insert_")[1].split()[0]
+            self.rowcount = self.connection.insert(
+                table_name, [tuple(str(p) for p in params)])
+
+    def copy_expert(self, query, buffer) -> None:
+        """Stage rows copied from buffer."""
+        table_name = render(query).split()[1].removesuffix("_staging")
+        self.connection.staging.setdefault(table_name, []).extend(
+            tuple(row) for row in reader(buffer))
+
+    def fetchall(self) -> list:
+        """Return result of the last select."""
+        return self.result
+
+
+class FakeConnection:
+    """In-memory database enforcing the interaction unique constraints."""
+
+    def __init__(self):
+        """Start with empty interaction tables."""
+        self.tables = {"rating": set(), "request": set()}
+        self.staging = {}
+
+    def cursor(self) -> FakeCursor:
+        """Return a new cursor."""
+        return FakeCursor(self)
+
+    def insert(self, table_name: str, rows: list[tuple]) -> int:
+        """Return number of rows that were not already present."""
+        table = self.tables[table_name]
+        before = len(table)
+        table.update(rows)
+        return len(table) - before
+
+    def commit(self) -> None:
+        """Empty staging tables as ON COMMIT DELETE ROWS would."""
+        self.staging.clear()
+
+    def rollback(self) -> None:
+        """Empty staging tables."""
+        self.staging.clear()
+
+    def close(self) -> None:
+        """Ignore close."""
+
+
+def get_database(dsn: str = None):
+    """Return a connection to dsn, or a fake database when there is none."""
+    return connect(dsn) if dsn else FakeConnection()
+
+
+def make_history_rows(count: int, seed: int = 0) -> list[list]:
+    """Return count synthetic history rows."""
+    rand = Random(seed)
+    rows = []
+    for i in range(count):
+        val = rand.randint(-1, 4)
+        rows.append([f"2025-{i // 2678400 % 12 + 1:02}-{i // 86400 % 28 + 1:02} "
+                     f"{i // 3600 % 24:02}:{i // 60 % 60:02}:{i % 60:02}",
+                     str(rand.randint(0, 5)), str(val),
+                     f"{rand.randint(0, 1)}.0" if val == -1 else ""])
+    return rows
+
+
+def make_messages(count: int, seed: int = 0) -> list[FakeMessage]:
+    """Return count kafka shaped messages, roughly 1% of them invalid."""
+    rand = Random(seed)
+    messages = []
+    for i in range(count):
+        body = {"at": f"2025-05-14T12:{i // 60 % 60:02}:{i % 60:02}.000000+01:00",
+                "site": str(rand.randint(0, 5)),
+                "val": rand.randint(-1, 4)}
+        if body["val"] == -1:
+            body["type"] = rand.randint(0, 1)
+        if rand.random() < 0.01:
+            del body["site"]
+        messages.append(FakeMessage(dumps(body).encode(), i))
+    return messages
+
+
+def make_bucket(s_client: client, rows: int, files: int) -> None:
+    """Create a bucket holding rows split across files history csvs."""
+    s_client.create_bucket(Bucket=BUCKET)
+    data = make_history_rows(rows)
+    size = -(-rows // files)
+    for i in range(files):
+        buffer = StringIO()
+        w = writer(buffer)
+        w.writerow(['at', 'site', 'val', 'type'])
+        w.writerows(data[i * size:(i + 1) * size])
+        s_client.put_object(Bucket=BUCKET, Key=f"lmnh_hist_data_{i}.csv",
+                            Body=buffer.getvalue().encode())
+
+
+def percentile(samples: list[float], percent: float) -> float:
+    """Return the nearest-rank percentile of samples."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def summarise(rows: int, seconds: float, samples: list[tuple[float, int]]) -> dict:
+    """Return throughput and per-row latency for timed (seconds, rows) samples.
+
+    Latency is amortised over the rows of each sample, as rows are
+    processed a batch at a time."""
+    per_row = [elapsed / count for elapsed, count in samples if count]
+    return {"rows": rows,
+            "seconds": round(seconds, 4),
+            "rows_per_sec": round(rows / seconds, 1) if seconds else 0.0,
+            "p50_row_ms": round(percentile(per_row, 50) * 1000, 6),
+            "p99_row_ms": round(percentile(per_row, 99) * 1000, 6)}
+
+
+def time_batches(batches, work) -> tuple[int, float, list]:
+    """Return (rows, seconds, samples) for pulling each batch and calling work on it."""
+    samples = []
+    rows = 0
+    start = last = perf_counter()
+    for batch in batches:
+        work(batch)
+        now = perf_counter()
+        samples.append((now - last, len(batch)))
+        rows += len(batch)
+        last = now
+    return rows, last - start, samples
+
+
+def bench_extract_files(config: Namespace) -> dict:
+    """Download and collate bucket objects to lmnh_hist_data.csv."""
+    with mock_aws():
+        s_client = client("s3")
+        make_bucket(s_client, config.rows, config.files)
+        start = perf_counter()
+        get_files(s_client, BUCKET, config.workers)
+        seconds = perf_counter() - start
+    rows = sum(len(chunk) for chunk, _ in get_data_chunks(config.batch_size))
+    return summarise(rows, seconds, [(seconds, rows)])
+
+
+def bench_extract_stream(config: Namespace) -> dict:
+    """Stream rows from bucket objects without local files."""
+    with mock_aws():
+        s_client = client("s3")
+        make_bucket(s_client, config.rows, config.files)
+        rows = stream_rows(s_client, BUCKET)
+        return summarise(*time_batches(
+            iter(lambda: list(islice(rows, config.batch_size)), []), lambda _: None))
+
+
+def bench_transform_rows(config: Namespace) -> dict:
+    """Map rows to ids one row at a time."""
+    cache = DimensionCache(get_database(config.dsn))
+    cache.refresh()
+    data = make_history_rows(config.rows)
+    return summarise(*time_batches(get_batches(data, config.batch_size),
+                                   lambda batch: group_rows(batch, cache)))
+
+
+def bench_transform_vectorized(config: Namespace) -> dict:
+    """Map rows to ids a DataFrame chunk at a time."""
+    cache = DimensionCache(get_database(config.dsn))
+    cache.refresh()
+    buffer = StringIO()
+    w = writer(buffer)
+    w.writerow(['at', 'site', 'val', 'type'])
+    w.writerows(make_history_rows(config.rows))
+    buffer.seek(0)
+    frames = list(read_frames(buffer, config.batch_size))
+    return summarise(*time_batches(frames, lambda frame: transform_frame(frame, cache)))
+
+
+def bench_load(config: Namespace) -> dict:
+    """Load batches through staging tables with COPY."""
+    conn = get_database(config.dsn)
+    cache = DimensionCache(conn)
+    data = make_history_rows(config.rows)
+    result = summarise(*time_batches(get_batches(data, config.batch_size),
+                                     lambda batch: load_batch(conn, batch, cache)))
+    conn.close()
+    return result
+
+
+def bench_stream(config: Namespace) -> dict:
+    """Consume, validate and load kafka messages in batches."""
+    from pipeline import upload_data_from_cluster  # pylint:disable=import-outside-toplevel
+    conn = get_database(config.dsn)
+    cons = FakeConsumer(make_messages(config.messages))
+    with patch("pipeline.get_consumer", return_value=cons), \
+            patch.dict(ENV, {"TOPIC": "lmnh", "GROUP": "benchmark"}):
+        start = perf_counter()
+        upload_data_from_cluster(conn, config.messages, DimensionCache(conn),
+                                 config.batch_size, 60)
+        seconds = perf_counter() - start
+    samples = [(end - begin, count) for (begin, count), (end, _)
+               in zip(cons.calls, cons.calls[1:] + [(start + seconds, 0)])]
+    conn.close()
+    return summarise(config.messages, seconds, samples)
+
+
+def bench_parse_messages(config: Namespace) -> dict:
+    """Decode and validate messages with read_messages."""
+    messages = make_messages(config.messages)
+    return summarise(*time_batches(get_batches(messages, config.batch_size), read_messages))
+
+
+def bench_parse_messages_two_step(config: Namespace) -> dict:
+    """Decode and validate messages with log_message and get_message_data."""
+    messages = make_messages(config.messages)
+
+    def parse(batch):
+        for message in batch:
+            log_message(message)
+            get_message_data(message)
+    return summarise(*time_batches(get_batches(messages, config.batch_size), parse))
+
+
+STAGES = {
+    "extract_files": bench_extract_files,
+    "extract_stream": bench_extract_stream,
+    "transform_rows": bench_transform_rows,
+    "transform_vectorized": bench_transform_vectorized,
+    "load": bench_load,
+    "stream": bench_stream,
+    "parse_messages": bench_parse_messages,
+    "parse_messages_two_step": bench_parse_messages_two_step
+}
+
+
+def run_stage(name: str, config: Namespace) -> dict:
+    """Return results of stage ran in a fresh directory with quiet logging."""
+    ENV.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+    ENV.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+    ENV.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    logger = getLogger("etl_logger")
+    logger.handlers = [NullHandler()]
+    logger.propagate = False
+    cwd = getcwd()
+    with TemporaryDirectory() as directory:
+        chdir(directory)
+        try:
+            result = STAGES[name](config)
+        finally:
+            chdir(cwd)
+    result["peak_rss_mb"] = round(getrusage(RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return result
+
+
+def run_benchmarks(config: Namespace) -> dict:
+    """Return results of every selected stage, each ran in its own process."""
+    results = {}
+    for name in config.stages:
+        with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+            results[name] = pool.submit(run_stage, name, config).result()
+    commit = run(["git", "rev-parse", "--short", "HEAD"],
+                 capture_output=True, text=True, check=False)
+    return {"commit": commit.stdout.strip() or None,
+            "config": {k: v for k, v in vars(config).items()
+                       if k not in ("output", "compare", "dsn")},
+            "stages": results}
+
+
+def print_results(results: dict, baseline: dict = None) -> None:
+    """Print a table of results, with the change against baseline when given."""
+    print(f"{'stage':<26}{'rows/sec':>14}{'p50 ms':>12}{'p99 ms':>12}{'rss MB':>10}"
+          + (f"{'vs base':>10}" if baseline else ""))
+    for name, stage in results["stages"].items():
+        line = (f"{name:<26}{stage['rows_per_sec']:>14,.0f}{stage['p50_row_ms']:>12.4f}"
+                f"{stage['p99_row_ms']:>12.4f}{stage['peak_rss_mb']:>10.1f}")
+        base = (baseline or {}).get("stages", {}).get(name)
+        if base and base["rows_per_sec"]:
+            line += f"{stage['rows_per_sec'] / base['rows_per_sec']:>9.2f}x"
+        print(line)
+
+
+def get_arguments() -> Namespace:
+    """Return arguments from cli."""
+    parser = ArgumentParser(description="Run pipeline throughput benchmarks.")
+    parser.add_argument('-r', '--rows', type=int, default=100000,
+                        help='Number of synthetic history rows.')
+    parser.add_argument('-f', '--files', type=int, default=10,
+                        help='Number of history csv objects the rows are split across.')
+    parser.add_argument('-n', '--messages', type=int, default=100000,
+                        help='Number of synthetic kafka messages.')
+    parser.add_argument('--batch-size', type=int, default=10000,
+                        help='Rows per batch for every stage.')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='Download threads for the extract stage.')
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES), default=list(STAGES),
+                        help='Stages to run, all by default.')
+    parser.add_argument('--dsn', type=str,
+                        help='Postgres dsn to load into instead of the fake database.')
+    parser.add_argument('-o', '--output', type=str,
+                        help='File to save results to as json.')
+    parser.add_argument('-c', '--compare', type=str,
+                        help='Json results of a previous run to compare against.')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+    bench = run_benchmarks(args)
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = load(f)
+    print_results(bench, previous)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            dump(bench, f, indent=2)
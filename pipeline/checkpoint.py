@@ -0,0 +1,61 @@
+"""Module for checkpoints recording how far a bulk load has got through its source file."""
+
+from os import path
+from typing import NamedTuple
+from collections.abc import Iterable, Iterator
+
+from psycopg2.extensions import connection, cursor
+
+
+class Checkpoint(NamedTuple):
+    """Position after the last committed batch of a source file."""
+    source: str
+    row_offset: int = 0
+    byte_offset: int = None
+
+
+def get_source_key(file_path: str) -> str:
+    """Return key identifying a collated file by name, size and modification time."""
+    return f"{path.basename(file_path)}:{path.getsize(file_path)}:{int(path.getmtime(file_path))}"
+
+
+def save_checkpoint(curs: cursor, checkpoint: Checkpoint) -> None:
+    """Record checkpoint in the transaction of curs."""
+    curs.execute("""
+        INSERT INTO load_checkpoint (source, row_offset, byte_offset)
+        VALUES (%s, %s, %s)
+        ON CONFLICT (source) DO UPDATE
+        SET row_offset = EXCLUDED.row_offset, byte_offset = EXCLUDED.byte_offset,
+            updated_at = CURRENT_TIMESTAMP
+        """, checkpoint)
+
+
+def get_checkpoints(chunks: Iterable[tuple[list, int]], checkpoint: Checkpoint,
+                    byte_offsets: bool = True) -> Iterator[tuple[list, Checkpoint]]:
+    """Yield (rows, checkpoint after rows) for chunks of (rows, offset after rows),
+    where offsets are byte offsets, or row offsets when byte_offsets is False."""
+    row_offset = checkpoint.row_offset
+    for rows, offset in chunks:
+        row_offset = row_offset + len(rows) if byte_offsets else offset
+        yield rows, checkpoint._replace(row_offset=row_offset,
+                                        byte_offset=offset if byte_offsets else None)
+
+
+def has_checkpoints(conn: connection) -> bool:
+    """Return True if the database has a load_checkpoint table to save checkpoints in."""
+    with conn.cursor() as curs:
+        curs.execute("SELECT 1 FROM pg_tables WHERE tablename = 'load_checkpoint'")
+        exists = bool(curs.fetchall())
+    conn.commit()
+    return exists
+
+
+def get_checkpoint(conn: connection, source: str) -> Checkpoint:
+    """Return the last checkpoint of source, the start of it when there is none."""
+    with conn.cursor() as curs:
+        curs.execute("""
+            SELECT source, row_offset, byte_offset FROM load_checkpoint WHERE source = %s
+            """, (source,))
+        rows = curs.fetchall()
+    conn.commit()
+    return Checkpoint(*rows[0]) if rows else Checkpoint(source)
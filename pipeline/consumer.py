@@ -1,70 +1,174 @@
 """Module for consuming messages from a kafka cluster."""
 
-from json import loads
-import json
 from os import environ as ENV
 import logging
+from time import perf_counter
 from datetime import datetime
+from typing import NamedTuple
 
-from confluent_kafka import Consumer, Message
+from confluent_kafka import Consumer, Producer, Message
 from dotenv import load_dotenv
 
-from logger import get_logger
+from logger import get_logger, is_sampled, MESSAGE_LOGGER, SAMPLED
+from metrics import PARSE_SECONDS, ROWS_VALID, ROWS_INVALID
+from deadletter import reject
 
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads
 
-def get_consumer():
-    """Return a consumer connected to a Kafka cluster defined in environment."""
+
+SITES = frozenset(("0", "1", "2", "3", "4", "5"))
+VALUES = frozenset((-1, 0, 1, 2, 3, 4))
+TYPES = frozenset((0, 1))
+
+
+class MessageRecord(NamedTuple):
+    """Validated message from the kafka cluster, with its event time as stored."""
+    at: str
+    site: str
+    val: int
+    type: int = None
+
+
+def get_cluster_config() -> dict:
+    """Return connection config of the Kafka cluster defined in environment."""
     load_dotenv()
 
-    config = {
+    return {
         'bootstrap.servers': ENV["BOOTSTRAP_SERVERS"],
-        "auto.offset.reset": ENV["AUTO_OFFSET"],
         'security.protocol': ENV["SECURITY_PROTOCOL"],
         'sasl.mechanisms': ENV["SASL_MECHANISM"],
         'sasl.username': ENV["KAFKA_USERNAME"],
-        'sasl.password': ENV["KAFKA_PASSWORD"],
-        'group.id': ENV["GROUP"]
+        'sasl.password': ENV["KAFKA_PASSWORD"]
     }
 
+
+def get_consumer():
+    """Return a consumer connected to a Kafka cluster defined in environment."""
+    config = get_cluster_config()
+    config.update({
+        "auto.offset.reset": ENV["AUTO_OFFSET"],
+        'group.id': ENV["GROUP"],
+        'enable.auto.commit': False
+    })
+
     return Consumer(config)
 
 
-def is_valid_message(message: json) -> tuple[bool, str]:
-    """Return (valid, error) for message."""
-    keys = ['at', 'site', 'val']
-    for k in keys:
+def get_producer() -> Producer:
+    """Return a producer connected to a Kafka cluster defined in environment."""
+    return Producer(get_cluster_config())
+
+
+def validate_message(message: dict) -> tuple[datetime | None, str]:
+    """Return (event time, error) for message, without an event time when it is invalid."""
+    for k in ('at', 'site', 'val'):
         if message.get(k) is None:
-            return (False, f"No key called '{k}'")
+            return (None, f"No key called '{k}'")
 
-    at = message.get('at')
+    at = message['at']
     if not isinstance(at, str):
-        return (False, f"'at' value type is incorrect: {type(at)}")
-    if not bool(datetime.fromisoformat(at)):
-        return (False, f"'at' value is not in accepted format: {at}")
-    site = message.get('site')
-    if not site.isnumeric():
-        return (False, f"'site' value type is incorrect: {type(site)}")
-    if site not in ["0", "1", "2", "3", "4", "5"]:
-        return (False, f"'site' value is not in accepted list of values: {site}")
-    val = message.get('val')
+        return (None, f"'at' value type is incorrect: {type(at)}")
+    try:
+        event_at = datetime.fromisoformat(at)
+    except ValueError:
+        return (None, f"'at' value is not in accepted format: {at}")
+    site = message['site']
+    if not isinstance(site, str) or not site.isnumeric():
+        return (None, f"'site' value type is incorrect: {type(site)}")
+    if site not in SITES:
+        return (None, f"'site' value is not in accepted list of values: {site}")
+    val = message['val']
     if not isinstance(val, int):
-        return (False, f"'val' value type is incorrect: {type(val)}")
-    if val not in [-1, 0, 1, 2, 3, 4]:
-        return (False, f"'val' value is not in accepted list of values: {val}")
+        return (None, f"'val' value type is incorrect: {type(val)}")
+    if val not in VALUES:
+        return (None, f"'val' value is not in accepted list of values: {val}")
 
     if val == -1:
         mes_type = message.get('type')
         if mes_type is None:
-            return (False, "No key called 'type'")
-        if mes_type not in [0, 1]:
-            return (False, f"'type' value type is incorrect: {type(mes_type)}")
+            return (None, "No key called 'type'")
+        if mes_type not in TYPES:
+            return (None, f"'type' value type is incorrect: {type(mes_type)}")
+
+    return (event_at, "Valid message.")
 
-    return (True, "Valid message.")
+
+def is_valid_message(message: dict) -> tuple[bool, str]:
+    """Return (valid, error) for message."""
+    (event_at, err) = validate_message(message)
+    return (event_at is not None, err)
+
+
+def format_event_time(event_at: datetime) -> str:
+    """Return event time as stored by the pipeline, the wall-clock time of the
+    message without its offset or fractions of a second."""
+    return event_at.isoformat(" ", "seconds")[:19]
+
+
+def parse_message(value: bytes) -> tuple[MessageRecord | None, str]:
+    """Return (record, error) for a raw message value, decoded and validated once."""
+    try:
+        body = loads(value)
+    except ValueError as err:
+        return (None, f"Message is not valid json: {err}")
+    if not isinstance(body, dict):
+        return (None, f"Message is not a json object: {type(body)}")
+    (event_at, err) = validate_message(body)
+    if event_at is None:
+        return (None, err)
+    at = format_event_time(event_at)
+    if body['val'] == -1:
+        return (MessageRecord(at, body['site'], -1, body['type']), err)
+    return (MessageRecord(at, body['site'], body['val']), err)
+
+
+def read_message(message: Message, logger: logging.Logger = None) -> MessageRecord | None:
+    """Return validated record from message, logging it once when sampled."""
+    if logger is None:
+        logger = logging.getLogger(MESSAGE_LOGGER)
+    value = message.value()
+    if value is None:
+        ROWS_INVALID.inc()
+        logger.error("INVALID: %s, with ERROR: %s", None, "empty message")
+        reject("kafka", f"{message.topic()}:{message.partition()}:{message.offset()}",
+               "empty message", "")
+        return None
+    (record, err) = parse_message(value)
+    if record is None:
+        ROWS_INVALID.inc()
+        text = value.decode(errors="replace")
+        if is_sampled(logger, logging.ERROR):
+            logger.error("INVALID: %s, with ERROR: %s", text, err, extra=SAMPLED)
+        reject("kafka", f"{message.topic()}:{message.partition()}:{message.offset()}",
+               err, text)
+    else:
+        ROWS_VALID.inc()
+        if is_sampled(logger, logging.INFO):
+            logger.info("MESSAGE: %s", value.decode(), extra=SAMPLED)
+    return record
+
+
+def read_messages(messages: list[Message]) -> list[MessageRecord]:
+    """Return validated records from a batch of messages, logging consumer errors
+    and observing the parse time once for the whole batch."""
+    start = perf_counter()
+    logger = logging.getLogger(MESSAGE_LOGGER)
+    records = []
+    for message in messages:
+        if message.error():
+            logging.getLogger("etl_logger").error("Consumer error: %s", message.error())
+        elif (record := read_message(message, logger)) is not None:
+            records.append(record)
+    PARSE_SECONDS.observe(perf_counter() - start)
+    return records
 
 
 def log_message(message: Message):
     """Logs consumed messsages from kafka cluster."""
-    logger = logging.getLogger("etl_logger")
+    logger = logging.getLogger(MESSAGE_LOGGER)
     if message:
         val = message.value().decode()
         (valid, err) = is_valid_message(loads(val))
@@ -76,7 +180,7 @@ def log_message(message: Message):
 
 def get_message_data(message: Message) -> list:
     """Return list formatted data from message."""
-    logger = logging.getLogger("etl_logger")
+    logger = logging.getLogger(MESSAGE_LOGGER)
     body = loads(message.value().decode())
     (valid, _) = is_valid_message(body)
     if valid:
@@ -94,5 +198,4 @@ if __name__ == "__main__":
     while True:
         message = cons.poll(1.0)
         if message:
-            log_message(message)
-            print(get_message_data(message))
+            print(read_message(message))
@@ -0,0 +1,222 @@
+"""Module for collecting rejected records and writing them to a dead-letter sink in batches."""
+
+from abc import ABC, abstractmethod
+from os import path, environ as ENV
+from pathlib import Path
+from gzip import open as gzip_open
+from json import dumps, loads
+from datetime import datetime, timezone
+from logging import getLogger
+from threading import Lock
+from bisect import bisect_right
+from typing import NamedTuple
+from collections.abc import Iterator
+
+from psycopg2.extras import execute_values
+from psycopg2.extensions import connection
+from confluent_kafka import Producer
+
+
+SINK_TYPES = ("file", "table", "topic")
+
+
+class DeadLetter(NamedTuple):
+    """Rejected record with where it came from and why it was rejected."""
+    source: str
+    source_key: str
+    reason: str
+    record: str
+    rejected_at: str
+
+
+class DeadLetterSink(ABC):
+    """Buffer of dead letters written once batch_size have been collected."""
+
+    def __init__(self, batch_size: int = 1000):
+        """Start with an empty buffer."""
+        self.batch_size = batch_size
+        self.buffer = []
+        self.lock = Lock()
+        self.written = 0
+
+    def add(self, letter: DeadLetter) -> None:
+        """Buffer letter, writing the buffer once it is full."""
+        with self.lock:
+            self.buffer.append(letter)
+            if len(self.buffer) >= self.batch_size:
+                self.flush_buffer()
+
+    def flush(self) -> None:
+        """Write every buffered letter."""
+        with self.lock:
+            self.flush_buffer()
+
+    def flush_buffer(self) -> None:
+        """Write the buffer, logging instead of raising when the sink fails."""
+        if not self.buffer:
+            return
+        (letters, self.buffer) = (self.buffer, [])
+        try:
+            self.write(letters)
+            self.written += len(letters)
+        except Exception as err:  # pylint:disable=broad-exception-caught
+            getLogger("etl_logger").error("Failed to write %s dead letters: %s",
+                                          len(letters), err)
+
+    @abstractmethod
+    def write(self, letters: list[DeadLetter]) -> None:
+        """Write a batch of letters to the sink."""
+
+    def close(self) -> None:
+        """Write anything left in the buffer."""
+        self.flush()
+
+
+class FileSink(DeadLetterSink):
+    """Dead letters appended as json lines to a gzip file."""
+
+    def __init__(self, file_path: str, batch_size: int = 1000):
+        """Store path of the gzip file."""
+        super().__init__(batch_size)
+        self.file_path = file_path
+
+    def write(self, letters: list[DeadLetter]) -> None:
+        """Append letters as one gzip member."""
+        with gzip_open(self.file_path, "at", encoding="utf-8") as file:
+            file.writelines(dumps(letter._asdict()) + "\n" for letter in letters)
+
+
+class TableSink(DeadLetterSink):
+    """Dead letters inserted into the dead_letter table."""
+
+    def __init__(self, conn: connection, batch_size: int = 1000):
+        """Store a connection used only by the sink."""
+        super().__init__(batch_size)
+        self.conn = conn
+
+    def write(self, letters: list[DeadLetter]) -> None:
+        """Insert letters in one statement and commit."""
+        try:
+            with self.conn.cursor() as curs:
+                execute_values(curs, """
+                    INSERT INTO dead_letter (source, source_key, reason, record, rejected_at)
+                    VALUES %s
+                    """, letters, page_size=len(letters))
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    def close(self) -> None:
+        """Write anything left in the buffer and close the connection."""
+        super().close()
+        self.conn.close()
+
+
+class TopicSink(DeadLetterSink):
+    """Dead letters produced as json messages to a kafka topic."""
+
+    def __init__(self, producer: Producer, topic: str, batch_size: int = 1000):
+        """Store producer and dead-letter topic."""
+        super().__init__(batch_size)
+        self.producer = producer
+        self.topic = topic
+
+    def write(self, letters: list[DeadLetter]) -> None:
+        """Produce letters and wait for them to be delivered."""
+        for letter in letters:
+            self.producer.produce(self.topic, value=dumps(letter._asdict()),
+                                  key=letter.source_key)
+        if remaining := self.producer.flush(30):
+            raise RuntimeError(f"{remaining} dead letters were not delivered")
+
+
+SINK = None
+
+RowSources = list[tuple[int, str, int]]
+
+
+def add_row_source(sources: RowSources, index: int, source: str, row: int) -> None:
+    """Record that row index of a batch is row number row of source, extending
+    the last run of rows when it follows on from it."""
+    if sources:
+        (start, last_source, first_row) = sources[-1]
+        if last_source == source and first_row + index - start == row:
+            return
+    sources.append((index, source, row))
+
+
+def get_row_sources(source: str, first_row: int) -> RowSources:
+    """Return sources of a batch read from consecutive rows of source."""
+    return [(0, source, first_row)]
+
+
+def get_row_key(sources: RowSources | None, index: int) -> str | None:
+    """Return source:row key of row index of a batch, None without sources."""
+    if not sources:
+        return None
+    (start, source, first_row) = sources[bisect_right(sources, index, key=lambda s: s[0]) - 1]
+    return f"{source}:{first_row + index - start}"
+
+
+def set_sink(sink: DeadLetterSink | None) -> None:
+    """Set the sink rejected records are sent to, None to only log them."""
+    global SINK  # pylint:disable=global-statement
+    SINK = sink
+
+
+def reject(source: str, source_key, reason, record) -> None:
+    """Send a rejected record to the dead-letter sink."""
+    if SINK is None:
+        return
+    if not isinstance(record, str):
+        record = dumps(record, default=str)
+    SINK.add(DeadLetter(source, None if source_key is None else str(source_key),
+                        str(reason), record, datetime.now(timezone.utc).isoformat()))
+
+
+def flush_dead_letters() -> None:
+    """Write any buffered dead letters."""
+    if SINK is not None:
+        SINK.flush()
+
+
+def close_sink() -> None:
+    """Write any buffered dead letters and stop sending rejects to the sink."""
+    if SINK is not None:
+        SINK.close()
+        getLogger("etl_logger").info("%s records written to the dead-letter sink.",
+                                     SINK.written)
+    set_sink(None)
+
+
+def get_dead_letter_path() -> str:
+    """Return default path of the dead-letter file."""
+    return f"{path.dirname(__file__)}/dead_letters.jsonl.gz"
+
+
+def get_worker_path(file_path: str, pid: int) -> str:
+    """Return path of the dead-letter file of the worker process pid, with the pid
+    before every suffix of file_path."""
+    file = Path(file_path)
+    suffix = "".join(file.suffixes)
+    return str(file.with_name(f"{file.name[:len(file.name) - len(suffix)]}.{pid}{suffix}"))
+
+
+def get_sink(sink_type: str, batch_size: int = 1000, file_path: str = None,
+             conn: connection = None, producer: Producer = None) -> DeadLetterSink:
+    """Return dead-letter sink of sink_type."""
+    if sink_type == "file":
+        return FileSink(file_path or get_dead_letter_path(), batch_size)
+    if sink_type == "table":
+        return TableSink(conn, batch_size)
+    if sink_type == "topic":
+        return TopicSink(producer, ENV["DEAD_LETTER_TOPIC"], batch_size)
+    raise ValueError(f"Unknown dead-letter sink: {sink_type}")
+
+
+def read_dead_letters(file_path: str = None) -> Iterator[DeadLetter]:
+    """Yield dead letters from a dead-letter file to replay them."""
+    with gzip_open(file_path or get_dead_letter_path(), "rt", encoding="utf-8") as file:
+        for line in file:
+            yield DeadLetter(**loads(line))
@@ -0,0 +1,69 @@
+"""In-memory cache of the small dimension tables used to resolve ids."""
+
+from logging import getLogger
+from collections.abc import Callable
+
+from psycopg2.sql import SQL, Identifier
+from psycopg2.extensions import connection
+
+
+DIMENSION_TABLES = ("rating", "request")
+
+
+def load_ids(conn: connection) -> dict[str, dict]:
+    """Return {key: id} of every dimension table by table name."""
+    ids = {}
+    with conn.cursor() as curs:
+        for table in DIMENSION_TABLES:
+            curs.execute(
+                SQL("SELECT {value}, {pkey} FROM {table}").format(
+                    value=Identifier(f"{table}_value"),
+                    pkey=Identifier(f"{table}_id"),
+                    table=Identifier(table)))
+            ids[table] = dict(curs.fetchall())
+        curs.execute("SELECT public_id, exhibition_id FROM exhibition")
+        ids["exhibition"] = dict(curs.fetchall())
+    conn.commit()
+    return ids
+
+
+class DimensionCache:
+    """Cache of rating, request and exhibition ids loaded once per run."""
+
+    def __init__(self, conn: connection, run: Callable = None):
+        """Store connection, tables are loaded on first lookup.
+
+        Given run, such as LoaderPool.run, tables are loaded by run(load_ids)
+        so a lost connection is replaced instead of conn being used."""
+        self.conn = conn
+        self.run = run
+        self.ids = {}
+        self.missing = set()
+
+    def refresh(self) -> None:
+        """Reload every dimension table from the database."""
+        self.ids = load_ids(self.conn) if self.run is None else self.run(load_ids)
+        self.missing = set()
+        getLogger("etl_logger").info("Dimension cache loaded.")
+
+    def get_id(self, table_name: str, key) -> int:
+        """Return id for key in table, reloading the cache once on a new miss."""
+        if key not in self.ids.get(table_name, {}) and (table_name, key) not in self.missing:
+            self.refresh()
+            if key not in self.ids[table_name]:
+                self.missing.add((table_name, key))
+        return self.ids[table_name][key]
+
+    def get_ids(self, table_name: str) -> dict:
+        """Return every {key: id} of table, loading the cache if empty."""
+        if table_name not in self.ids:
+            self.refresh()
+        return self.ids[table_name]
+
+    def get_value_id(self, table_name: str, value: int) -> int:
+        """Return rating_id or request_id matching value."""
+        return self.get_id(table_name, value)
+
+    def get_exhibition_id(self, site) -> int:
+        """Return exhibition_id for a site number."""
+        return self.get_id("exhibition", f"EXH_0{site}")
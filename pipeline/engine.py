@@ -0,0 +1,192 @@
+"""Asyncio engine running extract, transform and load as overlapping stages."""
+
+from asyncio import Queue, TaskGroup, to_thread, run
+from logging import getLogger
+from collections.abc import Callable, Iterator
+
+from boto3 import client
+from confluent_kafka import Consumer
+
+from dimensions import DimensionCache
+from extract import iter_numbered_rows, TimeWindow
+from consumer import read_messages
+from loader import group_rows, get_sourced_batches
+from pool import LoaderPool
+from metrics import ROWS_READ, ROWS_VALID, ROWS_SKIPPED, update_consumer_lag
+from deadletter import flush_dead_letters, RowSources
+from offsets import StoredOffsets, get_offsets
+from recent import RecentEvents
+
+
+def next_batch(batches: Iterator) -> tuple | None:
+    """Return the next batch, None once there are none left."""
+    return next(batches, None)
+
+
+def parse_rows(rows: list, cache: DimensionCache, parse: Callable[[list], list],
+               sources: RowSources = None) -> dict[str, list[tuple]]:
+    """Return parsed rows grouped by table with ids mapped."""
+    return group_rows(parse(rows), cache, sources)
+
+
+class Totals:
+    """Running counts of rows processed by the engine."""
+
+    def __init__(self, limit: int = None):
+        """Start every count at zero."""
+        self.limit = limit
+        self.extracted = 0
+        self.inserted = 0
+        self.skipped = 0
+
+    def take(self, count: int) -> int:
+        """Return how many of count rows can still be extracted."""
+        if self.limit is not None:
+            count = max(min(count, self.limit - self.extracted), 0)
+        self.extracted += count
+        return count
+
+    def is_done(self) -> bool:
+        """Return True once the row limit has been extracted."""
+        return self.limit is not None and self.extracted >= self.limit
+
+
+async def extract_objects(s_client: client, bucket_name: str, keys: Queue,
+                          outbox: Queue, totals: Totals, chunk_size: int,
+                          window: TimeWindow = None) -> None:
+    """Put chunks of csv rows in window from each key taken off keys into outbox,
+    along with the rows they were read from."""
+    while (key := await keys.get()) is not None:
+        rows = iter_numbered_rows(s_client, bucket_name, key, window)
+        batches = get_sourced_batches(rows, chunk_size)
+        while not totals.is_done() and (batch := await to_thread(next_batch, batches)):
+            (chunk, sources) = batch
+            if count := totals.take(len(chunk)):
+                ROWS_READ.inc(count)
+                await outbox.put((chunk[:count], None, sources))
+        rows.close()
+
+
+async def extract_messages(cons: Consumer, outbox: Queue, totals: Totals,
+                           batch_size: int) -> None:
+    """Put batches of kafka messages into outbox until the row limit is met."""
+    while not totals.is_done():
+        messages = await to_thread(cons.consume, batch_size, 1.0)
+        if count := totals.take(len(messages)):
+            ROWS_READ.inc(count)
+            messages = messages[:count]
+            await outbox.put((messages, get_offsets(messages), None))
+
+
+async def transform(inbox: Queue, outbox: Queue, cache: DimensionCache,
+                    parse: Callable[[list], list]) -> None:
+    """Put rows from inbox into outbox grouped by table with ids mapped, in a
+    worker thread so the event loop keeps extracting and loading."""
+    while (item := await inbox.get()) is not None:
+        (rows, offsets, sources) = item
+        grouped = await to_thread(parse_rows, rows, cache, parse, sources)
+        await outbox.put((grouped, offsets))
+
+
+async def load(inbox: Queue, pool: LoaderPool, totals: Totals, method: str,
+               cons: Consumer = None, group: str = None, recent: RecentEvents = None) -> None:
+    """Write grouped rows from inbox, committing kafka offsets after each write.
+
+    With a consumer group the offsets are also stored in the write itself, and
+    rows in the recent events index are left out of it."""
+    while (item := await inbox.get()) is not None:
+        (grouped, offsets) = item
+        stored = StoredOffsets(group, offsets) if group and offsets else None
+        hits = 0
+        if recent is not None:
+            (grouped, hits) = recent.split(grouped)
+        (inserted, skipped) = await to_thread(pool.load, grouped, method, stored)
+        if recent is not None:
+            recent.add_grouped(grouped)
+            ROWS_SKIPPED.inc(hits)
+            skipped += hits
+        totals.inserted += inserted
+        totals.skipped += skipped
+        if cons is None:
+            ROWS_VALID.inc(inserted + skipped)
+        elif offsets:
+            await to_thread(flush_dead_letters)
+            await to_thread(cons.commit, offsets=offsets, asynchronous=False)
+            await to_thread(update_consumer_lag, cons)
+
+
+async def run_stages(extractors: list, transform_workers: int, load_workers: int,
+                     pool: LoaderPool,
+                     cache: DimensionCache, parse: Callable[[list], list], totals: Totals,
+                     queue_size: int, method: str, cons: Consumer = None,
+                     group: str = None, recent: RecentEvents = None) -> None:
+    """Run extractors, transform and load workers joined by bounded queues."""
+    extracted = Queue(queue_size)
+    transformed = Queue(queue_size)
+
+    async def run_extract():
+        async with TaskGroup() as tasks:
+            for extractor in extractors:
+                tasks.create_task(extractor(extracted))
+        for _ in range(transform_workers):
+            await extracted.put(None)
+
+    async def run_transform():
+        async with TaskGroup() as tasks:
+            for _ in range(transform_workers):
+                tasks.create_task(transform(extracted, transformed, cache, parse))
+        for _ in range(load_workers):
+            await transformed.put(None)
+
+    async with TaskGroup() as tasks:
+        tasks.create_task(run_extract())
+        tasks.create_task(run_transform())
+        for _ in range(load_workers):
+            tasks.create_task(load(transformed, pool, totals, method, cons, group, recent))
+
+
+async def run_bucket(s_client: client, bucket_name: str, files: list[str],
+                     pool: LoaderPool, cache: DimensionCache, rows: int = None,
+                     extract_workers: int = 8, transform_workers: int = 1, load_workers: int = 2,
+                     queue_size: int = 8, chunk_size: int = 10000,
+                     method: str = 'copy', window: TimeWindow = None) -> Totals:
+    """Return totals after loading files from bucket through the staged engine."""
+    totals = Totals(rows)
+    keys = Queue()
+    for key in files:
+        keys.put_nowait(key)
+    for _ in range(extract_workers):
+        keys.put_nowait(None)
+    extractors = [lambda outbox: extract_objects(s_client, bucket_name, keys,
+                                                 outbox, totals, chunk_size, window)
+                  for _ in range(extract_workers)]
+    await run_stages(extractors, transform_workers, load_workers, pool, cache,
+                     list, totals, queue_size, method)
+    return totals
+
+
+async def run_cluster(cons: Consumer, pool: LoaderPool, cache: DimensionCache,
+                      rows: int = None, queue_size: int = 8,
+                      batch_size: int = 1000, method: str = 'copy',
+                      group: str = None, recent: RecentEvents = None) -> Totals:
+    """Return totals after loading messages through the staged engine.
+
+    Batches are loaded in order by a single load worker so offsets are
+    always committed behind the data that has been written. Offsets are
+    stored in the database with each batch when group is given, and rows
+    in the recent events index are skipped without reaching it."""
+    totals = Totals(rows)
+    extractors = [lambda outbox: extract_messages(cons, outbox, totals, batch_size)]
+    await run_stages(extractors, 1, 1, pool, cache, read_messages,
+                     totals, queue_size, method, cons, group, recent)
+    return totals
+
+
+def run_engine(coroutine) -> Totals:
+    """Run an engine coroutine to completion and log its totals."""
+    totals = run(coroutine)
+    logger = getLogger("etl_logger")
+    logger.info("%s Rows have been bulk loaded.", totals.inserted)
+    if totals.skipped:
+        logger.info("%s Rows have been skipped.", totals.skipped)
+    return totals
@@ -3,52 +3,325 @@
 from os import environ as ENV, remove, path, mkdir
 from re import fullmatch
 from csv import writer, reader
+from datetime import datetime, timezone
+from typing import NamedTuple
+from itertools import islice
+from collections import deque
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 from dotenv import load_dotenv
 from boto3 import client
+from pyarrow import schema, string, Table
+from pyarrow.parquet import ParquetWriter, ParquetFile
 
+from metrics import S3_DOWNLOAD_SECONDS
 
-def get_object_names_from_bucket(s_client: client, bucket_name: str) -> list[str]:
-    """Returns a list of S3 object names."""
-    objects = s_client.list_objects(Bucket=bucket_name)["Contents"]
-    return [o['Key'] for o in objects]
 
+FILE_PATTERN = r"(lmnh_hist_data_[0-9]*\.csv)|(lmnh_exhibition_\w*.json)"
+CSV_PATTERN = r"lmnh_hist_data_[0-9]*\.csv"
+STREAM_CHUNK_SIZE = 64 * 1024
+COLUMNS = ['at', 'site', 'val', 'type']
+FILE_FORMATS = ('csv', 'parquet')
+ROW_GROUP_SIZE = 100000
+PARQUET_SCHEMA = schema([(column, string()) for column in COLUMNS])
 
-def get_files(s_client: client, bucket_name) -> list[str]:
-    """Return list of filtered files downloaded from S3 bucket."""
-    files = get_object_names_from_bucket(s_client, bucket_name)
+
+class TimeWindow(NamedTuple):
+    """Range of event times [start, end) to load, either end may be left open."""
+    start: datetime = None
+    end: datetime = None
+
+
+def get_utc(value: datetime) -> datetime:
+    """Return value as an aware datetime, taking naive times to be utc."""
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def get_window_time(value: str) -> datetime:
+    """Return an iso format window bound as an aware datetime."""
+    return get_utc(datetime.fromisoformat(value))
+
+
+def in_window(at: str, window: TimeWindow) -> bool:
+    """Return True if event time at is in window, or cannot be parsed and is
+    left for validation to reject."""
+    try:
+        event_at = get_utc(datetime.fromisoformat(at))
+    except (TypeError, ValueError):
+        return True
+    return ((window.start is None or event_at >= window.start)
+            and (window.end is None or event_at < window.end))
+
+
+def filter_rows(rows: Iterable[list], window: TimeWindow = None) -> Iterable[list]:
+    """Return rows with an event time in window, all of them without a window."""
+    if window is None or window == TimeWindow():
+        return rows
+    return (row for row in rows if row and in_window(row[0], window))
+
+
+def filter_numbered_rows(rows: Iterable[tuple[str, int, list]],
+                         window: TimeWindow = None) -> Iterable[tuple[str, int, list]]:
+    """Return (source, row number, row) items with an event time in window."""
+    if window is None or window == TimeWindow():
+        return rows
+    return (item for item in rows if in_window(item[2][0], window))
+
+
+def may_contain(obj: dict, window: TimeWindow = None) -> bool:
+    """Return False for history objects last modified before window starts,
+    which were written before any event in it happened."""
+    if window is None or window.start is None or not fullmatch(CSV_PATTERN, obj['Key']):
+        return True
+    return obj.get('LastModified') is None or obj['LastModified'] >= window.start
+
+
+def get_objects_from_bucket(s_client: client, bucket_name: str,
+                            prefix: str = None) -> list[dict]:
+    """Returns every S3 object summary in bucket under prefix, following pagination."""
+    paginator = s_client.get_paginator("list_objects_v2")
+    pages = (paginator.paginate(Bucket=bucket_name, Prefix=prefix) if prefix
+             else paginator.paginate(Bucket=bucket_name))
+    return [o for page in pages for o in page.get("Contents", [])]
+
+
+def get_object_names_from_bucket(s_client: client, bucket_name: str,
+                                 prefix: str = None) -> list[str]:
+    """Returns a list of S3 object names under prefix."""
+    return [o['Key'] for o in get_objects_from_bucket(s_client, bucket_name, prefix)]
+
+
+def download_file(s_client: client, bucket_name: str, key: str,
+                  path_to_data: str) -> list[list]:
+    """Download object, returning its csv rows and removing it when it is a csv."""
+    with S3_DOWNLOAD_SECONDS.time():
+        s_client.download_file(bucket_name, key, f'{path_to_data}/{key}')
+    if key[-3:] != 'csv':
+        return []
+    with open(f'{path_to_data}/{key}', 'r', encoding="utf-8") as infile:
+        r = reader(infile)
+        next(r)
+        rows = list(r)
+    remove(f'{path_to_data}/{key}')
+    return rows
+
+
+class ParquetRowWriter:
+    """Writer of csv rows to a parquet file in row groups of row_group_size rows."""
+
+    def __init__(self, file_path: str, row_group_size: int = None):
+        """Open a zstd compressed, dictionary encoded parquet file."""
+        self.writer = ParquetWriter(file_path, PARQUET_SCHEMA, compression='zstd',
+                                    use_dictionary=True)
+        self.row_group_size = row_group_size or ROW_GROUP_SIZE
+        self.rows = []
+
+    def writerows(self, rows: list[list]) -> None:
+        """Buffer rows, writing a row group each time row_group_size are buffered."""
+        self.rows.extend(rows)
+        while len(self.rows) >= self.row_group_size:
+            self.write_group(self.rows[:self.row_group_size])
+            self.rows = self.rows[self.row_group_size:]
+
+    def write_group(self, rows: list[list]) -> None:
+        """Write rows as a single row group, each padded or cut to the schema columns."""
+        rows = [(list(row) + [''] * len(COLUMNS))[:len(COLUMNS)] for row in rows]
+        self.writer.write_table(Table.from_arrays(
+            [[row[index] for row in rows] for index in range(len(COLUMNS))],
+            schema=PARQUET_SCHEMA))
+
+    def close(self) -> None:
+        """Write the last row group and close the file."""
+        if self.rows:
+            self.write_group(self.rows)
+        self.writer.close()
+
+
+def get_data_path(file_format: str = 'csv') -> str:
+    """Return path of the collated history file in file_format."""
+    return f"{get_dir_path()}/lmnh_hist_data.{file_format}"
+
+
+@contextmanager
+def open_collated_file(file_format: str = 'csv') -> Iterator:
+    """Yield a writer of rows to the collated history file in file_format."""
+    if file_format == 'parquet':
+        parquet_writer = ParquetRowWriter(get_data_path('parquet'))
+        try:
+            yield parquet_writer
+        finally:
+            parquet_writer.close()
+    else:
+        with open(get_data_path('csv'), 'w', encoding="utf-8") as outfile:
+            w = writer(outfile)
+            w.writerow(COLUMNS)
+            yield w
+
+
+def get_files(s_client: client, bucket_name, workers: int = 8,
+              files: list[str] = None, file_format: str = 'csv',
+              window: TimeWindow = None) -> list[str]:
+    """Return list of filtered files downloaded from S3 bucket, collating
+    only rows in window."""
+    if files is None:
+        files = get_object_names_from_bucket(s_client, bucket_name)
+    filtered_files = [f for f in files if fullmatch(FILE_PATTERN, f)]
 
     path_to_data = get_dir_path()
 
-    with open(f"{path_to_data}/lmnh_hist_data.csv", 'w', encoding="utf-8") as outfile:
-        w = writer(outfile)
-        w.writerow(['at', 'site', 'val', 'type'])
-        filtered_files = []
-        for f in files:
-            if fullmatch(r"(lmnh_hist_data_[0-9]*\.csv)|(lmnh_exhibition_\w*.json)", f):
-                filtered_files.append(f)
-                s_client.download_file(
-                    bucket_name, f, f'{path_to_data}/{f}')
-                if f[-3:] == 'csv':
-                    with open(f'{path_to_data}/{f}', 'r', encoding="utf-8") as infile:
-                        r = reader(infile)
-                        next(r)
-                        for row in r:
-                            w.writerow(row)
-                    remove(f'{path_to_data}/{f}')
+    with (ThreadPoolExecutor(max_workers=workers) as pool,
+          open_collated_file(file_format) as w):
+        downloads = deque()
+        for f in filtered_files:
+            downloads.append(pool.submit(
+                download_file, s_client, bucket_name, f, path_to_data))
+            if len(downloads) > workers:
+                w.writerows(filter_rows(downloads.popleft().result(), window))
+        while downloads:
+            w.writerows(filter_rows(downloads.popleft().result(), window))
     return filtered_files
 
 
-def get_data_from_file(row_number: int = -1) -> list[list]:
-    """Return data from collatted csv for upload."""
+def iter_numbered_rows(s_client: client, bucket_name: str, key: str,
+                       window: TimeWindow = None) -> Iterator[tuple[str, int, list]]:
+    """Yield (key, row number, row) for csv rows in window from an S3 object body
+    without writing it to disk."""
+    with S3_DOWNLOAD_SECONDS.time():
+        body = s_client.get_object(Bucket=bucket_name, Key=key)["Body"]
+    try:
+        r = reader(line.decode("utf-8")
+                   for line in body.iter_lines(chunk_size=STREAM_CHUNK_SIZE))
+        next(r, None)
+        yield from filter_numbered_rows(
+            ((key, number, row) for number, row in enumerate(row for row in r if row)), window)
+    finally:
+        body.close()
+
+
+def iter_object_rows(s_client: client, bucket_name: str, key: str,
+                     window: TimeWindow = None) -> Iterator[list]:
+    """Yield csv rows in window from an S3 object body without writing it to disk."""
+    rows = iter_numbered_rows(s_client, bucket_name, key, window)
+    try:
+        yield from (row for _, _, row in rows)
+    finally:
+        rows.close()
+
+
+def stream_bodies(s_client: client, bucket_name: str,
+                  files: list[str] = None) -> Iterator[tuple[str, object]]:
+    """Yield (key, streaming body) of every history object in bucket, in listing order."""
+    if files is None:
+        files = get_object_names_from_bucket(s_client, bucket_name)
+    for key in files:
+        if fullmatch(CSV_PATTERN, key):
+            body = s_client.get_object(Bucket=bucket_name, Key=key)["Body"]
+            try:
+                yield key, body
+            finally:
+                body.close()
+
+
+def stream_rows(s_client: client, bucket_name: str,
+                files: list[str] = None, window: TimeWindow = None) -> Iterator[list]:
+    """Yield csv rows in window from every history object in bucket, in listing order."""
+    if files is None:
+        files = get_object_names_from_bucket(s_client, bucket_name)
+    for key in files:
+        if fullmatch(CSV_PATTERN, key):
+            yield from iter_object_rows(s_client, bucket_name, key, window)
+
+
+def stream_numbered_rows(s_client: client, bucket_name: str, files: list[str] = None,
+                         window: TimeWindow = None) -> Iterator[tuple[str, int, list]]:
+    """Yield (key, row number, row) for csv rows in window from every history object
+    in bucket, in listing order."""
+    if files is None:
+        files = get_object_names_from_bucket(s_client, bucket_name)
+    for key in files:
+        if fullmatch(CSV_PATTERN, key):
+            yield from iter_numbered_rows(s_client, bucket_name, key, window)
+
+
+def iter_file_rows(start_byte: int = 0) -> Iterator[tuple[list, int]]:
+    """Yield (row, byte offset after row) from collated csv."""
     path_to_data = get_dir_path()
 
-    with open(f"{path_to_data}/lmnh_hist_data.csv", 'r', encoding='utf-8') as f:
-        r = reader(f)
-        next(r)
-        l = list(r)[:row_number]
-        return l
-    return None
+    with open(f"{path_to_data}/lmnh_hist_data.csv", 'rb') as f:
+        if start_byte:
+            f.seek(start_byte)
+            offset = [start_byte]
+        else:
+            offset = [len(f.readline())]
+
+        def lines():
+            for line in f:
+                offset[0] += len(line)
+                yield line.decode("utf-8")
+
+        for row in reader(lines()):
+            if row:
+                yield row, offset[0]
+
+
+def get_data_chunks(chunk_size: int = 10000, row_number: int = None,
+                    start_row: int = 0,
+                    start_byte: int = 0) -> Iterator[tuple[list[list], int]]:
+    """Yield (rows, byte offset after rows) chunks of at most chunk_size rows."""
+    stop = None if row_number is None else start_row + row_number
+    rows = islice(iter_file_rows(start_byte), start_row, stop)
+    while chunk := list(islice(rows, chunk_size)):
+        yield [row for row, _ in chunk], chunk[-1][1]
+
+
+def iter_parquet_batches(chunk_size: int = 10000, row_number: int = None,
+                         start_row: int = 0, columns: list[str] = None) -> Iterator:
+    """Yield record batches of the collated parquet file from start_row,
+    reading only the row groups and columns needed."""
+    parquet_file = ParquetFile(get_data_path('parquet'), memory_map=True)
+    stop = None if row_number is None else start_row + row_number
+    row_groups = []
+    first_row = 0
+    skip = start_row
+    for index in range(parquet_file.num_row_groups):
+        group_rows = parquet_file.metadata.row_group(index).num_rows
+        if first_row + group_rows <= start_row:
+            skip -= group_rows
+        elif stop is None or first_row < stop:
+            row_groups.append(index)
+        first_row += group_rows
+    remaining = None if row_number is None else row_number
+    for batch in parquet_file.iter_batches(chunk_size, row_groups=row_groups, columns=columns):
+        if skip:
+            (batch, skip) = (batch.slice(skip), max(skip - len(batch), 0))
+        if remaining is not None:
+            batch = batch.slice(0, remaining)
+            remaining -= len(batch)
+        if len(batch):
+            yield batch
+        if remaining == 0:
+            return
+
+
+def get_parquet_chunks(chunk_size: int = 10000, row_number: int = None,
+                       start_row: int = 0) -> Iterator[tuple[list[list], int]]:
+    """Yield (rows, row number after rows) chunks of at most chunk_size rows."""
+    end_row = start_row
+    for batch in iter_parquet_batches(chunk_size, row_number, start_row):
+        rows = [list(row) for row in zip(*(column.to_pylist() for column in batch.columns))]
+        end_row += len(rows)
+        yield rows, end_row
+
+
+def get_data_from_file(row_number: int = None, file_format: str = 'csv',
+                       start_row: int = 0) -> list[list]:
+    """Return data from collatted csv or parquet for upload."""
+    chunks = (get_parquet_chunks(row_number=row_number, start_row=start_row)
+              if file_format == 'parquet'
+              else get_data_chunks(row_number=row_number, start_row=start_row))
+    return [row for chunk, _ in chunks for row in chunk]
 
 
 def get_dir_path():
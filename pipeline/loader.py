@@ -0,0 +1,266 @@
+"""Module for bulk loading interaction rows into the database."""
+
+from io import StringIO
+from csv import writer
+from datetime import datetime
+from itertools import islice
+from functools import partial
+from logging import getLogger
+from weakref import WeakKeyDictionary
+from collections.abc import Callable, Iterable, Iterator, Sequence
+
+from psycopg2.sql import SQL, Identifier
+from psycopg2.extras import execute_values
+from psycopg2.extensions import connection, cursor
+from progress.counter import Counter
+
+from dimensions import DimensionCache
+from checkpoint import Checkpoint, save_checkpoint
+from offsets import StoredOffsets, save_offsets
+from recent import RecentEvents
+from deadletter import reject, add_row_source, get_row_key, RowSources
+from partitions import ensure_partitions
+from rollups import has_rollup, get_rollup_statement
+from metrics import (ROWS_READ, ROWS_VALID, ROWS_INVALID, ROWS_INSERTED, ROWS_SKIPPED, BATCH_SIZE,
+                     LOOKUP_SECONDS, DEDUP_SECONDS, INSERT_SECONDS)
+
+
+REQUEST_TYPES = {'0.0': 0, '1.0': 1, '0': 0, '1': 1, 0: 0, 1: 1}
+STATEMENTS = {
+    'insert': """
+        INSERT INTO {table} (exhibition_id, {field}, event_at)
+        VALUES ($1, $2, $3)
+        ON CONFLICT DO NOTHING
+        """,
+    'merge': """
+        INSERT INTO {table} (exhibition_id, {field}, event_at)
+        SELECT DISTINCT exhibition_id, {field}, event_at FROM {staging}
+        ON CONFLICT DO NOTHING
+        """
+}
+STATEMENT_PARAMS = {'insert': "(SMALLINT, SMALLINT, TIMESTAMPTZ)"}
+PREPARED = WeakKeyDictionary()
+
+Load = Callable[..., tuple[int, int]]
+
+
+def get_batches(rows: Iterable, size: int) -> Iterator[list]:
+    """Yield lists of at most size rows from an iterable."""
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+def get_sourced_batches(rows: Iterable[tuple[str, int, list]],
+                        size: int) -> Iterator[tuple[list, RowSources]]:
+    """Yield (batch, row sources) of at most size rows from (source, row number, row)."""
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        sources = []
+        for index, (source, number, _) in enumerate(chunk):
+            add_row_source(sources, index, source, number)
+        yield [row for _, _, row in chunk], sources
+
+
+def transform_row(row: list, cache: DimensionCache) -> tuple[str, tuple]:
+    """Return table name and (exhibition_id, value_id, event_at) for a row."""
+    datetime.fromisoformat(row[0])
+    if str(row[2]) == '-1':
+        table_name = 'request'
+        value = REQUEST_TYPES[row[3]]
+    else:
+        table_name = 'rating'
+        value = int(row[2])
+    return table_name, (cache.get_exhibition_id(row[1]),
+                        cache.get_value_id(table_name, value),
+                        row[0])
+
+
+def group_rows(batch: list[list], cache: DimensionCache,
+               sources: RowSources = None) -> dict[str, list[tuple]]:
+    """Return transformed rows grouped by target table, rejecting invalid rows
+    keyed by where sources say they were read from."""
+    grouped = {'rating': [], 'request': []}
+    with LOOKUP_SECONDS.time():
+        for index, row in enumerate(batch):
+            try:
+                table_name, values = transform_row(row, cache)
+            except (KeyError, ValueError, IndexError, TypeError) as err:
+                ROWS_INVALID.inc()
+                reject("rows", get_row_key(sources, index), f"{type(err).__name__}: {err}",
+                       list(row))
+                continue
+            grouped[table_name].append(values)
+    return grouped
+
+
+def create_staging_table(curs: cursor, table_name: str) -> None:
+    """Create session staging table for table_name, emptied on every commit."""
+    curs.execute(
+        SQL("""
+            CREATE TEMP TABLE IF NOT EXISTS {staging} (
+                exhibition_id SMALLINT,
+                {field} SMALLINT,
+                event_at TIMESTAMPTZ
+            ) ON COMMIT DELETE ROWS
+            """).format(staging=Identifier(f"{table_name}_staging"),
+                        field=Identifier(f"{table_name}_id")))
+
+
+def copy_rows(curs: cursor, table_name: str, rows: list[tuple]) -> None:
+    """Write rows, or a DataFrame of columns, to the staging table with COPY FROM STDIN."""
+    buffer = StringIO()
+    if hasattr(rows, 'to_csv'):
+        rows.to_csv(buffer, header=False, index=False)
+    else:
+        writer(buffer).writerows(rows)
+    buffer.seek(0)
+    curs.copy_expert(
+        SQL("""
+            COPY {staging} (exhibition_id, {field}, event_at)
+            FROM STDIN WITH (FORMAT csv)
+            """).format(staging=Identifier(f"{table_name}_staging"),
+                        field=Identifier(f"{table_name}_id")),
+        buffer)
+
+
+def insert_rows(curs: cursor, table_name: str, rows: list[tuple]) -> None:
+    """Write rows, or a DataFrame of columns, to the staging table with a multi-row INSERT."""
+    if hasattr(rows, 'itertuples'):
+        rows = list(rows.itertuples(index=False, name=None))
+    execute_values(
+        curs,
+        SQL("INSERT INTO {staging} (exhibition_id, {field}, event_at) VALUES %s").format(
+            staging=Identifier(f"{table_name}_staging"),
+            field=Identifier(f"{table_name}_id")),
+        rows, page_size=len(rows))
+
+
+def prepare(curs: cursor, name: str, table_name: str, rollup: bool = False) -> Identifier:
+    """Return identifier of a prepared statement, preparing it once per connection.
+
+    With rollup the statement also adds the rows it inserts to the rollup table."""
+    statement = f"{name}_rollup_{table_name}" if rollup else f"{name}_{table_name}"
+    prepared = PREPARED.setdefault(curs.connection, set())
+    if statement not in prepared:
+        text = get_rollup_statement(STATEMENTS[name]) if rollup else STATEMENTS[name]
+        curs.execute(SQL("PREPARE {statement} {params} AS ").format(
+            statement=Identifier(statement),
+            params=SQL(STATEMENT_PARAMS.get(name, ""))) + SQL(text).format(
+                table=Identifier(f"{table_name}_interaction"),
+                field=Identifier(f"{table_name}_id"),
+                staging=Identifier(f"{table_name}_staging"),
+                rollup=Identifier(f"{table_name}_rollup")))
+        prepared.add(statement)
+    return Identifier(statement)
+
+
+def execute_prepared(curs: cursor, name: str, table_name: str, values: tuple = None) -> int:
+    """Return number of rows inserted by a prepared statement, keeping any rollup up to date."""
+    rollup = has_rollup(curs, table_name)
+    statement = prepare(curs, name, table_name, rollup)
+    if values is None:
+        curs.execute(SQL("EXECUTE {statement}").format(statement=statement))
+    else:
+        curs.execute(SQL("EXECUTE {statement} (%s, %s, %s)").format(statement=statement),
+                     values)
+    return curs.fetchone()[0] if rollup else curs.rowcount
+
+
+def insert_row(curs: cursor, table_name: str, values: tuple) -> bool:
+    """Return True if a single row was inserted, skipping existing events."""
+    ensure_partitions(curs.connection, f"{table_name}_interaction", [values[2]])
+    with INSERT_SECONDS.time():
+        return execute_prepared(curs, 'insert', table_name, values) == 1
+
+
+def merge_staging(curs: cursor, table_name: str) -> int:
+    """Return number of staged rows inserted, skipping existing events."""
+    return execute_prepared(curs, 'merge', table_name)
+
+
+LOAD_METHODS = {'copy': copy_rows, 'values': insert_rows}
+
+
+def get_event_times(rows: list[tuple]) -> Sequence:
+    """Return event_at of rows, or the event_at column of a DataFrame."""
+    if hasattr(rows, 'columns'):
+        return rows['event_at']
+    return [row[2] for row in rows]
+
+
+def load_grouped(conn: connection, grouped: dict[str, list[tuple]],
+                 method: str = 'copy', checkpoint: Checkpoint = None,
+                 offsets: StoredOffsets = None) -> tuple[int, int]:
+    """Return (inserted, skipped) for grouped rows written in a single transaction,
+    along with the checkpoint or kafka offsets reached after them."""
+    inserted = 0
+    try:
+        for table_name, rows in grouped.items():
+            if len(rows):
+                ensure_partitions(conn, f"{table_name}_interaction", get_event_times(rows))
+        with conn.cursor() as curs:
+            for table_name, rows in grouped.items():
+                if len(rows):
+                    create_staging_table(curs, table_name)
+                    with INSERT_SECONDS.time():
+                        LOAD_METHODS[method](curs, table_name, rows)
+                    with DEDUP_SECONDS.time():
+                        inserted += merge_staging(curs, table_name)
+            if checkpoint is not None:
+                save_checkpoint(curs, checkpoint)
+            if offsets is not None:
+                save_offsets(curs, offsets)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    total = sum(len(rows) for rows in grouped.values())
+    BATCH_SIZE.set(total)
+    ROWS_INSERTED.inc(inserted)
+    ROWS_SKIPPED.inc(total - inserted)
+    return inserted, total - inserted
+
+
+def load_batch(conn: connection, batch: list[list], cache: DimensionCache,
+               method: str = 'copy', checkpoint: Checkpoint = None,
+               offsets: StoredOffsets = None, recent: RecentEvents = None,
+               sources: RowSources = None, load: Load = None) -> tuple[int, int]:
+    """Return (inserted, skipped) for batch written in a single transaction,
+    leaving out rows already in the recent events index.
+
+    Grouped rows are written with load, such as LoaderPool.load to retry on a
+    new connection, or with load_grouped on conn by default."""
+    load = load or partial(load_grouped, conn)
+    grouped = group_rows(batch, cache, sources)
+    if recent is None:
+        return load(grouped, method, checkpoint=checkpoint, offsets=offsets)
+    (grouped, hits) = recent.split(grouped)
+    (inserted, skipped) = load(grouped, method, checkpoint=checkpoint, offsets=offsets)
+    recent.add_grouped(grouped)
+    ROWS_SKIPPED.inc(hits)
+    return inserted, skipped + hits
+
+
+def upload_batches(conn: connection,
+                   batches: Iterable[tuple[list[list], Checkpoint, RowSources]],
+                   cache: DimensionCache, method: str = 'copy',
+                   load: Load = None) -> tuple[int, int]:
+    """Upload (batch, checkpoint, row sources), each with its checkpoint when it has
+    one and written with load when given, return (inserted, skipped)."""
+    logger = getLogger('etl_logger')
+    inserted = 0
+    skipped = 0
+    with Counter('Uploading Rows... ') as counter:
+        for batch, checkpoint, sources in batches:
+            ROWS_READ.inc(len(batch))
+            (batch_inserted, batch_skipped) = load_batch(
+                conn, batch, cache, method, checkpoint, sources=sources, load=load)
+            ROWS_VALID.inc(batch_inserted + batch_skipped)
+            inserted += batch_inserted
+            skipped += batch_skipped
+            counter.next(len(batch))
+    logger.info("%s Rows have been bulk loaded.", inserted)
+    if skipped:
+        logger.info("%s Rows have been skipped.", skipped)
+    return inserted, skipped
@@ -2,8 +2,20 @@
 
 from os import path
 from sys import stdout
-from logging import (getLogger, DEBUG, INFO, ERROR, Filter,
-                     StreamHandler, FileHandler, Logger)
+from queue import SimpleQueue
+from time import monotonic
+from threading import Lock, Thread, Event
+from collections import Counter
+from logging import (getLogger, getLevelName, DEBUG, INFO, WARNING, ERROR, Filter,
+                     StreamHandler, FileHandler, Logger, LogRecord)
+from logging.handlers import QueueHandler, QueueListener
+
+
+MESSAGE_LOGGER = "etl_logger.messages"
+SAMPLED = {"sampled": True}
+
+LISTENERS = []
+SUMMARIES = []
 
 
 class ExcludeErrorFilter(Filter):
@@ -14,13 +26,113 @@ class ExcludeErrorFilter(Filter):
         return record.levelno != ERROR
 
 
-def get_logger(enabled: bool) -> Logger:
-    """Return logger with or without handlers."""
+class DeferredQueueHandler(QueueHandler):
+    """Queue handler leaving formatting to the listener thread."""
+
+    def prepare(self, record: LogRecord) -> LogRecord:
+        """Return record unformatted, the queue never leaves the process."""
+        return record
+
+
+class SampleFilter(Filter):
+    """Filter keeping one in every sample_rate records below warning and
+    at most rate_limit records a second, counting what was kept and dropped."""
+
+    def __init__(self, sample_rate: int = 1, rate_limit: int = None):
+        """Store sampling settings and start counts at zero."""
+        super().__init__()
+        self.sample_rate = max(sample_rate, 1)
+        self.rate_limit = rate_limit
+        self.lock = Lock()
+        self.seen = 0
+        self.second = 0
+        self.in_second = 0
+        self.kept = Counter()
+        self.dropped = Counter()
+
+    def filter(self, record: LogRecord) -> bool:
+        """Return True when record should be emitted, passing records already
+        sampled by is_sampled."""
+        return getattr(record, "sampled", False) or self.sample(record.levelno)
+
+    def sample(self, level: int) -> bool:
+        """Return True when a record at level should be emitted, counting it."""
+        with self.lock:
+            keep = True
+            if level < WARNING:
+                self.seen += 1
+                keep = (self.seen - 1) % self.sample_rate == 0
+            if keep and self.rate_limit is not None:
+                second = int(monotonic())
+                if second != self.second:
+                    (self.second, self.in_second) = (second, 0)
+                self.in_second += 1
+                keep = self.in_second <= self.rate_limit
+            (self.kept if keep else self.dropped)[getLevelName(level)] += 1
+        return keep
+
+    def take_counts(self) -> tuple[Counter, Counter]:
+        """Return (kept, dropped) counts by level since the last call and reset them."""
+        with self.lock:
+            counts = (self.kept, self.dropped)
+            (self.kept, self.dropped) = (Counter(), Counter())
+        return counts
+
+
+def is_sampled(message_logger: Logger, level: int) -> bool:
+    """Return True when a record at level would be emitted by message_logger, so its
+    arguments are only built for records that are kept and logged with extra=SAMPLED."""
+    return message_logger.isEnabledFor(level) and all(
+        log_filter.sample(level) for log_filter in message_logger.filters
+        if isinstance(log_filter, SampleFilter))
+
+
+def log_summary(sampler: SampleFilter, interval: float) -> None:
+    """Log one line of message log counts for the interval."""
+    (kept, dropped) = sampler.take_counts()
+    if kept or dropped:
+        levels = sorted(set(kept) | set(dropped))
+        getLogger("etl_logger").info(
+            "SUMMARY: %s messages logged in the last %ss, %s",
+            sum(kept.values()) + sum(dropped.values()), interval,
+            ", ".join(f"{level} {kept[level] + dropped[level]} "
+                      f"({dropped[level]} not shown)" for level in levels))
+
+
+def start_summaries(sampler: SampleFilter, interval: float) -> Event:
+    """Log a summary of message logs every interval seconds until the event is set."""
+    stop = Event()
+
+    def summarise():
+        while not stop.wait(interval):
+            log_summary(sampler, interval)
+
+    Thread(target=summarise, daemon=True, name="log-summary").start()
+    SUMMARIES.append(stop)
+    return stop
+
+
+def stop_logging() -> None:
+    """Stop summaries and flush every queue listener."""
+    while SUMMARIES:
+        SUMMARIES.pop().set()
+    while LISTENERS:
+        LISTENERS.pop().stop()
+
+
+def get_logger(enabled: bool, asynchronous: bool = False, sample_rate: int = 1,
+               rate_limit: int = None, summary_interval: float = None) -> Logger:
+    """Return logger with or without handlers.
+
+    Per message logs go to the etl_logger.messages child logger, which is
+    sampled and rate limited. When asynchronous, records are put on a queue
+    and written by a background thread."""
     ab = path.dirname(__file__)
     logger = getLogger("etl_logger")
     logger.setLevel(DEBUG)
     logger.propagate = False
 
+    stop_logging()
     if logger.handlers:
         logger.handlers.clear()
 
@@ -30,11 +142,27 @@ def get_logger(enabled: bool) -> Logger:
     console_handler = StreamHandler(stdout)
     console_handler.setLevel(INFO)
 
+    handlers = [console_handler]
     if enabled:
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
         console_handler.addFilter(ExcludeErrorFilter())
 
-    logger.addHandler(console_handler)
+    if asynchronous:
+        queue = SimpleQueue()
+        listener = QueueListener(queue, *handlers, respect_handler_level=True)
+        listener.start()
+        LISTENERS.append(listener)
+        handlers = [DeferredQueueHandler(queue)]
+
+    for handler in handlers:
+        logger.addHandler(handler)
+
+    message_logger = getLogger(MESSAGE_LOGGER)
+    message_logger.filters.clear()
+    sampler = SampleFilter(sample_rate, rate_limit)
+    message_logger.addFilter(sampler)
+    if summary_interval:
+        start_summaries(sampler, summary_interval)
 
     return logger
 
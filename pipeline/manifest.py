@@ -0,0 +1,43 @@
+"""Module for tracking which S3 objects have already been loaded."""
+
+from logging import getLogger
+
+from psycopg2.extras import execute_values
+from psycopg2.extensions import connection
+
+
+def get_manifest(conn: connection) -> dict[str, tuple[str, int]]:
+    """Return {key: (etag, size)} for every processed object."""
+    with conn.cursor() as curs:
+        curs.execute("SELECT object_key, etag, object_size FROM s3_manifest")
+        manifest = {key: (etag, size) for key, etag, size in curs.fetchall()}
+    conn.commit()
+    return manifest
+
+
+def get_new_objects(conn: connection, objects: list[dict]) -> list[dict]:
+    """Return objects that are not in the manifest or have changed since."""
+    manifest = get_manifest(conn)
+    new_objects = [o for o in objects
+                   if manifest.get(o['Key']) != (o['ETag'], o['Size'])]
+    getLogger("etl_logger").info("%s of %s objects are new or changed.",
+                                 len(new_objects), len(objects))
+    return new_objects
+
+
+def record_objects(conn: connection, objects: list[dict]) -> None:
+    """Record objects as processed, replacing any previous entry."""
+    if not objects:
+        return
+    with conn.cursor() as curs:
+        execute_values(curs, """
+            INSERT INTO s3_manifest (object_key, etag, object_size, last_modified)
+            VALUES %s
+            ON CONFLICT (object_key) DO UPDATE SET
+                etag = EXCLUDED.etag,
+                object_size = EXCLUDED.object_size,
+                last_modified = EXCLUDED.last_modified,
+                processed_at = CURRENT_TIMESTAMP
+            """, [(o['Key'], o['ETag'], o['Size'], o['LastModified'])
+                  for o in objects])
+    conn.commit()
@@ -0,0 +1,246 @@
+"""Module for lightweight pipeline metrics exposed as prometheus text or json."""
+
+from abc import ABC, abstractmethod
+from json import dumps
+from bisect import bisect_left
+from logging import getLogger
+from threading import Lock, Thread, Event
+from time import perf_counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+
+class Metric(ABC):
+    """Base of every metric, holding its name, help text and lock."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str):
+        """Store name and description."""
+        self.name = name
+        self.description = description
+        self.lock = Lock()
+
+    @abstractmethod
+    def samples(self) -> list[tuple[str, float]]:
+        """Return (name, value) samples for the metric."""
+
+    @abstractmethod
+    def snapshot(self):
+        """Return metric value for a json dump."""
+
+
+class Counter(Metric):
+    """Monotonically increasing count."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, description: str):
+        """Start count at zero."""
+        super().__init__(name, description)
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        """Increase count by amount."""
+        with self.lock:
+            self.value += amount
+
+    def samples(self) -> list[tuple[str, float]]:
+        """Return the current count."""
+        return [(self.name, self.value)]
+
+    def snapshot(self) -> int:
+        """Return the current count."""
+        return self.value
+
+
+class Gauge(Metric):
+    """Value that can go up and down."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str):
+        """Start value at zero."""
+        super().__init__(name, description)
+        self.value = 0
+
+    def set(self, value: float) -> None:
+        """Set the current value."""
+        self.value = value
+
+    def samples(self) -> list[tuple[str, float]]:
+        """Return the current value."""
+        return [(self.name, self.value)]
+
+    def snapshot(self) -> float:
+        """Return the current value."""
+        return self.value
+
+
+class Histogram(Metric):
+    """Distribution of observed durations in fixed buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, buckets: tuple = LATENCY_BUCKETS):
+        """Start every bucket at zero."""
+        super().__init__(name, description)
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """Record a single observation."""
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self) -> "Timer":
+        """Return a context manager observing the duration of its block."""
+        return Timer(self)
+
+    def samples(self) -> list[tuple[str, float]]:
+        """Return cumulative bucket counts, sum and count."""
+        with self.lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        samples = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+            cumulative += bucket_count
+            samples.append((f'{self.name}_bucket{{le="{bound}"}}', cumulative))
+        samples.append((f"{self.name}_sum", total))
+        samples.append((f"{self.name}_count", count))
+        return samples
+
+    def snapshot(self) -> dict:
+        """Return count, sum and mean of observations."""
+        with self.lock:
+            return {"count": self.count, "sum": round(self.sum, 6),
+                    "mean": round(self.sum / self.count, 6) if self.count else 0.0}
+
+
+class Timer:
+    """Context manager observing the duration of its block in a histogram,
+    without the generator of contextmanager."""
+
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: Histogram):
+        """Store histogram to observe."""
+        self.histogram = histogram
+        self.start = 0.0
+
+    def __enter__(self) -> None:
+        """Start timing."""
+        self.start = perf_counter()
+
+    def __exit__(self, *_) -> None:
+        """Observe time since the block was entered."""
+        self.histogram.observe(perf_counter() - self.start)
+
+
+class Registry:
+    """Collection of named metrics."""
+
+    def __init__(self):
+        """Start with no metrics."""
+        self.metrics = {}
+
+    def register(self, metric: Metric) -> Metric:
+        """Add metric to the registry and return it."""
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """Return every metric in prometheus text format."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.description}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name} {value}" for name, value in metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """Return every metric as a json serialisable dict."""
+        return {name: metric.snapshot() for name, metric in self.metrics.items()}
+
+
+REGISTRY = Registry()
+
+ROWS_READ = REGISTRY.register(Counter("etl_rows_read_total", "Rows or messages read from the source."))
+ROWS_VALID = REGISTRY.register(Counter("etl_rows_valid_total", "Rows that passed validation."))
+ROWS_INVALID = REGISTRY.register(Counter("etl_rows_invalid_total", "Rows rejected by validation."))
+ROWS_INSERTED = REGISTRY.register(Counter("etl_rows_inserted_total", "Rows inserted into the db."))
+ROWS_SKIPPED = REGISTRY.register(Counter("etl_rows_skipped_total", "Duplicate rows skipped."))
+RECENT_HITS = REGISTRY.register(Counter("etl_recent_hits_total",
+                                        "Duplicate rows skipped without a db check."))
+
+S3_DOWNLOAD_SECONDS = REGISTRY.register(Histogram("etl_s3_download_seconds",
+                                                  "Time to download an S3 object."))
+PARSE_SECONDS = REGISTRY.register(Histogram("etl_parse_seconds",
+                                            "Time to decode and validate a batch of messages."))
+LOOKUP_SECONDS = REGISTRY.register(Histogram("etl_lookup_seconds",
+                                             "Time to map a batch of rows to ids."))
+DEDUP_SECONDS = REGISTRY.register(Histogram("etl_dedup_seconds",
+                                            "Time to merge a staged batch, skipping duplicates."))
+INSERT_SECONDS = REGISTRY.register(Histogram("etl_insert_seconds",
+                                             "Time to write a batch or row to the db."))
+
+CONSUMER_LAG = REGISTRY.register(Gauge("etl_consumer_lag",
+                                       "Messages behind the end of the assigned partitions."))
+BATCH_SIZE = REGISTRY.register(Gauge("etl_batch_size", "Rows in the last loaded batch."))
+
+
+def update_consumer_lag(cons) -> None:
+    """Set consumer lag gauge from the assigned partitions of cons."""
+    lag = 0
+    for position in cons.position(cons.assignment()):
+        (_, high) = cons.get_watermark_offsets(position, cached=True)
+        if position.offset >= 0 and high >= 0:
+            lag += high - position.offset
+    CONSUMER_LAG.set(lag)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serve the registry in prometheus text format on /metrics."""
+
+    def do_GET(self):  # pylint:disable=invalid-name
+        """Return metrics or 404."""
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint:disable=redefined-builtin
+        """Keep scrapes out of the logs."""
+
+
+def start_http_server(port: int) -> ThreadingHTTPServer:
+    """Serve metrics on port from a background thread."""
+    server = ThreadingHTTPServer(("", port), MetricsHandler)
+    Thread(target=server.serve_forever, daemon=True, name="metrics-http").start()
+    getLogger("etl_logger").info("Serving metrics on port %s.", server.server_port)
+    return server
+
+
+def start_stats_dump(interval: float) -> Event:
+    """Log a json snapshot of every metric each interval seconds until the event is set."""
+    stop = Event()
+
+    def dump():
+        while not stop.wait(interval):
+            getLogger("etl_logger").info("STATS: %s", dumps(REGISTRY.snapshot()))
+
+    Thread(target=dump, daemon=True, name="metrics-dump").start()
+    return stop
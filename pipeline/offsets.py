@@ -0,0 +1,100 @@
+"""Module for kafka offsets stored in the database alongside the rows they loaded."""
+
+from logging import getLogger
+from typing import NamedTuple
+from collections.abc import Callable
+
+from psycopg2.extras import execute_values
+from psycopg2.extensions import connection, cursor
+from confluent_kafka import Consumer, Message, TopicPartition
+
+
+class StoredOffsets(NamedTuple):
+    """Next offsets to consume for partitions read by a consumer group."""
+    group: str
+    partitions: list[TopicPartition]
+
+
+def get_offsets(messages: list[Message]) -> list[TopicPartition]:
+    """Return the offsets to commit once messages are loaded."""
+    offsets = {}
+    for message in messages:
+        if message.error():
+            continue
+        key = (message.topic(), message.partition())
+        offsets[key] = max(offsets.get(key, -1), message.offset() + 1)
+    return [TopicPartition(topic, partition, offset)
+            for (topic, partition), offset in offsets.items()]
+
+
+def get_positions(cons: Consumer) -> list[TopicPartition]:
+    """Return the next offset to consume of every assigned partition that has been read."""
+    return [partition for partition in cons.position(cons.assignment())
+            if partition.offset >= 0]
+
+
+def save_offsets(curs: cursor, offsets: StoredOffsets) -> None:
+    """Record offsets in the transaction of curs, never moving a partition backwards."""
+    if not offsets.partitions:
+        return
+    execute_values(curs, """
+        INSERT INTO consumer_offset (consumer_group, topic, topic_partition, next_offset)
+        VALUES %s
+        ON CONFLICT (consumer_group, topic, topic_partition) DO UPDATE
+        SET next_offset = GREATEST(consumer_offset.next_offset, EXCLUDED.next_offset),
+            updated_at = CURRENT_TIMESTAMP
+        """, [(offsets.group, partition.topic, partition.partition, partition.offset)
+              for partition in offsets.partitions])
+
+
+def has_offsets(conn: connection) -> bool:
+    """Return True if the database has a consumer_offset table to store offsets in."""
+    with conn.cursor() as curs:
+        curs.execute("SELECT 1 FROM pg_tables WHERE tablename = 'consumer_offset'")
+        exists = bool(curs.fetchall())
+    conn.commit()
+    return exists
+
+
+def load_offsets(conn: connection, group: str,
+                 partitions: list[TopicPartition]) -> dict[tuple[str, int], int]:
+    """Return stored next offsets of the group by (topic, partition)."""
+    with conn.cursor() as curs:
+        curs.execute("""
+            SELECT topic, topic_partition, next_offset FROM consumer_offset
+            WHERE consumer_group = %s AND topic = ANY(%s)
+            """, (group, sorted({partition.topic for partition in partitions})))
+        rows = curs.fetchall()
+    conn.commit()
+    return {(topic, partition): offset for topic, partition, offset in rows}
+
+
+def get_on_assign(conn: connection, group: str,
+                  run: Callable = None) -> Callable[[Consumer, list[TopicPartition]], None]:
+    """Return on_assign callback starting each partition at its stored offset.
+
+    Partitions without a stored offset start from the broker committed
+    offset, or auto.offset.reset when there is none. Given run, such as
+    LoaderPool.run, offsets are read with it instead of on conn."""
+    def on_assign(cons: Consumer, partitions: list[TopicPartition]) -> None:
+        stored = (load_offsets(conn, group, partitions) if run is None
+                  else run(load_offsets, group, partitions))
+        for partition in partitions:
+            partition.offset = stored.get((partition.topic, partition.partition),
+                                          partition.offset)
+        cons.assign(partitions)
+        getLogger("etl_logger").info("Assigned %s partitions, %s from stored offsets.",
+                                     len(partitions),
+                                     sum((p.topic, p.partition) in stored for p in partitions))
+    return on_assign
+
+
+def subscribe(cons: Consumer, conn: connection, topic: str, group: str,
+              run: Callable = None) -> bool:
+    """Subscribe cons to topic, return True when offsets are stored in the database
+    and assigned partitions start from them, read with run when given."""
+    if not (has_offsets(conn) if run is None else run(has_offsets)):
+        cons.subscribe([topic])
+        return False
+    cons.subscribe([topic], on_assign=get_on_assign(conn, group, run))
+    return True
@@ -0,0 +1,95 @@
+"""Module for creating monthly partitions of the interaction tables as rows arrive."""
+
+from re import fullmatch
+from datetime import date, datetime, timedelta
+from logging import getLogger
+from collections.abc import Sequence
+
+from psycopg2.sql import SQL, Identifier
+from psycopg2.extensions import connection, cursor
+
+
+PARTITIONS = {}
+
+
+def get_partition_name(table: str, month: date) -> str:
+    """Return name of the partition of table holding month."""
+    return f"{table}_{month:%Y_%m}"
+
+
+def get_date(value) -> date:
+    """Return date of a timestamp string, datetime or pandas Timestamp."""
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10])
+    if isinstance(value, datetime):
+        return value.date()
+    return value.to_pydatetime().date()
+
+
+def next_month(month: date) -> date:
+    """Return first day of the month after month."""
+    return (month.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def get_months(first: date, last: date) -> list[date]:
+    """Return first day of every month from first to last."""
+    months = []
+    month = first.replace(day=1)
+    while month <= last:
+        months.append(month)
+        month = next_month(month)
+    return months
+
+
+def load_partitions(curs: cursor, table: str) -> set[date] | None:
+    """Return months with a partition of table, None when table is not partitioned."""
+    curs.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass",
+                 (table,))
+    if not curs.fetchall():
+        return None
+    curs.execute("""
+        SELECT child.relname FROM pg_inherits
+        JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = %s::regclass
+        """, (table,))
+    months = set()
+    for (name, ) in curs.fetchall():
+        if match := fullmatch(rf"{table}_(\d{{4}})_(\d{{2}})", name):
+            months.add(date(int(match[1]), int(match[2]), 1))
+    return months
+
+
+def create_partition(curs: cursor, table: str, month: date) -> None:
+    """Create the partition of table for month unless another loader already has."""
+    curs.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (table,))
+    curs.execute(
+        SQL("""
+            CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {table}
+            FOR VALUES FROM (%s) TO (%s)
+            """).format(partition=Identifier(get_partition_name(table, month)),
+                        table=Identifier(table)),
+        (f"{month} 00:00:00+00", f"{next_month(month)} 00:00:00+00"))
+
+
+def ensure_partitions(conn: connection, table: str, event_times: Sequence) -> None:
+    """Create any missing monthly partitions of table covering event_times.
+
+    Naive timestamps are stored in the session time zone, so the day either
+    side of the range is covered too."""
+    if table not in PARTITIONS:
+        with conn.cursor() as curs:
+            PARTITIONS[table] = load_partitions(curs, table)
+        conn.commit()
+    known = PARTITIONS[table]
+    if known is None or not len(event_times):
+        return
+    missing = [month for month in get_months(get_date(min(event_times)) - timedelta(days=1),
+                                             get_date(max(event_times)) + timedelta(days=1))
+               if month not in known]
+    if missing:
+        with conn.cursor() as curs:
+            for month in missing:
+                create_partition(curs, table, month)
+        conn.commit()
+        known.update(missing)
+        getLogger("etl_logger").info("Created %s partitions of %s.", len(missing), table)
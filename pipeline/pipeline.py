@@ -1,21 +1,52 @@
 """Extract, transform and load data from S3 to local db."""
 
-from os import environ as ENV
-from datetime import datetime
+from os import environ as ENV, getpid, path
+from datetime import date, datetime
 from logging import getLogger
 from argparse import Namespace, ArgumentParser
-from json import loads
+from multiprocessing.synchronize import Event
+from time import monotonic
+from itertools import islice, chain
+from re import fullmatch
+from collections.abc import Callable
+from typing import TypeVar
 
 from dotenv import load_dotenv
 from boto3 import client
 from psycopg2 import connect
-from psycopg2.sql import SQL, Identifier
+from psycopg2.pool import ThreadedConnectionPool
 from psycopg2.extensions import connection, cursor
 from progress.bar import Bar
-
-from extract import get_files, get_data_from_file
-from consumer import get_consumer, log_message, get_message_data
-from logger import get_logger
+from confluent_kafka import Consumer
+
+from extract import (get_files, get_data_from_file, get_data_chunks, get_parquet_chunks,
+                     get_objects_from_bucket, get_object_names_from_bucket,
+                     get_data_path, stream_bodies, stream_numbered_rows, CSV_PATTERN, FILE_FORMATS,
+                     TimeWindow, get_window_time, may_contain)
+from consumer import get_consumer, get_producer, read_messages
+from logger import get_logger, stop_logging
+from dimensions import DimensionCache
+from loader import (upload_batches, get_sourced_batches, load_batch, insert_row,
+                    LOAD_METHODS)
+from manifest import get_new_objects, record_objects
+from supervisor import supervise
+from engine import run_engine, run_bucket, run_cluster
+from pool import LoaderPool, SingleConnectionPool
+from rollups import rebuild_rollups
+from offsets import StoredOffsets, get_positions, subscribe
+from recent import RecentEvents, get_key
+from shards import upload_sharded, SHARD_KEYS
+from transform import (read_frames, read_parquet_frames, limit_frames, filter_frames,
+                       upload_frames)
+from checkpoint import (Checkpoint, get_source_key, get_checkpoint, get_checkpoints,
+                        has_checkpoints, save_checkpoint)
+from deadletter import (reject, set_sink, get_sink, close_sink, flush_dead_letters,
+                        get_dead_letter_path, get_worker_path, get_row_sources, SINK_TYPES)
+from metrics import (ROWS_READ, ROWS_INVALID, ROWS_INSERTED, ROWS_SKIPPED, RECENT_HITS,
+                     update_consumer_lag, start_http_server, start_stats_dump)
+
+
+T = TypeVar("T")
 
 
 def get_connection() -> connection:
@@ -29,6 +60,30 @@ def get_connection() -> connection:
     )
 
 
+def get_pool(size: int) -> LoaderPool:
+    """Get pool of size connections to database for loading batches"""
+    return LoaderPool(ThreadedConnectionPool(
+        size, size,
+        user=ENV["DATABASE_USERNAME"],
+        password=ENV["DATABASE_PASSWORD"],
+        host=ENV["DATABASE_IP"],
+        port=ENV["DATABASE_PORT"],
+        dbname=ENV["DATABASE_NAME"]
+    ), size)
+
+
+def get_loader(conn: connection) -> LoaderPool:
+    """Get pool of the single connection conn for sequential loads, replacing it
+    with a new connection after it is lost"""
+    return LoaderPool(SingleConnectionPool(get_connection, conn), 1)
+
+
+def run_load(conn: connection, loader: LoaderPool, function: Callable[..., T], *args) -> T:
+    """Return function(conn, *args), run by loader to retry on a new connection
+    when there is one."""
+    return function(conn, *args) if loader is None else loader.run(function, *args)
+
+
 def get_cursor(conn: connection) -> cursor:
     """Get cursor from database connection."""
     return conn.cursor()
@@ -41,128 +96,347 @@ def get_client():
                   aws_secret_access_key=ENV["AWS_SECRET_ACCESS_KEY"])
 
 
-def upload_data_from_cluster(conn: connection, rows: int = None):
-    """Upload data from kafka cluster"""
-    cons = get_consumer()
-    cons.subscribe(loads([ENV["TOPIC"]]))
-    i = 0
-    is_done = False
-    while not is_done:
-        message = cons.poll(1.0)
-        if message:
-            log_message(message)
-            data = get_message_data(message)
-            if data is not None:
-                upload_message(conn, data)
-        if i == rows:
-            is_done = True
-        i += 1
-
-
-def upload_message(conn: connection, row: list) -> None:
-    """Upload the list data to db."""
-    logger = getLogger("etl_logger")
-    row[0] = datetime.strftime(
-        datetime.fromisoformat(row[0]), r'%Y-%m-%d %H:%M:%S')
-
-    if row[2] == -1:
-        if input_row(conn, row, 'request'):
-            logger.info("Message has been uploaded as request entry.")
-        else:
-            logger.warning(
-                "Skipping Message: Already exists in request_interaction table.")
-    elif input_row(conn, row, 'rating'):
-        logger.info("Message has been uploaded as rating entry.")
-    else:
-        logger.warning(
-            "Skipping Message: Already exists in rating_interaction table.")
-
+def flush_messages(conn: connection, cons: Consumer, buffer: list[list],
+                   cache: DimensionCache, group: str = None,
+                   recent: RecentEvents = None, loader: LoaderPool = None) -> None:
+    """Load buffered rows in one transaction, then commit consumer offsets.
 
-def upload_data(conn: connection, data: list[list]) -> None:
-    """Upload the list data to db."""
+    With a consumer group the offsets are also stored in the load transaction."""
+    logger = getLogger("etl_logger")
+    offsets = StoredOffsets(group, get_positions(cons)) if group else None
+    if buffer or offsets:
+        (inserted, skipped) = load_batch(conn, buffer, cache, offsets=offsets, recent=recent,
+                                         load=None if loader is None else loader.load)
+        logger.info("Uploaded batch of %s messages, %s skipped.",
+                    inserted, skipped)
+    flush_dead_letters()
+    cons.commit(asynchronous=False)
+    update_consumer_lag(cons)
+
+
+def upload_data_from_cluster(conn: connection, rows: int = None,
+                             cache: DimensionCache = None, batch_size: int = 1000,
+                             flush_interval: float = 5.0, stop: Event = None,
+                             recent: RecentEvents = None, loader: LoaderPool = None):
+    """Upload data from kafka cluster in batches of batch_size messages."""
+    load_run = None if loader is None else loader.run
+    cache = cache or DimensionCache(conn, load_run)
+    cons = get_consumer()
+    group = ENV["GROUP"] if subscribe(cons, conn, ENV["TOPIC"], ENV["GROUP"], load_run) else None
+    buffer = []
+    pending = 0
+    consumed = 0
+    last_flush = monotonic()
+    try:
+        while (rows is None or consumed < rows) and not (stop and stop.is_set()):
+            limit = batch_size if rows is None else min(batch_size, rows - consumed)
+            messages = cons.consume(num_messages=limit, timeout=1.0)
+            buffer.extend(read_messages(messages))
+            consumed += len(messages)
+            pending += len(messages)
+            ROWS_READ.inc(len(messages))
+            if pending and (len(buffer) >= batch_size
+                            or monotonic() - last_flush >= flush_interval):
+                flush_messages(conn, cons, buffer, cache, group, recent, loader)
+                buffer = []
+                pending = 0
+                last_flush = monotonic()
+        if pending:
+            flush_messages(conn, cons, buffer, cache, group, recent, loader)
+    finally:
+        cons.close()
+
+
+def start_dead_letters(arguments: Namespace, worker: bool = False) -> None:
+    """Set the dead-letter sink from the cli options."""
+    if not arguments.dead_letter:
+        return
+    file_path = arguments.dead_letter_path or get_dead_letter_path()
+    if worker:
+        file_path = get_worker_path(file_path, getpid())
+    set_sink(get_sink(arguments.dead_letter, arguments.batch_size, file_path,
+                      get_connection() if arguments.dead_letter == "table" else None,
+                      get_producer() if arguments.dead_letter == "topic" else None))
+
+
+def start_logging(arguments: Namespace) -> None:
+    """Set up the etl logger from the logging cli options."""
+    get_logger(arguments.log, arguments.async_log, arguments.log_sample,
+               arguments.log_rate_limit, arguments.log_summary)
+
+
+def get_recent_events(arguments: Namespace) -> RecentEvents | None:
+    """Return the recent events index from the cli options, None when disabled."""
+    if not arguments.dedup_window:
+        return None
+    return RecentEvents(arguments.dedup_window, arguments.dedup_size)
+
+
+def run_stream_worker(arguments: Namespace, number: int, stop: Event) -> None:
+    """Run a stream consumer with its own db connection until stopped, serving its
+    metrics on the metrics port plus its worker number."""
+    start_logging(arguments)
+    if arguments.metrics_port is not None:
+        start_http_server(arguments.metrics_port + number)
+    if arguments.stats_interval:
+        start_stats_dump(arguments.stats_interval)
+    start_dead_letters(arguments, worker=True)
+    conn = get_connection()
+    loader = get_loader(conn)
+    try:
+        upload_data_from_cluster(conn, arguments.rows, DimensionCache(conn, loader.run),
+                                 arguments.batch_size, arguments.flush_interval, stop,
+                                 get_recent_events(arguments), loader)
+    finally:
+        loader.close()
+        close_sink()
+        stop_logging()
+
+
+def upload_data(conn: connection, data: list[list], cache: DimensionCache = None,
+                checkpoint: Checkpoint = None, checkpoint_every: int = 10000,
+                source: Checkpoint = None, loader: LoaderPool = None) -> None:
+    """Upload the list data to db.
+
+    Given the checkpoint of the first row, a checkpoint is saved after every
+    checkpoint_every rows in the insert transaction of the last of them, or on
+    its own when that row is rejected. Rejected rows are keyed by their offset
+    in the source of the source checkpoint."""
     logger = getLogger('etl_logger')
+    cache = cache or DimensionCache(conn)
     skipped = 0
+    ROWS_READ.inc(len(data))
     with Bar('Uploading Rows...', max=len(data)) as prog_bar:
-        for row in data:
-            if row[2] == '-1':
-                if not input_row(conn, row, 'request'):
+        for number, row in enumerate(data, 1):
+            point = None
+            if checkpoint is not None and (number % checkpoint_every == 0 or number == len(data)):
+                point = checkpoint._replace(row_offset=checkpoint.row_offset + number,
+                                            byte_offset=None)
+            try:
+                if not input_row(conn, row, 'request' if row[2] == '-1' else 'rating', cache,
+                                 loader=loader, checkpoint=point):
                     skipped += 1
-            elif not input_row(conn, row, 'rating'):
-                skipped += 1
+            except (KeyError, ValueError, IndexError) as err:
+                ROWS_INVALID.inc()
+                reject("rows", None if source is None
+                       else f"{source.source}:{source.row_offset + number - 1}",
+                       f"{type(err).__name__}: {err}", row)
+                if point is not None:
+                    run_load(conn, loader, commit_checkpoint, point)
             prog_bar.next()
     if skipped:
         logger.info("%s Rows have been skipped.", skipped)
 
 
-def is_duplicate(conn: connection,
-                 table: str, at: datetime,
-                 exhibit_id: int, table_id: int) -> bool:
-    """Return True when datapoint is already present in db."""
+def commit_checkpoint(conn: connection, checkpoint: Checkpoint) -> None:
+    """Save checkpoint in a transaction of its own."""
     with get_cursor(conn) as curs:
-        curs.execute(
-            SQL("""
-            SELECT * FROM {table} 
-            WHERE {pkey} = %s AND exhibition_id = %s AND event_at = %s
-            """).format(table=Identifier(f"{table}_interaction"),
-                        pkey=Identifier(f"{table}_id")),
-            (table_id, exhibit_id, at))
-        if curs.fetchone():
-            return True
-        return False
+        save_checkpoint(curs, checkpoint)
+    conn.commit()
 
 
-def input_row(conn: connection, row: list, table_name: str) -> bool:
-    """Return True if row was successfully input into database."""
+def insert_values(conn: connection, table_name: str, values: tuple,
+                  checkpoint: Checkpoint = None) -> bool:
+    """Return True if values were inserted into table_name in a transaction of their own,
+    along with the checkpoint reached after them."""
     with get_cursor(conn) as curs:
-        req_map = {'0.0': 0, '1.0': 1, 0: 0, 1: 1}
-        row_value = req_map[row[3]] if table_name == "request" else int(row[2])
-        curs.execute(
-            SQL("SELECT {field} from {table} where {pkey} = %s").format(
-                field=Identifier(f"{table_name}_id"),
-                table=Identifier(table_name),
-                pkey=Identifier(f"{table_name}_value")),
-            (row_value, ))
-        row_id = curs.fetchone()
-        conn.commit()
-
-        curs.execute("SELECT exhibition_id from exhibition where public_id = %s",
-                     (f"EXH_0{row[1]}", ))
-        exh_id = curs.fetchone()
-
-        dt_row = datetime.strptime(row[0], r'%Y-%m-%d %H:%M:%S')
-
-        if not is_duplicate(conn, table_name, dt_row, exh_id, row_id):
-            curs.execute(SQL("""
-                            INSERT INTO {table} (exhibition_id, {field}, event_at)
-                            VALUES (%s, %s, %s)
-                            """).format(table=Identifier(f"{table_name}_interaction"),
-                                        field=Identifier(f"{table_name}_id")),
-                         (exh_id[0], row_id[0], dt_row)
-                         )
-            conn.commit()
-            return True
+        inserted = insert_row(curs, table_name, values)
+        if checkpoint is not None:
+            save_checkpoint(curs, checkpoint)
+    conn.commit()
+    return inserted
+
+
+def input_row(conn: connection, row: list, table_name: str, cache: DimensionCache = None,
+              recent: RecentEvents = None, loader: LoaderPool = None,
+              checkpoint: Checkpoint = None) -> bool:
+    """Return True if row was successfully input into database, skipping rows
+    in the recent events index without a database round trip.
+
+    A checkpoint is saved in the insert transaction of row."""
+    cache = cache or DimensionCache(conn)
+    req_map = {'0.0': 0, '1.0': 1, 0: 0, 1: 1}
+    row_value = req_map[row[3]] if table_name == "request" else int(row[2])
+    row_id = cache.get_value_id(table_name, row_value)
+    exh_id = cache.get_exhibition_id(row[1])
+
+    dt_row = datetime.strptime(row[0], r'%Y-%m-%d %H:%M:%S')
+    key = get_key(table_name, (exh_id, row_id, dt_row))
+    if recent is not None and key in recent:
+        RECENT_HITS.inc()
+        ROWS_SKIPPED.inc()
+        if checkpoint is not None:
+            run_load(conn, loader, commit_checkpoint, checkpoint)
         return False
 
+    inserted = run_load(conn, loader, insert_values, table_name, (exh_id, row_id, dt_row),
+                        checkpoint)
+    if recent is not None:
+        recent.add(key)
+    (ROWS_INSERTED if inserted else ROWS_SKIPPED).inc()
+    return inserted
+
+
+def upload_collated_file(conn: connection, arguments: Namespace, cache: DimensionCache,
+                         checkpoint: Checkpoint, loader: LoaderPool = None) -> None:
+    """Upload the collated file from checkpoint, checkpointing each committed batch
+    when the database has a checkpoint table."""
+    parquet = arguments.file_format == 'parquet'
+    saving = run_load(conn, loader, has_checkpoints)
+    if arguments.bulk and arguments.vectorized:
+        frames = (read_parquet_frames(arguments.batch_size, arguments.rows, checkpoint.row_offset,
+                                      checkpoint.source)
+                  if parquet else read_frames(get_data_path('csv'), arguments.batch_size,
+                                              arguments.rows, checkpoint.row_offset,
+                                              checkpoint.source))
+        upload_frames(conn, frames, cache, arguments.load_method,
+                      checkpoint if saving else None, None if loader is None else loader.load)
+    elif arguments.bulk:
+        if parquet:
+            chunks = get_parquet_chunks(arguments.batch_size, arguments.rows,
+                                        checkpoint.row_offset)
+        elif checkpoint.byte_offset:
+            chunks = get_data_chunks(arguments.batch_size, arguments.rows,
+                                     start_byte=checkpoint.byte_offset)
+        else:
+            chunks = get_data_chunks(arguments.batch_size, arguments.rows,
+                                     checkpoint.row_offset)
+        batches = ((rows, point, get_row_sources(point.source, point.row_offset - len(rows)))
+                   for rows, point in get_checkpoints(chunks, checkpoint, not parquet))
+        if arguments.shards > 1:
+            upload_sharded(((rows, sources) for rows, _, sources in batches), cache,
+                           get_connection, arguments.shards, arguments.shard_by,
+                           arguments.batch_size, arguments.load_method)
+            return
+        if not saving:
+            batches = ((rows, None, sources) for rows, _, sources in batches)
+        upload_batches(conn, batches, cache, arguments.load_method,
+                       None if loader is None else loader.load)
+    else:
+        data = get_data_from_file(arguments.rows, arguments.file_format, checkpoint.row_offset)
+        upload_data(conn, data, cache, checkpoint if saving else None, arguments.batch_size,
+                    checkpoint, loader)
+
+
+def upload_data_from_bucket(conn: connection, arguments: Namespace,
+                            cache: DimensionCache, loader: LoaderPool = None) -> None:
+    """Upload data from s3 bucket, only new objects when incremental and only
+    objects under prefix that may hold rows in the time window when given."""
+    logger = getLogger("etl_logger")
+    s_client = get_client()
+    window = TimeWindow(arguments.start, arguments.end)
+
+    objects = None
+    files = None
+    if arguments.incremental or arguments.prefix or window.start:
+        objects = [o for o in get_objects_from_bucket(s_client, arguments.bucket,
+                                                      arguments.prefix)
+                   if may_contain(o, window)]
+        if arguments.incremental:
+            objects = run_load(conn, loader, get_new_objects, objects)
+        files = [o['Key'] for o in objects]
+
+    if arguments.async_engine:
+        if files is None:
+            files = get_object_names_from_bucket(s_client, arguments.bucket)
+        pool = get_pool(arguments.load_workers)
+        try:
+            run_engine(run_bucket(s_client, arguments.bucket,
+                                  [f for f in files if fullmatch(CSV_PATTERN, f)],
+                                  pool, cache, arguments.rows,
+                                  arguments.download_workers, arguments.transform_workers,
+                                  arguments.load_workers, arguments.queue_size,
+                                  arguments.batch_size, arguments.load_method, window))
+        finally:
+            pool.close()
+    elif arguments.direct and arguments.vectorized:
+        frames = filter_frames(chain.from_iterable(
+            read_frames(body, arguments.batch_size, source_key=key)
+            for key, body in stream_bodies(s_client, arguments.bucket, files)), window)
+        upload_frames(conn, limit_frames(frames, arguments.rows), cache,
+                      arguments.load_method, load=None if loader is None else loader.load)
+    elif arguments.direct:
+        data = stream_numbered_rows(s_client, arguments.bucket, files, window)
+        if arguments.rows:
+            data = islice(data, arguments.rows)
+        batches = get_sourced_batches(data, arguments.batch_size)
+        if arguments.shards > 1:
+            upload_sharded(batches, cache, get_connection, arguments.shards, arguments.shard_by,
+                           arguments.batch_size, arguments.load_method)
+        else:
+            upload_batches(conn, ((batch, None, sources) for batch, sources in batches),
+                           cache, arguments.load_method, None if loader is None else loader.load)
+    else:
+        file_path = get_data_path(arguments.file_format)
+        if arguments.resume and path.exists(file_path):
+            logger.info("Resuming from downloaded file %s.", file_path)
+        else:
+            file_names = get_files(s_client, arguments.bucket, arguments.download_workers,
+                                   files, arguments.file_format, window)
+            logger.info("All files downloaded: %s", file_names)
+        checkpoint = Checkpoint(get_source_key(file_path))
+        if arguments.resume:
+            checkpoint = run_load(conn, loader, get_checkpoint, checkpoint.source)
+            logger.info("Resuming after row %s.", checkpoint.row_offset)
+        upload_collated_file(conn, arguments, cache, checkpoint, loader)
+    logger.info("All data uploaded!")
+
+    if arguments.incremental and objects and not arguments.rows and window == TimeWindow():
+        run_load(conn, loader, record_objects, objects)
+        logger.info("%s objects recorded in manifest.", len(objects))
+
 
 def etl(arguments: Namespace) -> None:
     """Extract, transform and load data from s3 bucket into db."""
-    conn = get_connection()
-
     logger = getLogger("etl_logger")
 
     logger.info("Starting ETL...")
 
-    if arguments.stream:
-        upload_data_from_cluster(conn, arguments.rows)
-    else:
-        s_client = get_client()
-        file_names = get_files(s_client, arguments.bucket)
-        logger.info("All files downloaded: %s", file_names)
-        data = get_data_from_file(arguments.rows)
-        upload_data(conn, data)
-        logger.info("All data uploaded!")
+    if arguments.rebuild_rollups:
+        conn = get_connection()
+        try:
+            rebuild_rollups(conn, arguments.rebuild_since)
+        finally:
+            conn.close()
+        return
 
-    conn.close()
+    if arguments.stream and arguments.workers > 1:
+        supervise(run_stream_worker, (arguments,), arguments.workers)
+        return
+
+    if arguments.metrics_port is not None:
+        start_http_server(arguments.metrics_port)
+    if arguments.stats_interval:
+        start_stats_dump(arguments.stats_interval)
+    start_dead_letters(arguments)
+
+    conn = get_connection()
+    loader = get_loader(conn)
+    try:
+        cache = DimensionCache(conn, loader.run)
+        cache.refresh()
+
+        if arguments.stream and arguments.async_engine:
+            cons = get_consumer()
+            group = (ENV["GROUP"] if subscribe(cons, conn, ENV["TOPIC"], ENV["GROUP"], loader.run)
+                     else None)
+            pool = get_pool(1)
+            try:
+                run_engine(run_cluster(cons, pool, cache, arguments.rows,
+                                       arguments.queue_size, arguments.batch_size,
+                                       arguments.load_method, group,
+                                       get_recent_events(arguments)))
+            finally:
+                cons.close()
+                pool.close()
+        elif arguments.stream:
+            upload_data_from_cluster(conn, arguments.rows, cache,
+                                     arguments.batch_size, arguments.flush_interval,
+                                     recent=get_recent_events(arguments), loader=loader)
+        else:
+            upload_data_from_bucket(conn, arguments, cache, loader)
+    finally:
+        loader.close()
 
 
 def get_arguments() -> Namespace:
@@ -181,8 +455,82 @@ def get_arguments() -> Namespace:
                         help='Flag to set true for storing error logs in an output file.')
     parser.add_argument('-s', '--stream', action='store_true',
                         help='Flag to set true for changing the data source from s3 bucket to kafka cluster.')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='Number of consumer processes to run in stream mode.')
+    parser.add_argument('-d', '--direct', action='store_true',
+                        help='Flag to set true for streaming s3 objects straight into the db.')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='Flag to set true for only loading objects not in the manifest.')
+    parser.add_argument('--download-workers', type=int, default=8,
+                        help='Number of threads downloading objects from the s3 bucket.')
+    parser.add_argument('-a', '--async-engine', action='store_true',
+                        help='Flag to set true for running the pipeline as async stages.')
+    parser.add_argument('--transform-workers', type=int, default=1,
+                        help='Number of transform workers in the async engine.')
+    parser.add_argument('--load-workers', type=int, default=2,
+                        help='Size of the db connection pool loading s3 data in the async engine.')
+    parser.add_argument('--queue-size', type=int, default=8,
+                        help='Number of batches each async engine queue holds before blocking.')
+    parser.add_argument('-B', '--bulk', action='store_true',
+                        help='Flag to set true for loading bucket data in batches.')
+    parser.add_argument('-V', '--vectorized', action='store_true',
+                        help='Flag to set true for transforming bulk data as columns with pandas.')
+    parser.add_argument('-f', '--file-format', choices=FILE_FORMATS, default='csv',
+                        help='Format of the collated history file, parquet is compressed.')
+    parser.add_argument('-R', '--resume', action='store_true',
+                        help='Flag to set true for resuming a load of the collated file.')
+    parser.add_argument('--from', dest='start', type=get_window_time,
+                        help='Only load rows with an event time from this iso time, '
+                        'skipping objects last modified before it.')
+    parser.add_argument('--to', dest='end', type=get_window_time,
+                        help='Only load rows with an event time before this iso time.')
+    parser.add_argument('--prefix', type=str,
+                        help='Only list and load bucket objects with keys starting with prefix.')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='Worker processes loading bulk or direct rows in parallel, '
+                        'each with its own connection.')
+    parser.add_argument('--shard-by', choices=SHARD_KEYS, default='time',
+                        help='Split rows between shards by exhibition or by day of the event.')
+    parser.add_argument('--batch-size', type=int, default=10000,
+                        help='Number of rows written per transaction in bulk or stream mode.')
+    parser.add_argument('--flush-interval', type=float, default=5.0,
+                        help='Seconds to buffer stream messages before loading them.')
+    parser.add_argument('--dedup-window', type=float, default=600,
+                        help='Seconds of stream events kept in memory to skip redelivered '
+                        'duplicates without a db check, 0 to disable.')
+    parser.add_argument('--dedup-size', type=int, default=100000,
+                        help='Most stream events kept in memory for skipping duplicates.')
+    parser.add_argument('--load-method', choices=list(LOAD_METHODS), default='copy',
+                        help='Statement used to write batches in bulk mode.')
+    parser.add_argument('--metrics-port', type=int,
+                        help='Port serving prometheus metrics on /metrics.')
+    parser.add_argument('--stats-interval', type=float,
+                        help='Seconds between json stats lines in the log.')
+    parser.add_argument('--async-log', action='store_true',
+                        help='Flag to set true for writing logs from a background thread.')
+    parser.add_argument('--log-sample', type=int, default=1,
+                        help='Log one in every N per message info logs.')
+    parser.add_argument('--log-rate-limit', type=int,
+                        help='Most per message logs written each second.')
+    parser.add_argument('--log-summary', type=float,
+                        help='Seconds between summary lines counting per message logs.')
+    parser.add_argument('--dead-letter', choices=SINK_TYPES,
+                        help='Where rejected messages and rows are written.')
+    parser.add_argument('--dead-letter-path', type=str,
+                        help='Path of the gzip dead-letter file.')
+    parser.add_argument('--rebuild-rollups', action='store_true',
+                        help='Flag to set true for rebuilding the rollup tables.')
+    parser.add_argument('--rebuild-since', type=date.fromisoformat,
+                        help='Only rebuild rollups from this date, YYYY-MM-DD.')
     parser.add_argument('-h', '--help', action='help')
     arguments = parser.parse_args()
+    if arguments.resume and (arguments.direct or arguments.async_engine):
+        parser.error("--resume only resumes collated file loads, not -d or -a")
+    if arguments.shards > 1 and not (arguments.bulk or arguments.direct):
+        parser.error("--shards only loads -B or -d rows")
+    if arguments.shards > 1 and (arguments.vectorized or arguments.async_engine
+                                 or arguments.resume):
+        parser.error("--shards cannot be used with -V, -a or --resume")
 
     return arguments
 
@@ -193,11 +541,15 @@ def run():
 
     args = get_arguments()
 
-    get_logger(args.log)
+    start_logging(args)
     logger = getLogger("etl_logger")
     logger.info("Logger Initiated.")
 
-    etl(args)
+    try:
+        etl(args)
+    finally:
+        close_sink()
+        stop_logging()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,96 @@
+"""Module for a pool of database connections shared by loaders."""
+
+from time import sleep
+from logging import getLogger
+from threading import BoundedSemaphore
+from typing import TypeVar
+from contextlib import contextmanager
+from collections.abc import Callable, Iterator
+
+from psycopg2 import OperationalError, InterfaceError
+from psycopg2.pool import AbstractConnectionPool
+from psycopg2.extensions import connection
+
+from loader import load_grouped
+from checkpoint import Checkpoint
+from offsets import StoredOffsets
+
+
+T = TypeVar("T")
+
+
+class SingleConnectionPool:
+    """Pool of one connection for a sequential loader, opened again with connect
+    once it has been closed."""
+
+    def __init__(self, connect: Callable[[], connection], conn: connection = None):
+        """Start with conn when given, otherwise connect on first use."""
+        self.connect = connect
+        self.conn = conn
+
+    def getconn(self) -> connection:
+        """Return the connection, opening a new one if it was closed."""
+        if self.conn is None or self.conn.closed:
+            self.conn = self.connect()
+        return self.conn
+
+    def putconn(self, conn: connection, close: bool = False) -> None:
+        """Take back conn, closing it when it was lost."""
+        if close:
+            conn.close()
+            self.conn = None
+
+    def closeall(self) -> None:
+        """Close the connection."""
+        if self.conn is not None:
+            self.conn.close()
+
+
+class LoaderPool:
+    """Pool of connections loading batches, reconnecting after lost connections."""
+
+    def __init__(self, pool: AbstractConnectionPool, size: int,
+                 retries: int = 3, retry_delay: float = 1.0):
+        """Wrap pool so at most size connections are handed out at once."""
+        self.pool = pool
+        self.slots = BoundedSemaphore(size)
+        self.retries = retries
+        self.retry_delay = retry_delay
+
+    @contextmanager
+    def connection(self) -> Iterator[connection]:
+        """Yield a pooled connection, discarding it if it was lost."""
+        with self.slots:
+            conn = self.pool.getconn()
+            broken = False
+            try:
+                yield conn
+            except (OperationalError, InterfaceError):
+                broken = True
+                raise
+            finally:
+                self.pool.putconn(conn, close=broken or bool(conn.closed))
+
+    def run(self, function: Callable[..., T], *args, **kwargs) -> T:
+        """Return function(conn, *args, **kwargs) run on a pooled connection,
+        retrying on a new connection after the connection was lost."""
+        logger = getLogger("etl_logger")
+        for attempt in range(self.retries):
+            try:
+                with self.connection() as conn:
+                    return function(conn, *args, **kwargs)
+            except (OperationalError, InterfaceError) as err:
+                logger.warning("Lost database connection, retrying batch: %s", err)
+                sleep(self.retry_delay * 2 ** attempt)
+        with self.connection() as conn:
+            return function(conn, *args, **kwargs)
+
+    def load(self, grouped: dict[str, list[tuple]], method: str = 'copy',
+             offsets: StoredOffsets = None, checkpoint: Checkpoint = None) -> tuple[int, int]:
+        """Return (inserted, skipped) for grouped rows and the checkpoint or kafka
+        offsets reached after them, retrying on a new connection."""
+        return self.run(load_grouped, grouped, method, checkpoint, offsets)
+
+    def close(self) -> None:
+        """Close every pooled connection."""
+        self.pool.closeall()
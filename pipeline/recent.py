@@ -0,0 +1,64 @@
+"""Module for an in-memory index of recently loaded events to skip redelivered messages."""
+
+from datetime import datetime
+from collections import OrderedDict
+
+from metrics import RECENT_HITS
+
+
+def get_key(table_name: str, values: tuple) -> tuple:
+    """Return (table, exhibition id, value id, event time) identifying a loaded event."""
+    event_at = values[2]
+    if isinstance(event_at, str):
+        event_at = datetime.fromisoformat(event_at)
+    return (table_name, values[0], values[1], event_at)
+
+
+class RecentEvents:
+    """Events loaded within window seconds of the newest one, at most max_events.
+
+    Only committed events are added, so a hit is a duplicate that can skip
+    the database, while a miss still has to be checked by the insert."""
+
+    def __init__(self, window: float = 600, max_events: int = 100000):
+        """Start with an empty index."""
+        self.window = window
+        self.max_events = max_events
+        self.events = OrderedDict()
+        self.newest = float("-inf")
+
+    def __len__(self) -> int:
+        """Return number of events held."""
+        return len(self.events)
+
+    def __contains__(self, key: tuple) -> bool:
+        """Return True if the event with key was loaded recently."""
+        return key in self.events
+
+    def add(self, key: tuple) -> None:
+        """Record a committed event, evicting the oldest beyond the window or size."""
+        timestamp = key[3].timestamp()
+        if timestamp < self.newest - self.window:
+            return
+        self.events[key] = timestamp
+        self.events.move_to_end(key)
+        self.newest = max(self.newest, timestamp)
+        while self.events and (len(self.events) > self.max_events
+                               or next(iter(self.events.values())) < self.newest - self.window):
+            self.events.popitem(last=False)
+
+    def add_grouped(self, grouped: dict[str, list[tuple]]) -> None:
+        """Record every committed row of grouped."""
+        for table_name, rows in grouped.items():
+            for values in rows:
+                self.add(get_key(table_name, values))
+
+    def split(self, grouped: dict[str, list[tuple]]) -> tuple[dict[str, list[tuple]], int]:
+        """Return (grouped rows not loaded recently, number of recent duplicates removed)."""
+        fresh = {table_name: [values for values in rows
+                              if get_key(table_name, values) not in self.events]
+                 for table_name, rows in grouped.items()}
+        hits = sum(len(rows) for rows in grouped.values()) - sum(
+            len(rows) for rows in fresh.values())
+        RECENT_HITS.inc(hits)
+        return fresh, hits
@@ -0,0 +1,73 @@
+"""Module for hourly per-exhibition rollups of the interaction tables."""
+
+from logging import getLogger
+from datetime import date
+
+from psycopg2.sql import SQL, Identifier
+from psycopg2.extensions import connection, cursor
+
+
+ROLLUPS = {}
+ROLLUP_STATEMENT = """
+    WITH inserted AS (
+        {statement}
+        RETURNING exhibition_id, {field}, event_at
+    ), rolled_up AS (
+        INSERT INTO {rollup} (exhibition_id, event_hour, {field}, interaction_count)
+        SELECT exhibition_id, date_trunc('hour', event_at, 'UTC'), {field}, COUNT(*)
+        FROM inserted
+        GROUP BY 1, 2, 3
+        ON CONFLICT (exhibition_id, event_hour, {field}) DO UPDATE
+        SET interaction_count = {rollup}.interaction_count + EXCLUDED.interaction_count
+    )
+    SELECT COUNT(*) FROM inserted
+    """
+
+
+def get_rollup_statement(statement: str) -> str:
+    """Return statement rewritten to add the rows it inserts to the rollup."""
+    return ROLLUP_STATEMENT.replace("{statement}", statement.strip())
+
+
+def has_rollup(curs: cursor, table_name: str) -> bool:
+    """Return True if table_name has a rollup table, checked once per run."""
+    if table_name not in ROLLUPS:
+        curs.execute("SELECT 1 FROM pg_tables WHERE tablename = %s", (f"{table_name}_rollup",))
+        ROLLUPS[table_name] = bool(curs.fetchall())
+    return ROLLUPS[table_name]
+
+
+def rebuild_rollup(curs: cursor, table_name: str, since: date = None) -> int:
+    """Return number of rollup rows rebuilt from table_name since a date, or in full."""
+    names = {"table": Identifier(f"{table_name}_interaction"),
+             "rollup": Identifier(f"{table_name}_rollup"),
+             "field": Identifier(f"{table_name}_id")}
+    curs.execute(SQL("LOCK TABLE {table} IN SHARE MODE").format(**names))
+    curs.execute(SQL("""
+        DELETE FROM {rollup}
+        WHERE %(since)s IS NULL OR event_hour >= date_trunc('hour', %(since)s::TIMESTAMPTZ, 'UTC')
+        """).format(**names), {"since": since})
+    curs.execute(SQL("""
+        INSERT INTO {rollup} (exhibition_id, event_hour, {field}, interaction_count)
+        SELECT exhibition_id, date_trunc('hour', event_at, 'UTC'), {field}, COUNT(*)
+        FROM {table}
+        WHERE %(since)s IS NULL OR event_at >= date_trunc('hour', %(since)s::TIMESTAMPTZ, 'UTC')
+        GROUP BY 1, 2, 3
+        """).format(**names), {"since": since})
+    return curs.rowcount
+
+
+def rebuild_rollups(conn: connection, since: date = None) -> None:
+    """Rebuild every rollup table, each in its own transaction."""
+    logger = getLogger("etl_logger")
+    for table_name in ("rating", "request"):
+        try:
+            with conn.cursor() as curs:
+                if not has_rollup(curs, table_name):
+                    continue
+                count = rebuild_rollup(curs, table_name, since)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info("Rebuilt %s rows of %s_rollup.", count, table_name)
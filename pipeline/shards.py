@@ -0,0 +1,160 @@
+"""Module for loading rows in parallel worker processes, each owning a shard of the dedup keys."""
+
+from logging import getLogger
+from multiprocessing import Process, Queue
+from queue import Empty, Full
+from typing import NamedTuple
+from collections.abc import Callable, Iterable
+
+from psycopg2.extensions import connection
+
+from dimensions import DimensionCache
+from loader import group_rows, load_grouped
+from pool import LoaderPool, SingleConnectionPool
+from deadletter import RowSources
+from partitions import get_date
+from metrics import ROWS_READ, ROWS_VALID, ROWS_INSERTED, ROWS_SKIPPED
+
+
+SHARD_KEYS = ("exhibition", "time")
+
+
+class ShardSummary(NamedTuple):
+    """Rows loaded by one shard worker, with the error that stopped it if any."""
+    shard: int
+    batches: int = 0
+    inserted: int = 0
+    skipped: int = 0
+    error: str = None
+
+
+def get_shard(values: tuple, shard_by: str, shards: int) -> int:
+    """Return shard of an (exhibition_id, value_id, event_at) row.
+
+    Rows are sharded by exhibition, or by day of the event dealt round robin,
+    so every dedup key and rollup hour belongs to exactly one shard."""
+    if shard_by == "exhibition":
+        return values[0] % shards
+    return get_date(values[2]).toordinal() % shards
+
+
+def route(grouped: dict[str, list[tuple]], shard_by: str,
+          shards: list[dict[str, list[tuple]]]) -> None:
+    """Add grouped rows to the pending rows of their shards."""
+    for table_name, rows in grouped.items():
+        for values in rows:
+            shards[get_shard(values, shard_by, len(shards))][table_name].append(values)
+
+
+def run_shard(shard: int, connect: Callable[[], connection], inbox: Queue,
+              results: Queue, method: str) -> None:
+    """Load grouped batches from inbox on a connection of its own until None,
+    then put the shard summary on results.
+
+    A batch that lost its connection is retried on a new one."""
+    (batches, inserted, skipped, error) = (0, 0, 0, None)
+    pool = LoaderPool(SingleConnectionPool(connect), 1)
+    try:
+        while (grouped := inbox.get()) is not None:
+            (batch_inserted, batch_skipped) = pool.run(load_grouped, grouped, method)
+            batches += 1
+            inserted += batch_inserted
+            skipped += batch_skipped
+    except Exception as err:  # pylint:disable=broad-exception-caught
+        error = f"{type(err).__name__}: {err}"
+        getLogger("etl_logger").error("Shard %s failed: %s", shard, error)
+    finally:
+        pool.close()
+        results.put(ShardSummary(shard, batches, inserted, skipped, error))
+
+
+def send(process: Process, inbox: Queue, item) -> None:
+    """Put item on the inbox of a worker, failing if the worker has stopped."""
+    while True:
+        try:
+            inbox.put(item, timeout=1.0)
+            return
+        except Full as err:
+            if not process.is_alive():
+                raise RuntimeError(f"{process.name} stopped before loading every batch") from err
+
+
+def collect(processes: list[Process], results: Queue) -> list[ShardSummary]:
+    """Return a summary from every worker, marking those that died without one."""
+    summaries = {}
+    while len(summaries) < len(processes):
+        try:
+            summary = results.get(timeout=1.0)
+            summaries[summary.shard] = summary
+        except Empty:
+            if not any(process.is_alive() for process in processes) and results.empty():
+                break
+    for process in processes:
+        process.join()
+    return [summaries.get(shard, ShardSummary(shard, error=f"exit code {process.exitcode}"))
+            for shard, process in enumerate(processes)]
+
+
+def log_summaries(summaries: list[ShardSummary]) -> None:
+    """Log rows loaded by each shard and in total."""
+    logger = getLogger("etl_logger")
+    for summary in summaries:
+        logger.info("Shard %s: %s rows inserted, %s skipped in %s batches.",
+                    summary.shard, summary.inserted, summary.skipped, summary.batches)
+    logger.info("%s Rows have been bulk loaded by %s shards.",
+                sum(summary.inserted for summary in summaries), len(summaries))
+    if skipped := sum(summary.skipped for summary in summaries):
+        logger.info("%s Rows have been skipped.", skipped)
+
+
+def dispatch(grouped: dict[str, list[tuple]], shard_by: str,
+             pending: list[dict[str, list[tuple]]], processes: list[Process],
+             inboxes: list[Queue], batch_size: int) -> None:
+    """Route grouped rows, sending every shard with at least batch_size pending rows."""
+    route(grouped, shard_by, pending)
+    for shard, rows in enumerate(pending):
+        if sum(len(values) for values in rows.values()) >= batch_size:
+            send(processes[shard], inboxes[shard], rows)
+            pending[shard] = {'rating': [], 'request': []}
+
+
+def upload_sharded(batches: Iterable[tuple[list[list], RowSources]], cache: DimensionCache,
+                   connect: Callable[[], connection], shards: int = 4,
+                   shard_by: str = "time", batch_size: int = 10000,
+                   method: str = 'copy', queue_size: int = 4) -> list[ShardSummary]:
+    """Return shard summaries after loading (batch, row sources) across shards
+    worker processes.
+
+    Rows are transformed here, then sent to the worker owning their shard in
+    batches of batch_size, each loaded in its own transaction."""
+    if shard_by not in SHARD_KEYS:
+        raise ValueError(f"Unknown shard key: {shard_by}")
+    results = Queue()
+    inboxes = [Queue(queue_size) for _ in range(shards)]
+    processes = [Process(target=run_shard, args=(shard, connect, inbox, results, method),
+                         name=f"shard-{shard}")
+                 for shard, inbox in enumerate(inboxes)]
+    for process in processes:
+        process.start()
+    pending = [{'rating': [], 'request': []} for _ in range(shards)]
+    try:
+        for batch, sources in batches:
+            ROWS_READ.inc(len(batch))
+            dispatch(group_rows(batch, cache, sources), shard_by, pending,
+                     processes, inboxes, batch_size)
+        dispatch({}, shard_by, pending, processes, inboxes, 1)
+    finally:
+        for process, inbox in zip(processes, inboxes):
+            if process.is_alive():
+                send(process, inbox, None)
+        summaries = collect(processes, results)
+        log_summaries(summaries)
+    inserted = sum(summary.inserted for summary in summaries)
+    skipped = sum(summary.skipped for summary in summaries)
+    ROWS_VALID.inc(inserted + skipped)
+    ROWS_INSERTED.inc(inserted)
+    ROWS_SKIPPED.inc(skipped)
+    if failed := [summary for summary in summaries if summary.error]:
+        raise RuntimeError(f"{len(failed)} shards failed: "
+                           + ", ".join(f"shard {s.shard} ({s.error})" for s in failed))
+    return summaries
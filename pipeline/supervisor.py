@@ -0,0 +1,95 @@
+"""Module for running and supervising worker processes."""
+
+from time import monotonic
+from logging import getLogger
+from multiprocessing import Process, Event
+from multiprocessing.synchronize import Event as EventType
+from signal import signal, getsignal, SIGINT, SIGTERM, SIG_IGN
+from collections.abc import Callable
+
+
+def run_target(target: Callable, args: tuple, number: int, stop: EventType) -> None:
+    """Run target in a worker, leaving interrupts to the supervisor."""
+    signal(SIGINT, SIG_IGN)
+    signal(SIGTERM, SIG_IGN)
+    target(*args, number, stop)
+
+
+def start_worker(target: Callable, args: tuple, stop: EventType, number: int) -> Process:
+    """Return started worker process running target(*args, number, stop), where
+    number stays the same when the worker is restarted."""
+    process = Process(target=run_target, args=(target, args, number, stop),
+                      name=f"worker-{number}", daemon=False)
+    process.start()
+    getLogger("etl_logger").info("Started %s (pid %s).", process.name, process.pid)
+    return process
+
+
+def get_restart_delay(process: Process, restarts: int, restart_delay: float,
+                      max_restarts: int, max_delay: float) -> float:
+    """Return delay before restarting a failed worker that has already been
+    restarted restarts times in a row, raising RuntimeError beyond max_restarts."""
+    if restarts >= max_restarts:
+        raise RuntimeError(f"{process.name} died {restarts + 1} times, "
+                           f"last with exit code {process.exitcode}")
+    return min(restart_delay * 2 ** restarts, max_delay)
+
+
+def supervise(target: Callable, args: tuple, workers: int,
+              restart_delay: float = 5.0, shutdown_timeout: float = 30.0,
+              stop: EventType = None, max_restarts: int = 5,
+              max_delay: float = 300.0) -> None:
+    """Run workers until they finish or a stop signal, restarting failed ones.
+
+    A worker is restarted after restart_delay, doubled after every failure up
+    to max_delay, and reset once it has run for max_delay. Workers are stopped
+    and RuntimeError raised when one fails more than max_restarts times in a row."""
+    logger = getLogger("etl_logger")
+    stop = stop or Event()
+
+    def handle_signal(signum, _):
+        logger.info("Received signal %s, stopping workers.", signum)
+        stop.set()
+
+    previous = {sig: getsignal(sig) for sig in (SIGINT, SIGTERM)}
+    for sig in previous:
+        signal(sig, handle_signal)
+
+    processes = {i: start_worker(target, args, stop, i) for i in range(workers)}
+    started = dict.fromkeys(processes, monotonic())
+    restarts = dict.fromkeys(processes, 0)
+    pending = {}
+    try:
+        while not stop.is_set() and (processes or pending):
+            now = monotonic()
+            for i, process in list(processes.items()):
+                if process.is_alive():
+                    continue
+                del processes[i]
+                if process.exitcode == 0:
+                    logger.info("%s finished.", process.name)
+                    continue
+                if now - started[i] >= max_delay:
+                    restarts[i] = 0
+                delay = get_restart_delay(process, restarts[i], restart_delay,
+                                          max_restarts, max_delay)
+                logger.error("%s died with exit code %s, restarting in %.1fs.",
+                             process.name, process.exitcode, delay)
+                restarts[i] += 1
+                pending[i] = now + delay
+            for i, restart_at in list(pending.items()):
+                if restart_at <= now:
+                    del pending[i]
+                    processes[i] = start_worker(target, args, stop, i)
+                    started[i] = monotonic()
+            stop.wait(restart_delay)
+    finally:
+        stop.set()
+        for process in processes.values():
+            process.join(shutdown_timeout)
+            if process.is_alive():
+                logger.error("%s did not stop in time, terminating.", process.name)
+                process.terminate()
+                process.join()
+        for sig, handler in previous.items():
+            signal(sig, handler)
@@ -0,0 +1,41 @@
+# pylint:skip-file
+"""Tests for benchmark script."""
+
+from argparse import Namespace
+from pytest import mark
+
+from benchmark import (FakeConnection,
+                       make_history_rows,
+                       percentile,
+                       run_stage,
+                       STAGES)
+from dimensions import DimensionCache
+from loader import load_batch
+
+
+def test_fake_connection_deduplicates():
+    """Test the fake database skips rows that were already loaded."""
+    conn = FakeConnection()
+    cache = DimensionCache(conn)
+    rows = make_history_rows(50)
+    assert load_batch(conn, rows, cache) == (50, 0)
+    assert load_batch(conn, rows[:20], cache) == (0, 20)
+    assert not conn.staging
+
+
+@mark.parametrize("percent, expected", [(50, 6), (99, 10), (0, 1)])
+def test_percentile(percent, expected):
+    """Test nearest-rank percentile of samples."""
+    assert percentile(list(range(10, 0, -1)), percent) == expected
+
+
+@mark.parametrize("name", list(STAGES))
+def test_run_stage(name):
+    """Test every stage reports throughput, latency and memory."""
+    config = Namespace(rows=200, files=2, messages=200, batch_size=50,
+                       workers=2, dsn=None)
+    result = run_stage(name, config)
+    assert result["rows"] == 200
+    assert result["rows_per_sec"] > 0
+    assert result["p99_row_ms"] >= result["p50_row_ms"]
+    assert result["peak_rss_mb"] > 0
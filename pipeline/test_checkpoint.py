@@ -0,0 +1,39 @@
+# pylint:skip-file
+"""Tests for checkpoint module."""
+
+from unittest.mock import MagicMock
+
+from checkpoint import Checkpoint, get_checkpoint, get_checkpoints, get_source_key
+
+
+def test_get_checkpoints_byte_offsets():
+    """Test row offsets are counted on from the checkpoint alongside byte offsets."""
+    chunks = [(["a", "b"], 120), (["c"], 180)]
+    actual = list(get_checkpoints(chunks, Checkpoint("hist", 10, 100)))
+    assert actual == [(["a", "b"], Checkpoint("hist", 12, 120)),
+                      (["c"], Checkpoint("hist", 13, 180))]
+
+
+def test_get_checkpoints_row_offsets():
+    """Test row offsets are taken from chunks without byte offsets."""
+    actual = list(get_checkpoints([(["a", "b"], 12)], Checkpoint("hist", 10), False))
+    assert actual == [(["a", "b"], Checkpoint("hist", 12, None))]
+
+
+def test_get_checkpoint():
+    """Test the stored checkpoint is returned, or the start of the source without one."""
+    conn = MagicMock()
+    curs = conn.cursor.return_value.__enter__.return_value
+    curs.fetchall.side_effect = [[("hist", 20, 300)], []]
+    assert get_checkpoint(conn, "hist") == Checkpoint("hist", 20, 300)
+    assert get_checkpoint(conn, "hist") == Checkpoint("hist", 0, None)
+
+
+def test_get_source_key_changes_with_file(tmp_path):
+    """Test the key of a file changes when its contents change size."""
+    file_path = tmp_path / "lmnh_hist_data.csv"
+    file_path.write_text("at,site,val,type\n")
+    first = get_source_key(str(file_path))
+    file_path.write_text("at,site,val,type\n2024-01-01 00:00:00,1,2,\n")
+    assert first.startswith("lmnh_hist_data.csv:17:")
+    assert get_source_key(str(file_path)) != first
@@ -1,12 +1,17 @@
 # pylint:skip-file
 """Tests for pipeline script."""
 
+from datetime import datetime
 from unittest.mock import patch, Mock
 from pytest import mark
 
 from consumer import (get_message_data,
                       is_valid_message,
-                      log_message)
+                      log_message,
+                      parse_message,
+                      read_message,
+                      read_messages,
+                      MessageRecord)
 
 
 def test_log_message_valid():
@@ -80,8 +85,100 @@ def test_get_message_data_valid():
                                            ({"at": "2025-05-14T12:33:35.076377+01:00",
                                                "site": "5", "val": 4}, (True, "Valid message.")),
                                            ({"at": "2025-05-14T12:33:35.076377+01:00",
-                                             "site": "5"}, (False, "No key called 'val'"))])
+                                             "site": "5"}, (False, "No key called 'val'")),
+                                           ({"at": "yesterday", "site": "5", "val": 4},
+                                            (False, "'at' value is not in accepted format: yesterday"))])
 def test_is_valid_message(test_input, expected):
     """Test if valid message returns expected bool."""
     actual = is_valid_message(test_input)
     assert actual == expected
+
+
+@mark.parametrize("value, expected", [
+    (b'{"at": "2025-05-14T12:33:35+01:00", "site": "5", "val": 3}',
+     (MessageRecord("2025-05-14 12:33:35", "5", 3), "Valid message.")),
+    (b'{"at": "2025-05-14T12:33:35+01:00", "site": "2", "val": -1, "type": 1}',
+     (MessageRecord("2025-05-14 12:33:35", "2", -1, 1), "Valid message.")),
+    (b'{"at": "2025-05-14T12:33:35+01:00", "site": "9", "val": 3}',
+     (None, "'site' value is not in accepted list of values: 9")),
+    (b'[1, 2]', (None, "Message is not a json object: <class 'list'>"))])
+def test_parse_message(value, expected):
+    """Test parse message returns a record or an error in one pass."""
+    assert parse_message(value) == expected
+
+
+def test_parse_message_parses_time_once():
+    """Test the event time validated is the one stored, without parsing it again."""
+    with patch("consumer.datetime", Mock(wraps=datetime)) as mock_datetime:
+        (record, _) = parse_message(
+            b'{"at": "2025-05-14T12:33:35.076377+01:00", "site": "5", "val": 3}')
+    assert record.at == "2025-05-14 12:33:35"
+    mock_datetime.fromisoformat.assert_called_once()
+
+
+def test_parse_message_invalid_json():
+    """Test parse message returns an error for undecodable values."""
+    (record, err) = parse_message(b'{"at":')
+    assert record is None
+    assert err.startswith("Message is not valid json")
+
+
+@mark.parametrize("message, level", [
+    ('{"at": "2025-05-14T12:33:35+01:00", "site": "5", "val": 3}', "info"),
+    ('{"site": "5", "val": 3}', "error")])
+def test_read_message_logs_once(message, level):
+    """Test read message logs each message a single time."""
+    mock_message = Mock()
+    mock_message.value.return_value = message.encode()
+    with patch("consumer.logging.getLogger") as mock_get_logger, \
+            patch("consumer.is_sampled", return_value=True):
+        read_message(mock_message)
+    logger = mock_get_logger.return_value
+    assert len(logger.method_calls) == 1
+    assert logger.method_calls[0][0] == level
+
+
+def test_read_message_skips_sampled_out_log():
+    """Test a sampled out message is neither decoded nor logged."""
+    mock_message = Mock()
+    value = mock_message.value.return_value = Mock()
+    with patch("consumer.logging.getLogger") as mock_get_logger, \
+            patch("consumer.is_sampled", return_value=False), \
+            patch("consumer.parse_message", return_value=(MessageRecord("at", "5", 3), None)):
+        assert read_message(mock_message) == MessageRecord("at", "5", 3)
+    value.decode.assert_not_called()
+    mock_get_logger.return_value.info.assert_not_called()
+
+
+def test_read_message_keeps_stored_event_time():
+    """Test event times are stored as the message wall-clock time to the second,
+    as row by row uploads always have, so redelivered messages still match."""
+    mock_message = Mock()
+    mock_message.value.return_value = \
+        b'{"at": "2025-05-14T12:33:35.076377+01:00", "site": "5", "val": -1, "type": 1}'
+    assert read_message(mock_message) == MessageRecord("2025-05-14 12:33:35", "5", -1, 1)
+
+
+def test_read_message_rejects_empty_message():
+    """Test a tombstone message is rejected instead of stopping the consumer."""
+    mock_message = Mock()
+    mock_message.value.return_value = None
+    mock_message.topic.return_value = "lmnh"
+    mock_message.partition.return_value = 0
+    mock_message.offset.return_value = 7
+    with patch("consumer.reject") as mock_reject:
+        assert read_message(mock_message) is None
+    mock_reject.assert_called_once_with("kafka", "lmnh:0:7", "empty message", "")
+
+
+def test_read_messages_observes_batch_once():
+    """Test parse time is observed once per batch and consumer errors are skipped."""
+    messages = [Mock() for _ in range(3)]
+    for message in messages:
+        message.error.return_value = None
+        message.value.return_value = b'{"at": "2025-05-14T12:33:35+01:00", "site": "5", "val": 3}'
+    messages[1].error.return_value = "EOF"
+    with patch("consumer.PARSE_SECONDS") as mock_seconds, patch("consumer.reject"):
+        records = read_messages(messages)
+    assert records == [MessageRecord("2025-05-14 12:33:35", "5", 3)] * 2
+    mock_seconds.observe.assert_called_once()
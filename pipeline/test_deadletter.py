@@ -0,0 +1,94 @@
+# pylint:skip-file
+"""Tests for deadletter module."""
+
+from unittest.mock import MagicMock, Mock, patch
+from pytest import mark, raises
+
+from deadletter import (DeadLetter, DeadLetterSink, FileSink, TableSink, TopicSink, set_sink,
+                        reject, close_sink, read_dead_letters, add_row_source, get_row_key,
+                        get_worker_path)
+
+
+def make_letter(key):
+    """Return a dead letter with key."""
+    return DeadLetter("rows", key, "KeyError", '["a"]', "2025-05-14T12:33:35+00:00")
+
+
+def test_file_sink_writes_batches(tmp_path):
+    """Test letters are written once the batch is full and can be read back."""
+    file_path = f"{tmp_path}/dead.jsonl.gz"
+    sink = FileSink(file_path, batch_size=2)
+    sink.add(make_letter("1"))
+    assert sink.written == 0
+    sink.add(make_letter("2"))
+    sink.add(make_letter("3"))
+    assert sink.written == 2
+    sink.close()
+    assert [letter.source_key for letter in read_dead_letters(file_path)] == ["1", "2", "3"]
+
+
+def test_table_sink_failure_does_not_raise():
+    """Test a failed write is rolled back and logged instead of stopping the load."""
+    conn = MagicMock()
+    sink = TableSink(conn, batch_size=1)
+    with patch("deadletter.execute_values", side_effect=ValueError), \
+            patch("deadletter.getLogger") as mock_get_logger:
+        sink.add(make_letter("1"))
+    conn.rollback.assert_called_once()
+    mock_get_logger.return_value.error.assert_called_once()
+    assert (sink.written, sink.buffer) == (0, [])
+
+
+def test_topic_sink_produces_each_letter():
+    """Test letters are produced keyed by source key and flushed once per batch."""
+    producer = Mock()
+    producer.flush.return_value = 0
+    sink = TopicSink(producer, "lmnh_dead", batch_size=2)
+    sink.add(make_letter("1"))
+    sink.add(make_letter("2"))
+    assert [c[1]["key"] for c in producer.produce.call_args_list] == ["1", "2"]
+    producer.flush.assert_called_once()
+
+
+def test_reject_without_sink():
+    """Test rejects are dropped when no sink is set."""
+    set_sink(None)
+    reject("rows", None, "KeyError", ["a"])
+
+
+def test_reject_to_sink():
+    """Test rejects are converted to dead letters and the sink closed."""
+    sink = Mock()
+    set_sink(sink)
+    reject("kafka", 5, KeyError("val"), ["2025-05-14 12:33:35", 1])
+    close_sink()
+    letter = sink.add.call_args[0][0]
+    assert letter[:4] == ("kafka", "5", "'val'", '["2025-05-14 12:33:35", 1]')
+    sink.close.assert_called_once()
+
+
+def test_get_row_key_from_runs():
+    """Test contiguous rows of a source share a run and keys give the source row."""
+    sources = []
+    for index, (source, row) in enumerate([("a.csv", 4), ("a.csv", 5), ("a.csv", 8),
+                                           ("b.csv", 0)]):
+        add_row_source(sources, index, source, row)
+    assert sources == [(0, "a.csv", 4), (2, "a.csv", 8), (3, "b.csv", 0)]
+    assert [get_row_key(sources, index) for index in range(4)] == [
+        "a.csv:4", "a.csv:5", "a.csv:8", "b.csv:0"]
+    assert get_row_key([], 0) is None
+
+
+def test_sink_without_write_is_abstract():
+    """Test a sink that cannot write its letters cannot be created."""
+    with raises(TypeError):
+        DeadLetterSink()
+
+
+@mark.parametrize("file_path, expected", [
+    ("/tmp/dead_letters.jsonl.gz", "/tmp/dead_letters.12.jsonl.gz"),
+    ("/tmp/rejects.gz", "/tmp/rejects.12.gz"),
+    ("/tmp/rejects", "/tmp/rejects.12")])
+def test_get_worker_path(file_path, expected):
+    """Test every worker writes its own file whatever the suffix of the path."""
+    assert get_worker_path(file_path, 12) == expected
@@ -0,0 +1,64 @@
+# pylint:skip-file
+"""Tests for dimensions module."""
+
+from unittest.mock import MagicMock
+from pytest import fixture, raises
+
+from dimensions import DimensionCache
+
+
+@fixture(name='conn')
+def test_conn():
+    """Mock connection returning rows for each dimension table."""
+    conn = MagicMock()
+    curs = conn.cursor.return_value.__enter__.return_value
+    curs.fetchall.side_effect = lambda: [
+        [(0, 1), (1, 2), (2, 3), (3, 4), (4, 5)],
+        [(0, 1), (1, 2)],
+        [("EXH_00", 2), ("EXH_01", 1), ("EXH_05", 3)]][
+            curs.fetchall.call_count - 1]
+    return conn
+
+
+def test_get_id_loads_once(conn):
+    """Test tables are only queried on the first lookup."""
+    cache = DimensionCache(conn)
+    assert cache.get_value_id("rating", 4) == 5
+    assert cache.get_value_id("request", 1) == 2
+    assert cache.get_exhibition_id(5) == 3
+    assert cache.get_exhibition_id("0") == 2
+    curs = conn.cursor.return_value.__enter__.return_value
+    assert curs.execute.call_count == 3
+
+
+def test_get_id_missing_key(conn):
+    """Test an unknown key raises KeyError after a single refresh."""
+    cache = DimensionCache(conn)
+    cache.ids = {"rating": {}, "request": {}, "exhibition": {}}
+    curs = conn.cursor.return_value.__enter__.return_value
+    curs.fetchall.side_effect = None
+    curs.fetchall.return_value = []
+    with raises(KeyError):
+        cache.get_exhibition_id(9)
+    assert curs.execute.call_count == 3
+
+
+def test_get_id_missing_key_reloads_once(conn):
+    """Test a key missing after a refresh does not reload the cache again."""
+    cache = DimensionCache(conn)
+    cache.ids = {"rating": {}, "request": {}, "exhibition": {}}
+    curs = conn.cursor.return_value.__enter__.return_value
+    curs.fetchall.side_effect = None
+    curs.fetchall.return_value = []
+    for _ in range(3):
+        with raises(KeyError):
+            cache.get_exhibition_id(9)
+    assert curs.execute.call_count == 3
+
+
+def test_refresh_with_run(conn):
+    """Test tables are loaded through run instead of on the stored connection."""
+    run = MagicMock(side_effect=lambda function: function(conn))
+    cache = DimensionCache(MagicMock(), run)
+    assert cache.get_exhibition_id(5) == 3
+    run.assert_called_once()
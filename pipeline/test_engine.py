@@ -0,0 +1,109 @@
+# pylint:skip-file
+"""Tests for engine module."""
+
+from asyncio import run
+from threading import main_thread, current_thread
+from unittest.mock import Mock, patch
+from pytest import mark
+
+from engine import run_bucket, run_cluster, get_offsets
+
+
+def make_object_rows(objects):
+    """Return fake iter_numbered_rows reading rows from a dict of keys."""
+    def iter_numbered_rows(s_client, bucket_name, key, window=None):
+        yield from ((key, number, row) for number, row in enumerate(objects[key]))
+    return iter_numbered_rows
+
+
+def make_message(partition, offset, error=None):
+    """Return a mock kafka message."""
+    message = Mock()
+    message.error.return_value = error
+    message.topic.return_value = "lmnh"
+    message.partition.return_value = partition
+    message.offset.return_value = offset
+    return message
+
+
+@mark.parametrize("rows, chunk_size, expected", [(None, 2, 9), (4, 2, 4), (5, 10, 5)])
+def test_run_bucket_loads_every_row(rows, chunk_size, expected):
+    """Test every extracted row is transformed and loaded once."""
+    objects = {f"lmnh_hist_data_{i}.csv": [[f"2024-01-01 00:00:0{j}", "1", "2", ""]
+                                         for j in range(3)]
+               for i in range(3)}
+    loaded = []
+
+    def load_grouped(grouped, method, offsets):
+        loaded.extend(grouped["rating"])
+        return len(grouped["rating"]), 0
+
+    cache = Mock()
+    cache.get_exhibition_id.return_value = 1
+    cache.get_value_id.return_value = 3
+    pool = Mock()
+    pool.load.side_effect = load_grouped
+    with patch("engine.iter_numbered_rows", make_object_rows(objects)):
+        totals = run(run_bucket(Mock(), "test_bucket", list(objects), pool,
+                                cache, rows, 2, 2, 2, 1, chunk_size))
+    assert len(loaded) == expected
+    assert totals.inserted == expected
+
+
+def test_run_bucket_transforms_off_event_loop():
+    """Test rows are grouped in worker threads, not on the event loop thread."""
+    threads = []
+
+    def group_rows(batch, cache, sources):
+        threads.append(current_thread())
+        return {"rating": [], "request": []}
+
+    pool = Mock()
+    pool.load.return_value = (0, 0)
+    objects = {"lmnh_hist_data_0.csv": [["2024-01-01 00:00:00", "1", "2", ""]] * 3}
+    with patch("engine.iter_numbered_rows", make_object_rows(objects)), \
+            patch("engine.group_rows", group_rows):
+        run(run_bucket(Mock(), "test_bucket", list(objects), pool, Mock(), None, 1, 2, 1, 1, 2))
+    assert len(threads) == 2
+    assert main_thread() not in threads
+
+
+def test_run_cluster_commits_after_load():
+    """Test offsets are committed after their batch has been loaded."""
+    batches = [[make_message(0, 0), make_message(1, 5)],
+               [make_message(0, 1), make_message(0, 2, error="EOF")]]
+    manager = Mock()
+    cons = manager.cons
+    cons.position.return_value = []
+    cons.consume.side_effect = lambda num, timeout: batches.pop(0)
+    manager.pool.load.return_value = (1, 1)
+    with patch("consumer.read_message", return_value=["2025-05-14T12:33:35+01:00", "1", 2]):
+        totals = run(run_cluster(cons, manager.pool, Mock(), 4, 1, 2))
+    calls = [c[0] for c in manager.mock_calls if c[0] in ("pool.load", "cons.commit")]
+    assert calls == ["pool.load", "cons.commit"] * 2
+    assert (totals.inserted, totals.skipped) == (2, 2)
+
+
+@mark.parametrize("group", [None, "etl"])
+def test_run_cluster_stores_offsets_for_group(group):
+    """Test offsets are stored with each batch only for a consumer group."""
+    cons = Mock()
+    cons.position.return_value = []
+    cons.consume.side_effect = lambda num, timeout: [make_message(0, 4)]
+    pool = Mock()
+    pool.load.return_value = (1, 0)
+    with patch("consumer.read_message", return_value=["2025-05-14T12:33:35+01:00", "1", 2]):
+        run(run_cluster(cons, pool, Mock(), 1, 1, 1, group=group))
+    stored = pool.load.call_args[0][2]
+    if group is None:
+        assert stored is None
+    else:
+        assert stored.group == "etl"
+        assert [(p.partition, p.offset) for p in stored.partitions] == [(0, 5)]
+
+
+def test_get_offsets_skips_errors():
+    """Test committed offsets are one past the highest message per partition."""
+    offsets = get_offsets([make_message(0, 3), make_message(0, 7), make_message(1, 2),
+                           make_message(1, -1, error="EOF")])
+    assert {(o.partition, o.offset) for o in offsets} == {(0, 8), (1, 3)}
@@ -1,16 +1,29 @@
 # pylint:skip-file
 """Tests for extract module."""
 
+from os import path
+from datetime import datetime, timezone
 from unittest.mock import patch, mock_open
 from pytest import mark, fixture, raises
 
 from boto3 import client
 from botocore.stub import Stubber
+from moto import mock_aws
 
 from extract import (get_data_from_file,
                      get_dir_path,
                      get_files,
-                     get_object_names_from_bucket)
+                     get_object_names_from_bucket,
+                     get_data_chunks,
+                     get_parquet_chunks,
+                     get_objects_from_bucket,
+                     get_window_time,
+                     may_contain,
+                     open_collated_file,
+                     stream_rows,
+                     stream_numbered_rows,
+                     TimeWindow)
+from pyarrow.parquet import ParquetFile
 
 
 @fixture(name='client')
@@ -39,14 +52,28 @@ def test_client():
                 'Key': 'lmnh_hist_data_4.csv'
             }
         ],
-        'Name': 'string'
+        'Name': 'string',
+        'IsTruncated': False
     }
     stubber.add_response(
-        'list_objects', object_response, {'Bucket': "test_bucket"})
+        'list_objects_v2', object_response, {'Bucket': "test_bucket"})
     stubber.activate()
     yield s3_client
 
 
+@fixture(name='moto_client')
+def test_moto_client(monkeypatch, tmp_path):
+    """S3 client backed by a local moto bucket, ran inside a temp directory."""
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.chdir(tmp_path)
+    with mock_aws():
+        s3_client = client('s3')
+        s3_client.create_bucket(Bucket="test_bucket")
+        yield s3_client
+
+
 @fixture(name='download_client')
 def test_client_downloads():
     """Test client for downloading files."""
@@ -132,7 +159,158 @@ def test_get_dir_path_valid(test_path):
 
 def test_get_data_from_file(test_csv):
     """Test get_data_from_file retrieves file data in expected format"""
-    with patch("builtins.open", mock_open(read_data=test_csv*5)):
+    with patch("builtins.open", mock_open(read_data=(test_csv*5).encode())):
         actual = get_data_from_file(5)
         expected = [["2024-01-01", "SiteA", "123", "TypeA"]]*5
     assert actual == expected
+
+
+def test_get_object_names_from_bucket_paginates(moto_client):
+    """Test listing returns every key when the bucket spans several pages."""
+    for i in range(1005):
+        moto_client.put_object(Bucket="test_bucket", Key=f"key_{i}", Body=b"")
+    assert len(get_object_names_from_bucket(moto_client, "test_bucket")) == 1005
+
+
+def test_get_files_deterministic_order(moto_client):
+    """Test merged csv keeps listing order regardless of download order."""
+    for i in range(12):
+        body = f"at,site,val,type\n2024-01-01 00:00:{i:02},1,{i},\n"
+        moto_client.put_object(Bucket="test_bucket",
+                               Key=f"lmnh_hist_data_{i}.csv", Body=body.encode())
+    moto_client.put_object(Bucket="test_bucket", Key="other.csv", Body=b"")
+    files = get_files(moto_client, "test_bucket", workers=4)
+    assert files == sorted(f"lmnh_hist_data_{i}.csv" for i in range(12))
+    with open("./data/lmnh_hist_data.csv", encoding="utf-8") as f:
+        rows = f.read().splitlines()[1:]
+    assert [int(r.split(",")[2]) for r in rows] == [
+        int(name[15:-4]) for name in files]
+
+
+def test_stream_rows_no_local_files(moto_client):
+    """Test rows are streamed from history objects without a data directory."""
+    for i in range(3):
+        body = f"at,site,val,type\n2024-01-01 00:00:0{i},1,{i},\n2024-01-01 00:01:0{i},2,-1,1.0\n"
+        moto_client.put_object(Bucket="test_bucket",
+                               Key=f"lmnh_hist_data_{i}.csv", Body=body.encode())
+    moto_client.put_object(Bucket="test_bucket",
+                           Key="lmnh_exhibition_bugs.json", Body=b"{}")
+    rows = list(stream_rows(moto_client, "test_bucket"))
+    assert len(rows) == 6
+    assert rows[0] == ["2024-01-01 00:00:00", "1", "0", ""]
+    assert rows[-1] == ["2024-01-01 00:01:02", "2", "-1", "1.0"]
+    assert not path.exists("./data")
+
+
+def test_stream_rows_in_window(moto_client):
+    """Test only rows with an event time in the window are streamed."""
+    body = "at,site,val,type\n2024-01-01 23:59:59,1,2,\n2024-01-02 00:00:00,1,3,\n" \
+           "2024-01-02T01:00:00+02:00,1,4,\nnot a time,1,2,\n2024-01-03 00:00:00,1,1,\n"
+    moto_client.put_object(Bucket="test_bucket", Key="lmnh_hist_data_0.csv", Body=body.encode())
+    window = TimeWindow(get_window_time("2024-01-02"), get_window_time("2024-01-03"))
+    rows = list(stream_rows(moto_client, "test_bucket", window=window))
+    assert [row[2] for row in rows] == ["3", "2"]
+    numbered = list(stream_numbered_rows(moto_client, "test_bucket", window=window))
+    assert [(key, number) for key, number, _ in numbered] == [
+        ("lmnh_hist_data_0.csv", 1), ("lmnh_hist_data_0.csv", 3)]
+
+
+def test_get_objects_from_bucket_prefix(moto_client):
+    """Test only keys under the prefix are listed."""
+    for key in ("lmnh_hist_data_1.csv", "lmnh_hist_data_12.csv", "lmnh_hist_data_2.csv"):
+        moto_client.put_object(Bucket="test_bucket", Key=key, Body=b"")
+    objects = get_objects_from_bucket(moto_client, "test_bucket", "lmnh_hist_data_1")
+    assert [o['Key'] for o in objects] == ["lmnh_hist_data_1.csv", "lmnh_hist_data_12.csv"]
+
+
+@mark.parametrize("key, modified, expected", [
+    ("lmnh_hist_data_1.csv", datetime(2024, 1, 1, tzinfo=timezone.utc), False),
+    ("lmnh_hist_data_1.csv", datetime(2024, 1, 2, tzinfo=timezone.utc), True),
+    ("lmnh_exhibition_bugs.json", datetime(2024, 1, 1, tzinfo=timezone.utc), True)])
+def test_may_contain(key, modified, expected):
+    """Test history objects written before the window starts are skipped."""
+    window = TimeWindow(get_window_time("2024-01-02"))
+    assert may_contain({'Key': key, 'LastModified': modified}, window) == expected
+
+
+@fixture(name='history_file')
+def test_history_file(monkeypatch, tmp_path):
+    """Collated csv of 10 rows written to a temp data directory."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    lines = ["at,site,val,type"] + [f"2024-01-01 00:00:0{i},1,{i},"
+                                    for i in range(10)]
+    (tmp_path / "data" / "lmnh_hist_data.csv").write_text(
+        "\n".join(lines) + "\n", encoding="utf-8")
+
+
+def test_get_data_from_file_keeps_last_row(history_file):
+    """Test the whole file is returned when no row limit is given."""
+    actual = get_data_from_file()
+    assert len(actual) == 10
+    assert actual[-1][2] == "9"
+
+
+@mark.parametrize("chunk_size, row_number, start_row, expected", [
+    (4, None, 0, [4, 4, 2]),
+    (4, 5, 0, [4, 1]),
+    (3, 5, 7, [3]),
+    (20, 0, 0, [])])
+def test_get_data_chunks_sizes(history_file, chunk_size, row_number, start_row, expected):
+    """Test chunks respect chunk size, row limit and row offset."""
+    chunks = list(get_data_chunks(chunk_size, row_number, start_row))
+    assert [len(rows) for rows, _ in chunks] == expected
+
+
+def test_get_data_chunks_resume_from_byte(history_file):
+    """Test reading from a returned byte offset continues after that chunk."""
+    (first, offset), _ = list(get_data_chunks(6))
+    resumed = [row for rows, _ in get_data_chunks(6, start_byte=offset)
+               for row in rows]
+    assert first[-1][2] == "5"
+    assert [row[2] for row in resumed] == ["6", "7", "8", "9"]
+
+
+@fixture(name='history_parquet')
+def test_history_parquet(monkeypatch, tmp_path):
+    """Collated parquet of 10 rows in row groups of 4 written to a temp data directory."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    with patch("extract.ROW_GROUP_SIZE", 4), open_collated_file('parquet') as w:
+        w.writerows([[f"2024-01-01 00:00:0{i}", "1", str(i), ""] for i in range(7)])
+        w.writerows([[f"2024-01-01 00:00:0{i}", "1", "-1"] for i in range(7, 10)])
+    return tmp_path / "data" / "lmnh_hist_data.parquet"
+
+
+def test_parquet_row_groups(history_parquet):
+    """Test rows are written in compressed row groups with missing types filled."""
+    parquet_file = ParquetFile(history_parquet)
+    assert [parquet_file.metadata.row_group(i).num_rows
+            for i in range(parquet_file.num_row_groups)] == [4, 4, 2]
+    assert parquet_file.metadata.row_group(0).column(0).compression == "ZSTD"
+    assert get_data_from_file(file_format='parquet')[-1] == ["2024-01-01 00:00:09", "1", "-1", ""]
+
+
+def test_parquet_malformed_rows(monkeypatch, tmp_path):
+    """Test short rows are padded and long rows cut to the schema columns."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    with open_collated_file('parquet') as w:
+        w.writerows([["2024-01-01 00:00:00", "1"],
+                     ["2024-01-01 00:00:01", "1", "2", "", "extra"]])
+    assert get_data_from_file(file_format='parquet') == [
+        ["2024-01-01 00:00:00", "1", "", ""], ["2024-01-01 00:00:01", "1", "2", ""]]
+
+
+@mark.parametrize("chunk_size, row_number, start_row, expected", [
+    (3, None, 0, [3, 3, 3, 1]),
+    (4, 5, 0, [4, 1]),
+    (3, 5, 6, [1, 3]),
+    (20, 0, 0, [])])
+def test_get_parquet_chunks_sizes(history_parquet, chunk_size, row_number, start_row, expected):
+    """Test chunks respect chunk size, row groups, row limit and row offset."""
+    chunks = list(get_parquet_chunks(chunk_size, row_number, start_row))
+    assert [len(rows) for rows, _ in chunks] == expected
+    if chunks:
+        assert chunks[0][0][0][2] == str(start_row)
+        assert chunks[-1][1] == start_row + sum(expected)
@@ -0,0 +1,193 @@
+# pylint:skip-file
+"""Tests for loader module."""
+
+from unittest.mock import MagicMock, Mock, patch
+from pytest import mark, fixture, raises
+from pandas import DataFrame, Timestamp
+
+from checkpoint import Checkpoint
+from recent import RecentEvents
+from loader import (get_batches,
+                    get_sourced_batches,
+                    transform_row,
+                    group_rows,
+                    load_batch,
+                    merge_staging,
+                    insert_row,
+                    copy_rows,
+                    upload_batches)
+
+
+@fixture(autouse=True)
+def plain_tables():
+    """Treat interaction tables as unpartitioned without rollups."""
+    with patch.dict("partitions.PARTITIONS",
+                    {"rating_interaction": None, "request_interaction": None}), \
+            patch.dict("rollups.ROLLUPS", {"rating": False, "request": False}):
+        yield
+
+
+@fixture(name='cache')
+def test_cache():
+    """Mock dimension cache returning predictable ids."""
+    cache = Mock()
+    cache.get_exhibition_id.side_effect = lambda site: int(site) + 10
+    cache.get_value_id.side_effect = lambda table, value: value + 100
+    return cache
+
+
+@mark.parametrize("size, expected", [(2, [[1, 2], [3, 4], [5]]),
+                                     (5, [[1, 2, 3, 4, 5]]),
+                                     (10, [[1, 2, 3, 4, 5]])])
+def test_get_batches(size, expected):
+    """Test rows are split into batches of at most size."""
+    assert list(get_batches(iter([1, 2, 3, 4, 5]), size)) == expected
+
+
+@mark.parametrize("row, expected", [(["2025-05-14 12:33:35", "1", "2", ""],
+                                     ("rating", (11, 102, "2025-05-14 12:33:35"))),
+                                    (["2025-05-14 12:33:35", "3", "-1", "1.0"],
+                                     ("request", (13, 101, "2025-05-14 12:33:35")))])
+def test_transform_row(row, expected, cache):
+    """Test rows are mapped to their table and ids."""
+    assert transform_row(row, cache) == expected
+
+
+def test_transform_row_invalid_type(cache):
+    """Test unknown request type raises KeyError."""
+    with raises(KeyError):
+        transform_row(["2025-05-14 12:33:35", "3", "-1", "7.0"], cache)
+
+
+def test_group_rows_rejects_invalid_rows(cache):
+    """Test invalid rows are sent to the dead-letter sink and valid rows kept."""
+    batch = [["2025-05-14 12:33:35", "1", "2", ""],
+             ["2025-05-14 12:33:36", "3", "-1", "7.0"],
+             ["not a time", "1", "2", ""]]
+    with patch("loader.reject") as mock_reject:
+        grouped = group_rows(batch, cache)
+    assert grouped == {'rating': [(11, 102, "2025-05-14 12:33:35")], 'request': []}
+    assert [c[0][3] for c in mock_reject.call_args_list] == batch[1:]
+    assert mock_reject.call_args_list[0][0][2] == "KeyError: '7.0'"
+
+
+def test_group_rows_rejects_with_source_key(cache):
+    """Test rejected rows are keyed by the object and row they were read from."""
+    rows = [("lmnh_hist_data_0.csv", 7, ["2025-05-14 12:33:35", "1", "2", ""]),
+            ("lmnh_hist_data_0.csv", 9, ["not a time", "1", "2", ""]),
+            ("lmnh_hist_data_1.csv", 0, ["2025-05-14 12:33:36", "3", "-1", "7.0"])]
+    ((batch, sources), ) = get_sourced_batches(rows, 3)
+    with patch("loader.reject") as mock_reject:
+        group_rows(batch, cache, sources)
+    assert [c[0][1] for c in mock_reject.call_args_list] == [
+        "lmnh_hist_data_0.csv:9", "lmnh_hist_data_1.csv:0"]
+
+
+@mark.parametrize("method", ["copy", "values"])
+def test_load_batch_commits_once(method, cache):
+    """Test each table is written once and batch is committed once."""
+    batch = [["2025-05-14 12:33:35", "1", "2", ""],
+             ["2025-05-14 12:33:36", "1", "-1", "0.0"],
+             ["2025-05-14 12:33:37", "2", "4", ""]]
+    conn = MagicMock()
+    conn.cursor.return_value.__enter__.return_value.rowcount = 1
+    mock_write = Mock()
+    with patch.dict("loader.LOAD_METHODS", {method: mock_write}):
+        assert load_batch(conn, batch, cache, method) == (2, 1)
+    assert mock_write.call_count == 2
+    conn.commit.assert_called_once()
+
+
+def test_load_batch_saves_checkpoint(cache):
+    """Test the checkpoint is saved in the batch transaction before it commits."""
+    conn = MagicMock()
+    manager = MagicMock()
+    conn.commit = manager.commit
+    checkpoint = Checkpoint("lmnh_hist_data.csv:100:1", 1, 40)
+    with patch.dict("loader.LOAD_METHODS", {"copy": Mock()}), \
+            patch("loader.save_checkpoint", manager.save_checkpoint):
+        load_batch(conn, [["2025-05-14 12:33:35", "1", "2", ""]], cache, "copy", checkpoint)
+    assert [c[0] for c in manager.mock_calls] == ["save_checkpoint", "commit"]
+    assert manager.save_checkpoint.call_args[0][1] == checkpoint
+
+
+def test_load_batch_skips_recent_rows(cache):
+    """Test rows in the recent events index are skipped and loaded rows added to it."""
+    batch = [["2025-05-14 12:33:35", "1", "2", ""]]
+    conn = MagicMock()
+    conn.cursor.return_value.__enter__.return_value.rowcount = 1
+    recent = RecentEvents()
+    mock_write = Mock()
+    with patch.dict("loader.LOAD_METHODS", {"copy": mock_write}):
+        assert load_batch(conn, batch, cache, recent=recent) == (1, 0)
+        assert load_batch(conn, batch, cache, recent=recent) == (0, 1)
+    assert mock_write.call_count == 1
+    assert len(recent) == 1
+
+
+def test_load_batch_rolls_back(cache):
+    """Test failed batch is rolled back and error raised."""
+    conn = MagicMock()
+    with patch.dict("loader.LOAD_METHODS", {"copy": Mock(side_effect=ValueError)}):
+        with raises(ValueError):
+            load_batch(conn, [["2025-05-14 12:33:35", "1", "2", ""]], cache)
+    conn.rollback.assert_called_once()
+    conn.commit.assert_not_called()
+
+
+def test_upload_batches(cache):
+    """Test every batch is loaded and skips are reported."""
+    data = [["2025-05-14 12:33:35", "1", "2", ""]] * 5
+    batches = ((batch, None, None) for batch in get_batches(data, 2))
+    with patch("loader.load_batch") as mock_load, patch("loader.Counter"), \
+            patch("loader.getLogger") as mock_get_logger:
+        mock_load.side_effect = lambda conn, batch, cache, method, checkpoint, sources, load: (
+            len(batch) - 1, 1)
+        assert upload_batches(Mock(), batches, cache) == (2, 3)
+    assert mock_load.call_count == 3
+    mock_get_logger.return_value.info.assert_called_with(
+        "%s Rows have been skipped.", 3)
+
+
+def test_merge_staging_returns_rowcount():
+    """Test merge reports the number of rows inserted."""
+    curs = Mock()
+    curs.rowcount = 4
+    assert merge_staging(curs, "rating") == 4
+    assert "ON CONFLICT DO NOTHING" in repr(curs.execute.call_args_list[0][0][0])
+
+
+def test_statements_prepared_once_per_connection():
+    """Test statements are prepared on first use of each connection only."""
+    curs = Mock()
+    curs.rowcount = 1
+    for _ in range(3):
+        assert insert_row(curs, "request", (1, 2, "2025-05-14 12:33:35"))
+    merge_staging(curs, "request")
+    statements = [repr(c[0][0]) for c in curs.execute.call_args_list]
+    assert sum("PREPARE" in statement for statement in statements) == 2
+    assert len(statements) == 6
+
+    other = Mock()
+    insert_row(other, "request", (1, 2, "2025-05-14 12:33:35"))
+    assert "PREPARE" in repr(other.execute.call_args_list[0][0][0])
+
+
+def test_merge_staging_with_rollup():
+    """Test merge updates the rollup in the same statement and counts inserted rows."""
+    curs = Mock()
+    curs.fetchone.return_value = (3, )
+    with patch.dict("rollups.ROLLUPS", {"rating": True}):
+        assert merge_staging(curs, "rating") == 3
+    prepared = repr(curs.execute.call_args_list[0][0][0])
+    assert "merge_rollup_rating" in prepared and "rating_rollup" in prepared
+
+
+@mark.parametrize("rows", [[(1, 2, "2025-05-14 12:33:35")],
+                           DataFrame({"exhibition_id": [1], "rating_id": [2],
+                                      "event_at": [Timestamp("2025-05-14 12:33:35")]})])
+def test_copy_rows_formats(rows):
+    """Test tuples and DataFrames are copied as the same csv."""
+    curs = Mock()
+    copy_rows(curs, "rating", rows)
+    assert curs.copy_expert.call_args[0][1].getvalue().strip() == "1,2,2025-05-14 12:33:35"
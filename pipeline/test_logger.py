@@ -1,11 +1,13 @@
 # pylint:skip-file
 """Tests for logger module."""
 
-from unittest.mock import patch
+from unittest.mock import Mock, patch
+from threading import get_ident
 from pytest import mark
-from logging import StreamHandler, FileHandler
+from logging import StreamHandler, FileHandler, LogRecord, getLogger, DEBUG, INFO, ERROR
 
-from logger import get_logger
+from logger import (get_logger, stop_logging, log_summary, LISTENERS,
+                    SampleFilter, DeferredQueueHandler, is_sampled)
 
 
 @mark.parametrize("streaming, types", ((True, [StreamHandler, FileHandler]), (False, [StreamHandler])))
@@ -14,3 +16,69 @@ def test_get_logger_valid(streaming, types):
     handlers = get_logger(streaming).handlers
     for handler in handlers:
         assert type(handler) in types
+
+
+def make_record(level):
+    """Return a log record at level."""
+    return LogRecord("etl_logger.messages", level, __file__, 1, "MESSAGE", None, None)
+
+
+def test_sample_filter_keeps_one_in_n():
+    """Test info records are sampled and errors are always kept."""
+    sampler = SampleFilter(sample_rate=3)
+    kept = [sampler.filter(make_record(INFO)) for _ in range(7)]
+    assert kept == [True, False, False, True, False, False, True]
+    assert sampler.filter(make_record(ERROR))
+    (kept, dropped) = sampler.take_counts()
+    assert (kept["INFO"], dropped["INFO"], kept["ERROR"]) == (3, 4, 1)
+    assert sampler.take_counts() == ({}, {})
+
+
+def test_sample_filter_rate_limit():
+    """Test at most rate_limit records are kept each second."""
+    sampler = SampleFilter(rate_limit=2)
+    with patch("logger.monotonic", side_effect=[10.1, 10.2, 10.3, 11.0]):
+        kept = [sampler.filter(make_record(level)) for level in (INFO, INFO, ERROR, INFO)]
+    assert kept == [True, True, False, True]
+
+
+def test_is_sampled_counts_before_logging():
+    """Test is_sampled applies the sampler once and sampled records pass its filter."""
+    logger = getLogger("etl_logger.sampled_test")
+    logger.setLevel(INFO)
+    sampler = SampleFilter(sample_rate=2)
+    logger.addFilter(sampler)
+    assert [is_sampled(logger, INFO) for _ in range(3)] == [True, False, True]
+    assert not is_sampled(logger, DEBUG)
+    record = make_record(INFO)
+    record.sampled = True
+    assert sampler.filter(record)
+    (kept, dropped) = sampler.take_counts()
+    assert (kept["INFO"], dropped["INFO"]) == (2, 1)
+
+
+def test_log_summary():
+    """Test summaries count kept and dropped records by level."""
+    sampler = SampleFilter(sample_rate=2)
+    for _ in range(4):
+        sampler.filter(make_record(INFO))
+    with patch("logger.getLogger") as mock_get_logger:
+        log_summary(sampler, 5)
+        log_summary(sampler, 5)
+    mock_get_logger.return_value.info.assert_called_once_with(
+        "SUMMARY: %s messages logged in the last %ss, %s", 4, 5, "INFO 4 (2 not shown)")
+
+
+def test_get_logger_asynchronous():
+    """Test records are handled by the listener thread, flushed when logging stops."""
+    logger = get_logger(False, asynchronous=True)
+    assert [type(handler) for handler in logger.handlers] == [DeferredQueueHandler]
+    threads = []
+    handler = Mock(level=INFO)
+    handler.handle.side_effect = lambda record: threads.append(get_ident())
+    LISTENERS[0].handlers = (handler,)
+    logger.info("Queued %s", "record")
+    stop_logging()
+    record = handler.handle.call_args[0][0]
+    assert record.getMessage() == "Queued record"
+    assert threads and get_ident() not in threads
@@ -0,0 +1,42 @@
+# pylint:skip-file
+"""Tests for manifest module."""
+
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+from manifest import get_new_objects, record_objects
+
+
+def make_object(key, etag, size):
+    """Return an S3 object summary."""
+    return {'Key': key, 'ETag': etag, 'Size': size,
+            'LastModified': datetime(2025, 5, 14)}
+
+
+def test_get_new_objects_filters_unchanged():
+    """Test only new or changed objects are returned."""
+    conn = MagicMock()
+    curs = conn.cursor.return_value.__enter__.return_value
+    curs.fetchall.return_value = [("a.csv", '"1"', 10), ("b.csv", '"2"', 20)]
+    objects = [make_object("a.csv", '"1"', 10),
+               make_object("b.csv", '"3"', 20),
+               make_object("c.csv", '"4"', 30)]
+    actual = get_new_objects(conn, objects)
+    assert [o['Key'] for o in actual] == ["b.csv", "c.csv"]
+
+
+def test_record_objects_upserts():
+    """Test objects are written to the manifest and committed."""
+    conn = MagicMock()
+    with patch("manifest.execute_values") as mock_values:
+        record_objects(conn, [make_object("a.csv", '"1"', 10)])
+    assert mock_values.call_args[0][2] == [
+        ("a.csv", '"1"', 10, datetime(2025, 5, 14))]
+    conn.commit.assert_called_once()
+
+
+def test_record_objects_empty():
+    """Test nothing is written when there are no objects."""
+    conn = MagicMock()
+    record_objects(conn, [])
+    conn.cursor.assert_not_called()
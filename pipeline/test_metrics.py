@@ -0,0 +1,65 @@
+# pylint:skip-file
+"""Tests for metrics module."""
+
+from unittest.mock import Mock
+from urllib.request import urlopen
+from urllib.error import HTTPError
+from pytest import raises
+
+from confluent_kafka import TopicPartition
+
+from metrics import (Metric, Counter, Gauge, Histogram, Registry, update_consumer_lag,
+                     start_http_server, CONSUMER_LAG)
+
+
+def test_histogram_buckets_are_cumulative():
+    """Test observations are counted in every bucket at or above them."""
+    histogram = Histogram("test_seconds", "Test.", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value)
+    samples = dict(histogram.samples())
+    assert samples['test_seconds_bucket{le="0.1"}'] == 1
+    assert samples['test_seconds_bucket{le="1.0"}'] == 3
+    assert samples['test_seconds_bucket{le="+Inf"}'] == 4
+    assert samples["test_seconds_count"] == 4
+    assert histogram.snapshot()["sum"] == 6.05
+
+
+def test_registry_render_and_snapshot():
+    """Test every metric is rendered with its type and in the snapshot."""
+    registry = Registry()
+    registry.register(Counter("test_total", "Rows.")).inc(3)
+    registry.register(Gauge("test_lag", "Lag.")).set(7)
+    text = registry.render()
+    assert "# TYPE test_total counter\ntest_total 3\n" in text
+    assert "# TYPE test_lag gauge\ntest_lag 7\n" in text
+    assert registry.snapshot() == {"test_total": 3, "test_lag": 7}
+
+
+def test_update_consumer_lag():
+    """Test lag is summed over partitions, ignoring ones with no position."""
+    cons = Mock()
+    cons.position.return_value = [TopicPartition("lmnh", 0, 5),
+                                  TopicPartition("lmnh", 1, -1001)]
+    cons.get_watermark_offsets.return_value = (0, 12)
+    update_consumer_lag(cons)
+    assert CONSUMER_LAG.value == 7
+
+
+def test_http_server_serves_metrics():
+    """Test metrics are served on /metrics and other paths are not found."""
+    server = start_http_server(0)
+    try:
+        url = f"http://127.0.0.1:{server.server_port}"
+        with urlopen(f"{url}/metrics") as response:
+            assert "etl_rows_read_total" in response.read().decode()
+        with raises(HTTPError):
+            urlopen(f"{url}/other")
+    finally:
+        server.shutdown()
+
+
+def test_metric_is_abstract():
+    """Test a metric without samples and snapshot cannot be created."""
+    with raises(TypeError):
+        Metric("etl_rows", "Rows")
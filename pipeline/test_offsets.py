@@ -0,0 +1,60 @@
+# pylint:skip-file
+"""Tests for offsets module."""
+
+from unittest.mock import MagicMock, Mock, patch
+
+from confluent_kafka import TopicPartition, OFFSET_INVALID
+
+from offsets import StoredOffsets, get_on_assign, save_offsets, subscribe
+
+
+def test_on_assign_seeks_stored_offsets():
+    """Test assigned partitions start at their stored offset, others where they were."""
+    conn = MagicMock()
+    curs = conn.cursor.return_value.__enter__.return_value
+    curs.fetchall.return_value = [("lmnh", 0, 42)]
+    cons = Mock()
+    partitions = [TopicPartition("lmnh", 0), TopicPartition("lmnh", 1)]
+    get_on_assign(conn, "etl")(cons, partitions)
+    assigned = cons.assign.call_args[0][0]
+    assert [(p.partition, p.offset) for p in assigned] == [(0, 42), (1, OFFSET_INVALID)]
+    assert curs.execute.call_args[0][1] == ("etl", ["lmnh"])
+
+
+def test_save_offsets():
+    """Test offsets are upserted per partition, and nothing is written without any."""
+    curs = Mock()
+    with patch("offsets.execute_values") as mock_execute:
+        save_offsets(curs, StoredOffsets("etl", []))
+        mock_execute.assert_not_called()
+        save_offsets(curs, StoredOffsets("etl", [TopicPartition("lmnh", 2, 7)]))
+    assert mock_execute.call_args[0][2] == [("etl", "lmnh", 2, 7)]
+
+
+def test_subscribe_without_table():
+    """Test offsets are left to the broker when the database cannot store them."""
+    conn = MagicMock()
+    conn.cursor.return_value.__enter__.return_value.fetchall.return_value = []
+    cons = Mock()
+    assert not subscribe(cons, conn, "lmnh", "etl")
+    cons.subscribe.assert_called_once_with(["lmnh"])
+
+
+def test_subscribe_with_table():
+    """Test assigned partitions start from stored offsets when the table exists."""
+    conn = MagicMock()
+    conn.cursor.return_value.__enter__.return_value.fetchall.return_value = [(1,)]
+    cons = Mock()
+    assert subscribe(cons, conn, "lmnh", "etl")
+    assert "on_assign" in cons.subscribe.call_args.kwargs
+
+
+def test_on_assign_reads_offsets_with_run():
+    """Test stored offsets are read through run instead of on the subscribed connection."""
+    conn = MagicMock()
+    run = Mock(return_value={("lmnh", 0): 42})
+    cons = Mock()
+    get_on_assign(conn, "etl", run)(cons, [TopicPartition("lmnh", 0)])
+    assert run.call_args[0][1:] == ("etl", [TopicPartition("lmnh", 0)])
+    assert cons.assign.call_args[0][0][0].offset == 42
+    conn.cursor.assert_not_called()
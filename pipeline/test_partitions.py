@@ -0,0 +1,59 @@
+# pylint:skip-file
+"""Tests for partitions module."""
+
+from datetime import date, datetime
+from unittest.mock import MagicMock, patch
+
+from pandas import Series, Timestamp
+from pytest import fixture, mark
+
+from partitions import get_date, get_months, load_partitions, ensure_partitions
+
+
+@fixture(autouse=True)
+def partitions():
+    """Start every test with no known partitions."""
+    with patch.dict("partitions.PARTITIONS", clear=True):
+        yield
+
+
+@mark.parametrize("value", ["2025-05-14 12:33:35", "2025-05-14T12:33:35+01:00",
+                            datetime(2025, 5, 14, 12, 33), Timestamp("2025-05-14 12:33:35")])
+def test_get_date(value):
+    """Test dates are read from every timestamp type the loader writes."""
+    assert get_date(value) == date(2025, 5, 14)
+
+
+def test_get_months():
+    """Test every month in the range is returned across a year end."""
+    assert get_months(date(2024, 11, 30), date(2025, 1, 1)) == [
+        date(2024, 11, 1), date(2024, 12, 1), date(2025, 1, 1)]
+
+
+def test_load_partitions():
+    """Test months are read from partition names."""
+    curs = MagicMock()
+    curs.fetchall.side_effect = [[(1, )], [("rating_interaction_2025_04", ),
+                                           ("rating_interaction_default", )]]
+    assert load_partitions(curs, "rating_interaction") == {date(2025, 4, 1)}
+
+
+def test_ensure_partitions_creates_missing_once():
+    """Test missing months, including the day either side, are created once."""
+    conn = MagicMock()
+    curs = conn.cursor.return_value.__enter__.return_value
+    with patch("partitions.load_partitions", return_value={date(2025, 5, 1)}):
+        ensure_partitions(conn, "rating_interaction",
+                          Series([Timestamp("2025-05-14"), Timestamp("2025-05-31 23:00")]))
+        ensure_partitions(conn, "rating_interaction", ["2025-05-20 10:00:00"])
+    created = [c[0][1] for c in curs.execute.call_args_list if c[0][1][0].startswith("2025")]
+    assert created == [("2025-06-01 00:00:00+00", "2025-07-01 00:00:00+00")]
+
+
+def test_ensure_partitions_unpartitioned():
+    """Test nothing is created for tables that are not partitioned."""
+    conn = MagicMock()
+    with patch("partitions.load_partitions", return_value=None), \
+            patch("partitions.create_partition") as mock_create:
+        ensure_partitions(conn, "rating_interaction", ["2025-05-20 10:00:00"])
+    mock_create.assert_not_called()
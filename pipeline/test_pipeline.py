@@ -1,11 +1,33 @@
 # pylint:skip-file
 """Tests for pipeline script."""
 
-from pytest import mark
+from pytest import mark, raises, fixture
 from unittest.mock import Mock, patch, mock_open
 
+from argparse import Namespace
+from datetime import datetime, timezone
+
+from confluent_kafka import TopicPartition, OFFSET_INVALID
+
+from checkpoint import Checkpoint
+from recent import RecentEvents
+from extract import get_data_chunks
 from pipeline import (upload_data,
-                      input_row)
+                      upload_collated_file,
+                      upload_data_from_bucket,
+                      upload_data_from_cluster,
+                      input_row,
+                      get_arguments,
+                      run_stream_worker)
+
+
+@fixture(autouse=True)
+def plain_tables():
+    """Treat interaction tables as unpartitioned without rollups."""
+    with patch.dict("partitions.PARTITIONS",
+                    {"rating_interaction": None, "request_interaction": None}), \
+            patch.dict("rollups.ROLLUPS", {"rating": False, "request": False}):
+        yield
 
 
 @mark.parametrize("table, row, expected", [("rating", ["2025-05-14 12:33:35", 1, 2], True),
@@ -16,14 +38,39 @@ from pipeline import (upload_data,
                                            ("rating", ["2025-05-14 12:33:35", 1, -1, '0.0'], False)])
 def test_input_row_valid(table, row, expected):
     """Test case when input row recieves valid input."""
-    with patch("pipeline.is_duplicate") as mock_duplicate, patch("pipeline.get_cursor") as mock_cursor:
-        mock_duplicate.return_value = not expected
-        mock_cursor.fetchone.return_value = (1)
+    with patch("pipeline.get_cursor") as mock_cursor:
+        mock_curs = mock_cursor.return_value.__enter__.return_value
+        mock_curs.rowcount = int(expected)
         mock_conn = Mock()
-        actual = input_row(mock_conn, row, table)
+        actual = input_row(mock_conn, row, table, Mock())
     assert actual == expected
 
 
+def test_input_row_skips_recent_event():
+    """Test a redelivered event is skipped without touching the database."""
+    recent = RecentEvents()
+    cache = Mock()
+    cache.get_exhibition_id.return_value = 1
+    cache.get_value_id.return_value = 3
+    row = ["2025-05-14 12:33:35", "1", 2]
+    with patch("pipeline.get_cursor") as mock_cursor:
+        mock_cursor.return_value.__enter__.return_value.rowcount = 1
+        assert input_row(Mock(), row, "rating", cache, recent)
+        assert not input_row(Mock(), row, "rating", cache, recent)
+    assert mock_cursor.call_count == 1
+
+
+def test_input_row_retries_with_loader():
+    """Test a row insert is retried by the loader on a new connection."""
+    loader = Mock()
+    loader.run.return_value = True
+    row = ["2025-05-14 12:33:35", "1", 2]
+    with patch("pipeline.get_cursor") as mock_cursor:
+        assert input_row(Mock(), row, "rating", Mock(), loader=loader)
+    mock_cursor.assert_not_called()
+    assert loader.run.call_args[0][1] == "rating"
+
+
 @mark.parametrize("data, skip", [([["2025-05-14 12:33:35", 1, 2],
                                    ["2025-05-14 12:33:35", 1, 2],
                                    ["2025-05-14 12:33:35", 1, 2]], True),
@@ -45,3 +92,204 @@ def test_upload_data_valid(data, skip):
             mock_logger_instance.info.assert_called_with(
                 "%s Rows have been skipped.", len(data))
         mock_input.assert_called()
+
+
+def test_upload_data_checkpoints_with_row():
+    """Test a checkpoint is saved in the insert transaction of its row, or on its own
+    after a rejected row."""
+    data = [["2025-05-14 12:33:35", "1", "2"], ["2025-05-14 12:33:36", "1", "2"],
+            ["not a time", "1", "2"]]
+    manager = Mock()
+    conn = Mock()
+    conn.commit = manager.commit
+    start = Checkpoint("hist", 4)
+    with patch("pipeline.get_cursor"), patch("pipeline.Bar"), patch("pipeline.reject"), \
+            patch("pipeline.insert_row", manager.insert_row), \
+            patch("pipeline.save_checkpoint", manager.save_checkpoint):
+        upload_data(conn, data, Mock(), start, 2)
+    assert [c[0] for c in manager.mock_calls] == [
+        "insert_row", "commit", "insert_row", "save_checkpoint", "commit",
+        "save_checkpoint", "commit"]
+    assert [c[0][1].row_offset for c in manager.save_checkpoint.call_args_list] == [6, 7]
+
+
+@mark.parametrize("rows, recorded", [(None, True), (5, False)])
+def test_upload_data_from_bucket_incremental(rows, recorded):
+    """Test only new objects are loaded and recorded after a full load."""
+    args = Namespace(incremental=True, direct=True, async_engine=False, vectorized=False,
+                     rows=rows, bucket="test_bucket",
+                     batch_size=10, load_method="copy", shards=1,
+                     start=None, end=None, prefix=None)
+    new_objects = [{'Key': 'lmnh_hist_data_2.csv'}]
+    with patch("pipeline.get_client"), patch("pipeline.get_objects_from_bucket"), \
+            patch("pipeline.get_new_objects") as mock_new, \
+            patch("pipeline.stream_numbered_rows") as mock_stream, \
+            patch("pipeline.upload_batches"), \
+            patch("pipeline.record_objects") as mock_record:
+        mock_new.return_value = new_objects
+        upload_data_from_bucket(Mock(), args, Mock())
+    assert mock_stream.call_args[0][2] == ['lmnh_hist_data_2.csv']
+    assert mock_record.called == recorded
+
+
+def test_upload_data_from_bucket_window():
+    """Test a windowed load lists under the prefix, skips objects written before
+    the window and is not recorded in the manifest."""
+    args = Namespace(incremental=True, direct=True, async_engine=False, vectorized=False,
+                     rows=None, bucket="test_bucket", batch_size=10, load_method="copy",
+                     shards=1, start=datetime(2024, 1, 2, tzinfo=timezone.utc), end=None,
+                     prefix="lmnh_hist_data_1")
+    objects = [{'Key': 'lmnh_hist_data_1.csv',
+                'LastModified': datetime(2024, 1, 1, tzinfo=timezone.utc)},
+               {'Key': 'lmnh_hist_data_10.csv',
+                'LastModified': datetime(2024, 1, 3, tzinfo=timezone.utc)}]
+    with patch("pipeline.get_client"), \
+            patch("pipeline.get_objects_from_bucket", return_value=objects) as mock_list, \
+            patch("pipeline.get_new_objects", side_effect=lambda conn, o: o), \
+            patch("pipeline.stream_numbered_rows") as mock_stream, \
+            patch("pipeline.upload_batches"), \
+            patch("pipeline.record_objects") as mock_record:
+        upload_data_from_bucket(Mock(), args, Mock())
+    assert mock_list.call_args[0][2] == "lmnh_hist_data_1"
+    assert mock_stream.call_args[0][2] == ['lmnh_hist_data_10.csv']
+    assert mock_stream.call_args[0][3].start == args.start
+    mock_record.assert_not_called()
+
+
+def make_messages(count):
+    """Return mock kafka messages without errors."""
+    messages = [Mock() for _ in range(count)]
+    for message in messages:
+        message.error.return_value = None
+    return messages
+
+
+@mark.parametrize("rows, batch_size, loads", [(6, 3, 2), (5, 2, 3), (4, 10, 1)])
+def test_upload_data_from_cluster_batches(rows, batch_size, loads):
+    """Test messages are loaded in batches with offsets committed after each load."""
+    manager = Mock()
+    cons = manager.cons
+    cons.position.return_value = []
+    cons.consume.side_effect = lambda num_messages, timeout: make_messages(
+        num_messages)
+    with patch("pipeline.get_consumer", return_value=cons), \
+            patch("pipeline.load_batch", manager.load_batch), \
+            patch("pipeline.read_messages", side_effect=list), \
+            patch("pipeline.subscribe", return_value=False), \
+            patch.dict("pipeline.ENV", {"TOPIC": "lmnh", "GROUP": "etl"}):
+        manager.load_batch.return_value = (1, 0)
+        upload_data_from_cluster(Mock(), rows, Mock(), batch_size, 60)
+    assert manager.load_batch.call_count == loads
+    calls = [c[0] for c in manager.mock_calls if c[0] in
+             ("load_batch", "cons.commit")]
+    assert calls == ["load_batch", "cons.commit"] * loads
+    cons.close.assert_called_once()
+
+
+def test_upload_data_from_cluster_no_commit_on_failure():
+    """Test offsets are not committed when the database load fails."""
+    cons = Mock()
+    cons.consume.return_value = make_messages(2)
+    with patch("pipeline.get_consumer", return_value=cons), \
+            patch("pipeline.load_batch", side_effect=ValueError), \
+            patch("pipeline.read_messages", side_effect=list), \
+            patch("pipeline.subscribe", return_value=False), \
+            patch.dict("pipeline.ENV", {"TOPIC": "lmnh", "GROUP": "etl"}):
+        with raises(ValueError):
+            upload_data_from_cluster(Mock(), 2, Mock(), 2, 60)
+    cons.commit.assert_not_called()
+    cons.close.assert_called_once()
+
+
+def test_upload_data_from_cluster_stops_on_event():
+    """Test consumer closes without consuming once the stop event is set."""
+    cons = Mock()
+    stop = Mock()
+    stop.is_set.return_value = True
+    with patch("pipeline.get_consumer", return_value=cons), \
+            patch("pipeline.subscribe", return_value=False), \
+            patch.dict("pipeline.ENV", {"TOPIC": "lmnh", "GROUP": "etl"}):
+        upload_data_from_cluster(Mock(), None, Mock(), 10, 60, stop)
+    cons.consume.assert_not_called()
+    cons.close.assert_called_once()
+
+
+def test_upload_data_from_cluster_stores_offsets():
+    """Test consumer positions are stored with the batch when offsets are kept in the db."""
+    cons = Mock()
+    cons.consume.return_value = make_messages(2)
+    cons.position.return_value = [TopicPartition("lmnh", 0, 12),
+                                  TopicPartition("lmnh", 1, OFFSET_INVALID)]
+    cons.get_watermark_offsets.return_value = (0, 20)
+    with patch("pipeline.get_consumer", return_value=cons), \
+            patch("pipeline.load_batch", return_value=(2, 0)) as mock_load, \
+            patch("pipeline.read_messages", side_effect=list), \
+            patch("pipeline.subscribe", return_value=True), \
+            patch.dict("pipeline.ENV", {"TOPIC": "lmnh", "GROUP": "etl"}):
+        upload_data_from_cluster(Mock(), 2, Mock(), 2, 60)
+    offsets = mock_load.call_args.kwargs["offsets"]
+    assert offsets.group == "etl"
+    assert [(p.partition, p.offset) for p in offsets.partitions] == [(0, 12)]
+    cons.commit.assert_called_once()
+
+
+@fixture(name='history_file')
+def test_history_file(monkeypatch, tmp_path):
+    """Collated csv of 10 rows written to a temp data directory."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    lines = ["at,site,val,type"] + [f"2024-01-01 00:00:0{i},1,{i},"
+                                    for i in range(10)]
+    (tmp_path / "data" / "lmnh_hist_data.csv").write_text(
+        "\n".join(lines) + "\n", encoding="utf-8")
+
+
+@mark.parametrize("vectorized", [False, True])
+def test_upload_collated_file_resumes(history_file, vectorized):
+    """Test a resumed load starts after the checkpoint and checkpoints every batch."""
+    args = Namespace(bulk=True, vectorized=vectorized, file_format="csv",
+                     rows=None, batch_size=4, load_method="copy", shards=1)
+    first = next(get_data_chunks(6))
+    start = Checkpoint("hist", 6, None if vectorized else first[1])
+    loaded = []
+    with patch("pipeline.has_checkpoints", return_value=True), \
+            patch("pipeline.upload_batches",
+                  side_effect=lambda conn, batches, cache, method, load: loaded.extend(batches)), \
+            patch("pipeline.upload_frames",
+                  side_effect=lambda conn, frames, cache, method, checkpoint, load: loaded.extend(
+                      (frame.values.tolist(), checkpoint) for frame in frames)):
+        upload_collated_file(Mock(), args, Mock(), start)
+    assert [row[2] for rows, *_ in loaded for row in rows] == ["6", "7", "8", "9"]
+    if not vectorized:
+        assert [checkpoint.row_offset for _, checkpoint, _ in loaded] == [10]
+        assert loaded[-1][2] == [(0, "hist", 6)]
+        assert loaded[-1][1].byte_offset > start.byte_offset
+
+
+@mark.parametrize("argv", [["-R", "-d"], ["-R", "-a"],
+                          ["--shards", "2"], ["--shards", "2", "-B", "-V"],
+                          ["--shards", "2", "-d", "-a"], ["--shards", "2", "-B", "-R"]])
+def test_get_arguments_rejects_unsupported_combinations(argv):
+    """Test options a load mode would silently ignore are rejected."""
+    with patch("sys.argv", ["pipeline.py", "-b", "bucket"] + argv):
+        with raises(SystemExit):
+            get_arguments()
+
+
+def test_get_arguments_sharded_bulk():
+    """Test sharded bulk loads are accepted."""
+    with patch("sys.argv", ["pipeline.py", "-b", "bucket", "-B", "--shards", "2"]):
+        assert get_arguments().shards == 2
+
+
+def test_run_stream_worker_serves_metrics_per_worker():
+    """Test each stream worker serves its metrics on a port of its own."""
+    args = Namespace(metrics_port=9100, stats_interval=None, rows=None, batch_size=10,
+                     flush_interval=5.0, dedup_window=0)
+    with patch("pipeline.start_logging"), patch("pipeline.start_dead_letters"), \
+            patch("pipeline.get_connection"), patch("pipeline.get_loader"), \
+            patch("pipeline.upload_data_from_cluster"), patch("pipeline.close_sink"), \
+            patch("pipeline.stop_logging"), \
+            patch("pipeline.start_http_server") as mock_server:
+        run_stream_worker(args, 2, Mock())
+    mock_server.assert_called_once_with(9102)
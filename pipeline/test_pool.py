@@ -0,0 +1,61 @@
+# pylint:skip-file
+"""Tests for pool module."""
+
+from unittest.mock import Mock, patch
+from pytest import raises
+
+from psycopg2 import OperationalError
+
+from pool import LoaderPool, SingleConnectionPool
+
+
+def make_pool():
+    """Return a mock connection pool handing out open connections."""
+    pool = Mock()
+    pool.getconn.side_effect = lambda: Mock(closed=0)
+    return pool
+
+
+def test_load_returns_connection():
+    """Test connections are returned to the pool after a load."""
+    pool = make_pool()
+    with patch("pool.load_grouped", return_value=(3, 1)):
+        assert LoaderPool(pool, 2).load({"rating": []}) == (3, 1)
+    conn = pool.putconn.call_args[0][0]
+    pool.putconn.assert_called_once_with(conn, close=False)
+
+
+def test_load_retries_on_new_connection():
+    """Test a batch is retried on a fresh connection after a lost connection."""
+    pool = make_pool()
+    with patch("pool.load_grouped", side_effect=[OperationalError, (2, 0)]) as mock_load, \
+            patch("pool.sleep"):
+        assert LoaderPool(pool, 1).load({"rating": []}) == (2, 0)
+    first, second = [c[0][0] for c in mock_load.call_args_list]
+    assert first is not second
+    assert pool.putconn.call_args_list[0][1] == {"close": True}
+
+
+def test_load_gives_up_after_retries():
+    """Test the error is raised once every retry has failed."""
+    with patch("pool.load_grouped", side_effect=OperationalError) as mock_load, \
+            patch("pool.sleep"):
+        with raises(OperationalError):
+            LoaderPool(make_pool(), 1, retries=2).load({"rating": []})
+    assert mock_load.call_count == 3
+
+
+def test_single_connection_reconnects():
+    """Test a sequential loader keeps its connection until it is lost, then reconnects."""
+    first = Mock(closed=0)
+    connect = Mock(side_effect=lambda: Mock(closed=0))
+    loader = LoaderPool(SingleConnectionPool(connect, first), 1)
+    function = Mock(side_effect=[True, OperationalError, False])
+    with patch("pool.sleep"):
+        assert loader.run(function, "rating") is True
+        assert loader.run(function, "rating") is False
+    conns = [c[0][0] for c in function.call_args_list]
+    assert conns[:2] == [first, first]
+    assert conns[2] is not first
+    first.close.assert_called_once()
+    connect.assert_called_once()
@@ -0,0 +1,50 @@
+# pylint:skip-file
+"""Tests for recent module."""
+
+from datetime import datetime, timedelta
+
+from recent import RecentEvents, get_key
+
+
+def make_key(seconds, exhibition=1):
+    """Return key of a rating event seconds after midnight."""
+    return ("rating", exhibition, 3, datetime(2025, 5, 14) + timedelta(seconds=seconds))
+
+
+def test_get_key_parses_event_time():
+    """Test the same instant gives the same key whatever its offset."""
+    assert get_key("rating", (1, 3, "2025-05-14T12:00:00+01:00")) == \
+        get_key("rating", (1, 3, "2025-05-14T11:00:00+00:00"))
+
+
+def test_events_outside_window_are_evicted():
+    """Test events older than the window behind the newest are forgotten."""
+    recent = RecentEvents(window=60)
+    recent.add(make_key(0))
+    recent.add(make_key(30))
+    assert make_key(0) in recent
+    recent.add(make_key(90))
+    assert make_key(0) not in recent
+    assert make_key(30) in recent
+    recent.add(make_key(10))
+    assert make_key(10) not in recent
+
+
+def test_oldest_events_are_evicted_at_max_events():
+    """Test the index never holds more than max_events."""
+    recent = RecentEvents(window=600, max_events=2)
+    for exhibition in range(3):
+        recent.add(make_key(0, exhibition))
+    assert len(recent) == 2
+    assert make_key(0, 0) not in recent
+
+
+def test_split_removes_recent_rows():
+    """Test only rows not loaded recently are kept, counting the rest."""
+    recent = RecentEvents()
+    recent.add_grouped({"rating": [(1, 3, "2025-05-14T12:00:00")]})
+    (fresh, hits) = recent.split({"rating": [(1, 3, "2025-05-14T12:00:00"),
+                                             (2, 3, "2025-05-14T12:00:00")],
+                                  "request": []})
+    assert fresh == {"rating": [(2, 3, "2025-05-14T12:00:00")], "request": []}
+    assert hits == 1
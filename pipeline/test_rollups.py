@@ -0,0 +1,54 @@
+# pylint:skip-file
+"""Tests for rollups module."""
+
+from datetime import date
+from unittest.mock import MagicMock, patch
+
+from pytest import fixture, raises
+
+from rollups import has_rollup, rebuild_rollups, get_rollup_statement
+
+
+@fixture(autouse=True)
+def rollups():
+    """Start every test with no checked rollups."""
+    with patch.dict("rollups.ROLLUPS", clear=True):
+        yield
+
+
+def test_has_rollup_checked_once():
+    """Test the catalog is only queried on the first check of each table."""
+    curs = MagicMock()
+    curs.fetchall.return_value = [(1, )]
+    assert has_rollup(curs, "rating")
+    assert has_rollup(curs, "rating")
+    curs.execute.assert_called_once()
+
+
+def test_get_rollup_statement():
+    """Test inserted rows are returned to the rollup insert."""
+    statement = get_rollup_statement("INSERT INTO {table} VALUES ($1, $2, $3)")
+    assert "INSERT INTO {table} VALUES ($1, $2, $3)\n        RETURNING" in statement
+    assert "SELECT COUNT(*) FROM inserted" in statement
+
+
+def test_rebuild_rollups():
+    """Test each rollup is rebuilt and committed, skipping tables without one."""
+    conn = MagicMock()
+    curs = conn.cursor.return_value.__enter__.return_value
+    with patch.dict("rollups.ROLLUPS", {"rating": True, "request": False}):
+        rebuild_rollups(conn, date(2025, 5, 1))
+    statements = [repr(c[0][0]) for c in curs.execute.call_args_list]
+    assert ["LOCK" in s for s in statements] == [True, False, False]
+    assert all("rating_rollup" in s for s in statements[1:])
+    assert curs.execute.call_args[0][1] == {"since": date(2025, 5, 1)}
+    conn.commit.assert_called_once()
+
+
+def test_rebuild_rollups_rolls_back():
+    """Test a failed rebuild is rolled back and raised."""
+    conn = MagicMock()
+    conn.cursor.return_value.__enter__.return_value.execute.side_effect = ValueError
+    with patch.dict("rollups.ROLLUPS", {"rating": True}), raises(ValueError):
+        rebuild_rollups(conn)
+    conn.rollback.assert_called_once()
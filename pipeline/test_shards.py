@@ -0,0 +1,70 @@
+# pylint:skip-file
+"""Tests for shards module."""
+
+from unittest.mock import MagicMock, Mock, patch
+from pytest import mark, raises
+
+from loader import get_sourced_batches
+from shards import get_shard, route, upload_sharded
+
+
+def connect():
+    """Return a fake connection for a shard worker."""
+    return MagicMock()
+
+
+def count_rows(conn, grouped, method):
+    """Load nothing, counting every row as inserted."""
+    return sum(len(rows) for rows in grouped.values()), 0
+
+
+def fail_exhibition_one(conn, grouped, method):
+    """Fail any batch holding exhibition 1."""
+    if any(values[0] == 1 for rows in grouped.values() for values in rows):
+        raise ValueError("lost connection")
+    return count_rows(conn, grouped, method)
+
+
+def make_cache():
+    """Return a cache mapping site n to exhibition n."""
+    cache = Mock()
+    cache.get_exhibition_id.side_effect = int
+    cache.get_value_id.return_value = 3
+    return cache
+
+
+def make_rows(count):
+    """Return rating rows spread across sites and days."""
+    return [("lmnh_hist_data_0.csv", i,
+             [f"2025-05-{1 + i % 5:02} 12:00:{i % 60:02}", str(i % 6), "2", ""])
+            for i in range(count)]
+
+
+@mark.parametrize("shard_by", ["exhibition", "time"])
+def test_same_key_always_same_shard(shard_by):
+    """Test rows sharing a dedup key are routed to one shard."""
+    shards = [{"rating": [], "request": []} for _ in range(3)]
+    row = (4, 3, "2025-05-14 12:33:35")
+    route({"rating": [row, row], "request": [(4, 1, "2025-05-14 12:33:35")]},
+          shard_by, shards)
+    owner = get_shard(row, shard_by, 3)
+    assert shards[owner] == {"rating": [row, row], "request": [(4, 1, "2025-05-14 12:33:35")]}
+    assert sum(len(s["rating"]) for s in shards) == 2
+
+
+def test_upload_sharded_loads_every_row():
+    """Test every row is loaded once by the worker owning its shard."""
+    rows = make_rows(50)
+    with patch("shards.load_grouped", count_rows):
+        summaries = upload_sharded(get_sourced_batches(rows, 4), make_cache(), connect, 3, "exhibition", 4)
+    expected = [sum(int(row[1]) % 3 == shard for _, _, row in rows) for shard in range(3)]
+    assert [summary.inserted for summary in summaries] == expected
+    assert all(summary.error is None for summary in summaries)
+
+
+def test_upload_sharded_raises_on_failed_shard():
+    """Test a failing shard is reported once the other shards have finished."""
+    with patch("shards.load_grouped", fail_exhibition_one):
+        with raises(RuntimeError, match="1 shards failed: shard 1"):
+            upload_sharded(get_sourced_batches(make_rows(12), 2), make_cache(), connect, 3,
+                           "exhibition", 2)
@@ -0,0 +1,66 @@
+# pylint:skip-file
+"""Tests for supervisor module."""
+
+from multiprocessing import Event, Value
+from threading import Timer
+from time import sleep, monotonic
+from pytest import raises
+
+from supervisor import supervise
+
+
+def fail_twice(starts, number, stop):
+    """Worker that exits with an error until it has been started three times."""
+    with starts.get_lock():
+        starts.value += 1
+        count = starts.value
+    if count < 3:
+        raise SystemExit(1)
+
+
+def always_fail(starts, number, stop):
+    """Worker that always exits with an error."""
+    with starts.get_lock():
+        starts.value += 1
+    raise SystemExit(1)
+
+
+def run_until_stopped(stopped, number, stop):
+    """Worker that runs until the stop event is set."""
+    while not stop.is_set():
+        sleep(0.01)
+    with stopped.get_lock():
+        stopped.value += 1
+
+
+def test_supervise_restarts_failed_workers():
+    """Test failed workers are restarted until they finish cleanly."""
+    starts = Value('i', 0)
+    supervise(fail_twice, (starts,), 1, restart_delay=0.01)
+    assert starts.value == 3
+
+
+def test_supervise_backs_off_restarts():
+    """Test each restart of a failing worker waits twice as long as the last."""
+    starts = Value('i', 0)
+    started = monotonic()
+    supervise(fail_twice, (starts,), 1, restart_delay=0.1)
+    assert starts.value == 3
+    assert monotonic() - started >= 0.3
+
+
+def test_supervise_gives_up_after_max_restarts():
+    """Test workers are stopped and an error raised once a worker keeps failing."""
+    starts = Value('i', 0)
+    with raises(RuntimeError, match="worker-0 died 3 times"):
+        supervise(always_fail, (starts,), 1, restart_delay=0.01, max_restarts=2)
+    assert starts.value == 3
+
+
+def test_supervise_stops_all_workers():
+    """Test every worker is stopped cleanly when the stop event is set."""
+    stopped = Value('i', 0)
+    stop = Event()
+    Timer(0.3, stop.set).start()
+    supervise(run_until_stopped, (stopped,), 3, restart_delay=0.01, stop=stop)
+    assert stopped.value == 3
@@ -0,0 +1,105 @@
+# pylint:skip-file
+"""Tests for transform module."""
+
+from io import StringIO
+from unittest.mock import Mock, patch
+
+from pandas import DataFrame, Timestamp
+from pytest import fixture, mark
+
+from extract import TimeWindow, get_window_time
+from transform import (read_frames, limit_frames, filter_frames, transform_frame,
+                       parse_event_times)
+
+
+@fixture(name='cache')
+def test_cache():
+    """Mock dimension cache holding every dimension id."""
+    ids = {"rating": {0: 1, 1: 2, 2: 3, 3: 4, 4: 5},
+           "request": {0: 1, 1: 2},
+           "exhibition": {f"EXH_0{site}": site + 10 for site in range(6)}}
+    cache = Mock()
+    cache.get_ids.side_effect = ids.get
+    return cache
+
+
+@fixture(name='history_csv')
+def test_history_csv():
+    """Csv chunk holding valid and invalid rows."""
+    return StringIO("at,site,val,type\n"
+                    "2025-05-14 12:33:35,1,2,\n"
+                    "2025-05-14 12:33:36,5,-1,1.0\n"
+                    "2025-05-14 12:33:37,3,4,\n"
+                    "2025-05-14 12:33:38,9,4,\n"
+                    "not a time,1,4,\n"
+                    "2025-05-14 12:33:39,1,-1,7.0\n"
+                    "2025-05-14 12:33:40,0,7,\n")
+
+
+def test_transform_frame(history_csv, cache):
+    """Test rows are split by table with mapped ids and invalid rows dropped."""
+    (frame, ) = read_frames(history_csv)
+    (grouped, invalid) = transform_frame(frame, cache)
+    assert invalid == 4
+    assert grouped["rating"].values.tolist() == [
+        [11, 3, Timestamp("2025-05-14 12:33:35")],
+        [13, 5, Timestamp("2025-05-14 12:33:37")]]
+    assert grouped["request"].values.tolist() == [
+        [15, 2, Timestamp("2025-05-14 12:33:36")]]
+    assert list(grouped["request"].columns) == ["exhibition_id", "request_id", "event_at"]
+
+
+@mark.parametrize("row_number, expected", [(None, [3, 3, 1]), (4, [3, 1]), (3, [3])])
+def test_limit_frames(row_number, expected):
+    """Test frames are trimmed to the row limit."""
+    frames = [DataFrame({"a": range(size)}) for size in (3, 3, 1)]
+    assert [len(f) for f in limit_frames(frames, row_number)] == expected
+
+
+def test_read_frames_chunks(history_csv):
+    """Test csv is read in chunks of chunk_size rows."""
+    assert [len(f) for f in read_frames(history_csv, 3, 5)] == [3, 2]
+
+
+def test_transform_frame_rejects_invalid_rows(history_csv, cache):
+    """Test invalid rows are sent to the dead-letter sink with row number and reason."""
+    (frame, ) = read_frames(history_csv)
+    with patch("transform.reject") as mock_reject:
+        transform_frame(frame, cache)
+    assert [c[0][1:3] for c in mock_reject.call_args_list] == [
+        (3, "unknown site"), (4, "invalid timestamp"),
+        (5, "unknown value"), (6, "unknown value")]
+    assert mock_reject.call_args_list[1][0][3] == ["not a time", "1", "4", ""]
+
+
+def test_parse_event_times_accepts_iso_format():
+    """Test any iso format time parses to naive utc like the row path, others to NaT."""
+    times = parse_event_times(DataFrame({"at": [
+        "2025-05-14 12:33:35", "2025-05-14T12:33:36", "2025-05-14T14:33:37+02:00",
+        "2025-05-14", "not a time", ""]})["at"])
+    assert times.tolist()[:4] == [Timestamp("2025-05-14 12:33:35"), Timestamp("2025-05-14 12:33:36"),
+                                  Timestamp("2025-05-14 12:33:37"), Timestamp("2025-05-14")]
+    assert times.isna().tolist() == [False] * 4 + [True] * 2
+
+
+def test_filter_frames_in_window():
+    """Test rows outside the window are dropped and unparseable rows kept."""
+    frame = DataFrame({"at": ["2024-01-01 23:59:59", "2024-01-02 00:00:00", "bad",
+                              "2024-01-03 00:00:00"], "site": ["1"] * 4})
+    window = TimeWindow(get_window_time("2024-01-02T00:00:00+00:00"),
+                        get_window_time("2024-01-03"))
+    frames = list(filter_frames([frame, frame.iloc[:1]], window))
+    assert len(frames) == 1
+    assert list(frames[0]["at"]) == ["2024-01-02 00:00:00", "bad"]
+
+
+def test_filtered_frame_rejects_with_source_key(history_csv, cache):
+    """Test rejects of a filtered frame are keyed by source and row in the source."""
+    window = TimeWindow(get_window_time("2025-05-14 12:33:36"))
+    (frame, ) = filter_frames(read_frames(history_csv, 10, source_key="lmnh_hist_data_0.csv"),
+                              window)
+    with patch("transform.reject") as mock_reject:
+        transform_frame(frame, cache)
+    assert len(frame) == 6
+    assert [c[0][1] for c in mock_reject.call_args_list] == [
+        f"lmnh_hist_data_0.csv:{row}" for row in (3, 4, 5, 6)]
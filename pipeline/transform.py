@@ -0,0 +1,176 @@
+"""Vectorized transform of history data into columns ready to load."""
+
+from time import perf_counter
+from datetime import datetime, timezone
+from logging import getLogger
+from functools import partial
+from collections.abc import Iterable, Iterator
+
+from numpy import full, ndarray, where, clip, select
+from pandas import DataFrame, RangeIndex, Series, read_csv, to_datetime, to_numeric
+from psycopg2.extensions import connection
+from progress.counter import Counter
+
+from checkpoint import Checkpoint
+from dimensions import DimensionCache
+from extract import iter_parquet_batches, TimeWindow
+from loader import load_grouped, Load
+from deadletter import reject
+from metrics import ROWS_READ, ROWS_VALID, ROWS_INVALID, LOOKUP_SECONDS
+
+
+def parse_event_times(values: Series) -> Series:
+    """Return iso format event times as naive utc times, taking naive times to be
+    utc like the row path, NaT where a time cannot be parsed."""
+    return to_datetime(values, format='ISO8601', errors='coerce', utc=True).dt.tz_convert(None)
+
+
+def set_source(frame: DataFrame, source_key: str, first_row: int) -> DataFrame:
+    """Return frame indexed by row number in its source, named in its attrs."""
+    frame.index = RangeIndex(first_row, first_row + len(frame))
+    frame.attrs["source"] = source_key
+    return frame
+
+
+def read_frames(source, chunk_size: int = 10000, row_number: int = None,
+                start_row: int = 0, source_key: str = None) -> Iterator[DataFrame]:
+    """Yield DataFrames of at most chunk_size rows from a csv path or file,
+    indexed by row number in source_key."""
+    first_row = start_row
+    for frame in read_csv(source, chunksize=chunk_size, nrows=row_number,
+                          skiprows=range(1, start_row + 1) if start_row else None,
+                          dtype=str, keep_default_na=False):
+        yield set_source(frame, source_key, first_row)
+        first_row += len(frame)
+
+
+def read_parquet_frames(chunk_size: int = 10000, row_number: int = None,
+                        start_row: int = 0, source_key: str = None) -> Iterator[DataFrame]:
+    """Yield DataFrames of at most chunk_size rows from the collated parquet file,
+    indexed by row number in source_key."""
+    first_row = start_row
+    for batch in iter_parquet_batches(chunk_size, row_number, start_row):
+        yield set_source(batch.to_pandas(), source_key, first_row)
+        first_row += batch.num_rows
+
+
+def limit_frames(frames: Iterable[DataFrame], row_number: int = None) -> Iterator[DataFrame]:
+    """Yield frames until row_number rows have been yielded."""
+    remaining = row_number
+    for frame in frames:
+        if remaining is not None:
+            frame = frame.iloc[:remaining]
+            remaining -= len(frame)
+        if len(frame):
+            yield frame
+        if remaining == 0:
+            return
+
+
+def get_naive_utc(value: datetime) -> datetime:
+    """Return an aware window bound as a naive utc time comparable with parsed frames."""
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def filter_frames(frames: Iterable[DataFrame], window: TimeWindow = None) -> Iterator[DataFrame]:
+    """Yield the rows of frames with an event time in window, leaving rows that
+    cannot be parsed for validation to reject."""
+    for frame in frames:
+        if window is not None and window != TimeWindow():
+            event_at = parse_event_times(frame['at'])
+            keep = event_at.notna()
+            if window.start is not None:
+                keep &= event_at >= get_naive_utc(window.start)
+            if window.end is not None:
+                keep &= event_at < get_naive_utc(window.end)
+            frame = frame[keep | event_at.isna()]
+        if len(frame):
+            yield frame
+
+
+def get_lookup(ids: dict[int, int]) -> ndarray:
+    """Return array mapping each key to its id, -1 where there is no id."""
+    lookup = full(max(ids, default=0) + 1, -1)
+    for key, value in ids.items():
+        lookup[key] = value
+    return lookup
+
+
+def lookup_ids(lookup: ndarray, keys) -> ndarray:
+    """Return ids for an array of integer keys, -1 for unknown keys."""
+    keys = keys.to_numpy(dtype=float, na_value=-1)
+    known = (keys >= 0) & (keys < len(lookup)) & (keys % 1 == 0)
+    return where(known, lookup[clip(keys, 0, len(lookup) - 1).astype(int)], -1)
+
+
+def transform_frame(frame: DataFrame, cache: DimensionCache) -> tuple[dict[str, DataFrame], int]:
+    """Return (rows grouped by table, number of invalid rows) for a chunk."""
+    start = perf_counter()
+    sites = {int(public_id.removeprefix("EXH_0")): exh_id
+             for public_id, exh_id in cache.get_ids("exhibition").items()}
+    event_at = parse_event_times(frame['at'])
+    exhibition_id = lookup_ids(get_lookup(sites), to_numeric(frame['site'], errors='coerce'))
+    val = to_numeric(frame['val'], errors='coerce')
+    is_request = (val == -1).to_numpy()
+    value_id = where(is_request,
+                     lookup_ids(get_lookup(cache.get_ids("request")),
+                                to_numeric(frame['type'], errors='coerce')),
+                     lookup_ids(get_lookup(cache.get_ids("rating")), val))
+    valid = event_at.notna().to_numpy() & (exhibition_id != -1) & (value_id != -1)
+
+    grouped = {}
+    for table_name, mask in (('rating', valid & ~is_request), ('request', valid & is_request)):
+        grouped[table_name] = DataFrame({'exhibition_id': exhibition_id[mask],
+                                         f'{table_name}_id': value_id[mask],
+                                         'event_at': event_at[mask].to_numpy()})
+    LOOKUP_SECONDS.observe(perf_counter() - start)
+    invalid = int(len(frame) - valid.sum())
+    ROWS_VALID.inc(len(frame) - invalid)
+    ROWS_INVALID.inc(invalid)
+    if invalid:
+        reject_frame(frame[~valid], select([event_at.isna().to_numpy()[~valid],
+                                            exhibition_id[~valid] == -1],
+                                           ["invalid timestamp", "unknown site"],
+                                           "unknown value"))
+    return grouped, invalid
+
+
+def reject_frame(frame: DataFrame, reasons: ndarray) -> None:
+    """Send every row of frame to the dead-letter sink with its reason, keyed by
+    its source and row number when the frame was read from a named source."""
+    source = frame.attrs.get("source")
+    for (index, row), reason in zip(frame.iterrows(), reasons):
+        reject("rows", index if source is None else f"{source}:{index}", reason, row.tolist())
+
+
+def upload_frames(conn: connection, frames: Iterable[DataFrame], cache: DimensionCache,
+                  method: str = 'copy', checkpoint: Checkpoint = None,
+                  load: Load = None) -> tuple[int, int]:
+    """Transform and load each frame in its own transaction, return (inserted, skipped).
+
+    Given the checkpoint of the first frame, the row offset after each frame
+    is checkpointed with it. Frames are written with load when given, otherwise
+    with load_grouped on conn."""
+    logger = getLogger('etl_logger')
+    load = load or partial(load_grouped, conn)
+    inserted = 0
+    skipped = 0
+    invalid = 0
+    with Counter('Uploading Rows... ') as counter:
+        for frame in frames:
+            ROWS_READ.inc(len(frame))
+            (grouped, frame_invalid) = transform_frame(frame, cache)
+            if checkpoint is not None:
+                checkpoint = checkpoint._replace(row_offset=checkpoint.row_offset + len(frame),
+                                                 byte_offset=None)
+            (frame_inserted, frame_skipped) = load(grouped, method, checkpoint=checkpoint)
+            inserted += frame_inserted
+            skipped += frame_skipped
+            invalid += frame_invalid
+            counter.next(len(frame))
+    logger.info("%s Rows have been bulk loaded.", inserted)
+    if skipped:
+        logger.info("%s Rows have been skipped.", skipped)
+    if invalid:
+        logger.warning("%s Invalid rows have been dropped.", invalid)
+    return inserted, skipped